@@ -32,19 +32,10 @@ import pickle
 NS_PICKLE_MAX = 16384
 
 def make_pickle_packer(max_len=NS_PICKLE_MAX):
-    def pack_pickle(x):
-        return ns.pack(pickle.dumps(x), max_len=max_len)
-    return pack_pickle
+    return ns.make_packer(pickle.dumps, max_len=max_len)
 
 def make_pickle_unpacker(max_len=NS_PICKLE_MAX):
-    def unpack_pickle(x):
-        (payload, tail) = ns.unpack(x, max_len=max_len)
-        if payload is not None:
-            payload_obj = pickle.loads(payload) 
-            return (payload_obj, tail)
-        else:
-            return (None, x)
-    return unpack_pickle
+    return ns.make_unpacker(pickle.loads, max_len=max_len)
 
 
 nstream = ns.NsStream(fd,
@@ -0,0 +1,34 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+"""
+Many threads send requests to echo server through pool of connections,
+TCP handshake is paid only by the first requests.
+Must be used with echo server, e.g. server_echo_ns_reactor.py.
+
+python client_echo_ns_pool.py
+"""
+
+import threading
+
+from netstrings.pool import NsClientPool
+
+SERVER_ADDR = '127.0.0.1'
+SERVER_TCP_PORT = 9000 
+THREADS = 16
+REQUESTS = 100
+
+def worker(pool, n):
+    for i in range(REQUESTS):
+        req = 'thread {} request {}'.format(n, i)
+        with pool.connection((SERVER_ADDR, SERVER_TCP_PORT)) as nstream:
+            nstream.write(req)
+            assert nstream.read() == req
+
+if __name__ == '__main__':
+    with NsClientPool(max_size=4, timeout=10) as pool:
+        threads = [threading.Thread(target=worker, args=(pool, n)) for n in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(pool.stats())
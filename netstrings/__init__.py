@@ -19,8 +19,27 @@ Netstrings definition (from draft-bernstein-netstrings-02):
 Package provides low-level functions for create and parse netstrings from/to
 bytes, and high level API NsStream
 
-See help for: NsStream, pack, unpack, pack_str, unpack_str defined in this module.
+See help for: NsStream, NsDecoder, pack, unpack, pack_str, unpack_str, unpack_view,
+iter_unpack, unpack_all, pack_iov, write_iov, make_packer, make_unpacker defined in this module.
+
+Submodules:
+    netstrings.aio -- AsyncNsStream for asyncio.
+    netstrings.server -- asyncio server framework, NsProtocol.
+    netstrings.reactor -- selectors event-loop server, NsReactor.
+    netstrings.prefork -- multi-process SO_REUSEPORT server, NsPreforkServer.
+    netstrings.files -- netstring files, NsMmapReader, NsIndexWriter, NsIndexedFile, scan_parallel.
+    netstrings.batch -- batch envelopes of small messages, BatchWriter, BatchReader.
+    netstrings.records -- schema-driven record codec, RecordSchema.
+    netstrings.compress -- compressing packers and unpackers, zlib dictionaries.
+    netstrings.oob -- pickle protocol 5 with out-of-band buffers.
+    netstrings.pool -- thread-safe pool of client connections, NsClientPool.
+    netstrings.pipeline -- pipelined clients, NsPipelineClient, AsyncNsPipelineClient.
+    netstrings.rpc -- multiplexed RPC with request ids, NsRpcClient, NsRpcServer, serve_rpc.
+    netstrings.stats -- instrumentation of NsStream, NsStreamStats, REGISTRY.
+    netstrings.bench -- benchmarks, run as `python -m netstrings.bench`.
 """
 
-from .netstrings import pack, unpack, pack_str, unpack_str
+from .netstrings import pack, unpack, pack_str, unpack_str, unpack_view
+from .netstrings import iter_unpack, unpack_all, pack_iov, write_iov
+from .netstrings import make_packer, make_unpacker, NsDecoder
 from .netstrings import NsStream, NsError, NsMalformed, NsStreamUnexpectedEnd  
@@ -0,0 +1,245 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Stream of netstring messages for asyncio.
+
+AsyncNsStream is the same as NsStream, but works over asyncio
+StreamReader/StreamWriter pair, so single event loop can serve many
+connections without thread per connection.
+"""
+
+import asyncio
+
+from .netstrings import (STREAM_MAX_READ, NsDecoder, NsStreamUnexpectedEnd,
+        hex_fragment, pack_iov, pack_str_strict, unpack_str_strict)
+
+class AsyncNsStream:
+    """
+    Stream of netstring messages over asyncio streams.
+
+    Attributes
+    ----------
+    reader : asyncio.StreamReader
+        Source of netstrings.
+    writer : asyncio.StreamWriter
+        Destination of netstrings.
+    pack_f
+        Packer function, see `NsStream`.
+    unpack_f
+        Unpacker function, see `NsStream`.
+    max_read : int
+        Default size of bytes for single read operation from `reader`.
+    buff : bytes
+        Internal buffer for custom `unpack_f`, see `NsStream`.
+    decoder : NsDecoder or None
+        Incremental parser used when `unpack_f` was made by `make_unpacker`.
+
+    Methods
+    -------
+    write(payload)
+        Coroutine, converts payload to netstring, writes it and waits for `drain()`.
+    write_nowait(payload)
+        Converts payload to netstring and writes it without backpressure.
+    write_many(payloads)
+        Coroutine, writes many netstrings and waits for `drain()`.
+    drain()
+        Coroutine, waits until write buffer of `writer` is flushed enough.
+    read()
+        Coroutine, reads netstring and unpacks it using `unpack_f`.
+    close()
+        Coroutine, closes `writer`.
+    __aiter__()
+        Python's asynchronous iterator protocol support.
+    __anext__()
+        Python's asynchronous iterator protocol support.
+
+    >>> async def demo():
+    ...     reader = asyncio.StreamReader()
+    ...     reader.feed_data(b'3:abc,3:d')
+    ...     reader.feed_data(b'ef,')
+    ...     reader.feed_eof()
+    ...     nstream = AsyncNsStream(reader, None)
+    ...     return [x async for x in nstream]
+    >>> asyncio.run(demo())
+    ['abc', 'def']
+
+    """
+    def __init__(self, reader, writer, max_read=STREAM_MAX_READ, pack_f=pack_str_strict, unpack_f=unpack_str_strict):
+        self.reader = reader
+        self.writer = writer
+        self.pack_f = pack_f
+        self.unpack_f = unpack_f
+        self.max_read = max_read
+        self.buff = b''
+        self.eof = False
+        self.buff_processed = False
+        if hasattr(unpack_f, 'decode_f'):
+            self.decoder = NsDecoder(max_len=unpack_f.max_len, size=max_read)
+            self.decode_f = unpack_f.decode_f
+        else:
+            self.decoder = None
+            self.decode_f = None
+
+    def write_nowait(self, payload):
+        """Converts payload to netstring and writes it to `writer` without backpressure.
+
+        Returns
+        -------
+        int
+            Number of written bytes.
+
+        """
+        ns = self.pack_f(payload)
+        self.writer.write(ns)
+        return len(ns)
+
+    async def write(self, payload):
+        """Converts payload to netstring, writes it to `writer` and waits for `drain()`.
+
+        Returns
+        -------
+        int
+            Number of written bytes.
+
+        """
+        n = self.write_nowait(payload)
+        await self.writer.drain()
+        return n
+
+    async def write_many(self, payloads):
+        """Converts payloads to netstrings, writes them and waits for `drain()`.
+
+        If `pack_f` was made by `make_packer` payloads are passed to `writer`
+        as segments without concatenation, see `pack_iov`.
+
+        Returns
+        -------
+        int
+            Number of written bytes.
+
+        """
+        pack_f = self.pack_f
+        if hasattr(pack_f, 'encode_f'):
+            encode_f = pack_f.encode_f
+            segments = []
+            for payload in payloads:
+                if encode_f is not None:
+                    payload = encode_f(payload)
+                segments.extend(pack_iov(payload, max_len=pack_f.max_len))
+        else:
+            segments = [pack_f(payload) for payload in payloads]
+        self.writer.writelines(segments)
+        await self.writer.drain()
+        return sum([len(seg) for seg in segments])
+
+    async def drain(self):
+        """Waits until write buffer of `writer` is flushed enough.
+        """
+        await self.writer.drain()
+
+    async def read(self):
+        """Reads netstring from `reader`, unpacks it using `unpack_f` and returns to caller.
+
+        Returns
+        -------
+        None
+            `reader` reach EOF and internal buffer is empty.
+        Any object
+            The result of parsing netstring and unpacking it by `unpack_f`.
+
+        """
+        if self.buff_processed:
+            return None
+        if self.decoder is not None:
+            payload = self.decoder.next_frame()
+            while payload is None and not self.eof:
+                raw_b = await self.reader.read(self.max_read)
+                if raw_b == b'':
+                    self.eof = True
+                else:
+                    self.decoder.feed(raw_b)
+                    payload = self.decoder.next_frame()
+            if payload is not None:
+                if self.decode_f is not None:
+                    return self.decode_f(payload)
+                return payload
+            if self.decoder.pending() == 0:
+                self.buff_processed = True
+                return None
+            fragment = self.decoder._fragment()
+        else:
+            (payload, tail) = self.unpack_f(self.buff)
+            while payload is None and not self.eof:
+                raw_b = await self.reader.read(self.max_read)
+                if raw_b == b'':
+                    self.eof = True
+                self.buff += raw_b
+                (payload, tail) = self.unpack_f(self.buff)
+            if payload is not None:
+                self.buff = tail
+                return payload
+            if self.buff == b'':
+                self.buff_processed = True
+                return None
+            fragment = '{} HEX:{}'.format(repr(self.buff[0:8]), hex_fragment(self.buff[0:8]))
+        raise NsStreamUnexpectedEnd('Unexpected end of byte stream. Buffer fragment (at begin):{}'.format(
+                    fragment))
+
+    async def close(self):
+        """Closes `writer` and waits until it is closed.
+        """
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    def __aiter__(self):
+        # the same single iteration context as NsStream
+        return self
+
+    async def __anext__(self):
+        res = await self.read()
+        if res is not None:
+            return res
+        else:
+            raise StopAsyncIteration
+
+async def open_connection(host, port, max_read=STREAM_MAX_READ, pack_f=pack_str_strict, unpack_f=unpack_str_strict, **kwargs):
+    """Opens TCP connection and returns AsyncNsStream over it.
+
+    Parameters
+    ----------
+    host, port
+        Server address, see `asyncio.open_connection`.
+    kwargs
+        Passed to `asyncio.open_connection`.
+
+    Returns
+    -------
+    AsyncNsStream
+
+    Echo round-trip of 4 MB, writer waits in `drain()` and server pauses
+    reading while reader is behind:
+
+    >>> from netstrings.server import serve
+    >>> async def demo():
+    ...     async def echo(conn, obj):
+    ...         return obj
+    ...     server = await serve(echo, '127.0.0.1', 0, max_queue=1)
+    ...     port = server.sockets[0].getsockname()[1]
+    ...     nstream = await open_connection('127.0.0.1', port)
+    ...     async def send():
+    ...         for i in range(100):
+    ...             await nstream.write_many(['x' * 4000] * 10)
+    ...     async def receive():
+    ...         return sum([len(await nstream.read()) for i in range(1000)])
+    ...     (sent, received) = await asyncio.gather(send(), receive())
+    ...     await nstream.close()
+    ...     server.close()
+    ...     await server.wait_closed()
+    ...     return received
+    >>> asyncio.run(demo())
+    4000000
+
+    """
+    (reader, writer) = await asyncio.open_connection(host, port, **kwargs)
+    return AsyncNsStream(reader, writer, max_read=max_read, pack_f=pack_f, unpack_f=unpack_f)
@@ -0,0 +1,328 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Batch envelope for many small messages.
+
+Batch envelope is netstring whose payload is a run of netstrings, e.g.
+`12:1:a,2:bc,0:,,`. Length header, parsing and Python call for every
+small message are amortized by the whole batch. Peer that does not know
+about batches receives envelope as single opaque payload.
+
+    with BatchWriter(fd, max_items=100, max_delay=0.01) as writer:
+        for msg in messages:
+            writer.write(msg)
+
+    for msg in BatchReader(fd):
+        print(msg)
+"""
+
+import time
+
+from .netstrings import (NS_MAX_LEN, STREAM_MAX_READ, NsMalformed, NsStream,
+        hex_fragment, make_unpacker, pack_iov, unpack_all, write_iov)
+
+# Default maximum number of messages in single batch envelope
+BATCH_MAX_ITEMS = 256
+
+def pack_batch(payloads, max_len=NS_MAX_LEN):
+    """Packing many payloads to single batch envelope.
+
+    Parameters
+    ----------
+    payloads : iterable of bytes-like objects
+        Payloads to be packed.
+    max_len : int
+        Maximum payload length of envelope, see `pack`.
+
+    Returns
+    -------
+    bytes
+        Envelope netstring.
+
+    >>> pack_batch([b'a', b'bc', b''])
+    b'12:1:a,2:bc,0:,,'
+
+    """
+    segments = []
+    for payload in payloads:
+        segments.extend(pack_iov(payload, max_len=max_len))
+    body = b''.join(segments)
+    return b''.join(pack_iov(body, max_len=max_len))
+
+def unpack_batch(envelope, max_len=NS_MAX_LEN):
+    """Unpacking payload of batch envelope to list of payloads.
+
+    Parameters
+    ----------
+    envelope : bytes-like object
+        Payload of envelope netstring.
+    max_len : int
+        Maximum length of single payload, see `unpack`.
+
+    Returns
+    -------
+    list
+        Payloads as bytes.
+
+    >>> unpack_batch(b'1:a,2:bc,0:,')
+    [b'a', b'bc', b'']
+
+    >>> unpack_batch(b'1:a,2:b')  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    NsMalformed: Incomplete netstring in batch envelope. Buffer fragment (at begin):b'2:b' HEX:32 3A 62
+
+    """
+    (payloads, offset) = unpack_all(envelope, max_len=max_len)
+    if offset != len(envelope):
+        fragment = bytes(envelope[offset:offset+8])
+        raise NsMalformed('Incomplete netstring in batch envelope. Buffer fragment (at begin):{} HEX:{}'.format(
+                    repr(fragment), hex_fragment(fragment)))
+    return payloads
+
+class BatchWriter:
+    """
+    Writer that collects messages to batch envelopes.
+
+    Batch is closed and written when it has `max_items` messages, when
+    the next message does not fit into `max_bytes`, or by `write()` or
+    `flush_expired()` when the oldest message of batch waits for
+    `max_delay` seconds or longer. Other cases require explicit `flush()`,
+    it is also called on exit from `with` block.
+
+    Attributes
+    ----------
+    fd : file-like object in binary mode or socket
+        Destination of envelopes, see `write_iov`.
+    encode_f
+        Function that converts message to bytes-like object,
+        None means that messages are bytes-like objects.
+    max_items : int
+        Maximum number of messages in envelope.
+    max_bytes : int
+        Maximum payload length of envelope, it must not be greater than
+        `max_len` of receiver.
+    max_delay : float or None
+        Age of batch, seconds, after which it is written by the next
+        `write()` or `flush_expired()`. There is no timer: it is not a
+        latency bound, writer that waits for something else (e.g. for
+        response) must call `flush_expired()` or `flush()` before it.
+    on_flush
+        Function `on_flush(items, nbytes)` that is called after every flush.
+
+    Methods
+    -------
+    write(msg)
+        Appends message to current batch.
+    flush()
+        Writes current batch as single envelope.
+    flush_expired()
+        Writes current batch if it waits for `max_delay` or longer.
+
+    >>> from io import BytesIO
+    >>> b_stream = BytesIO()
+    >>> writer = BatchWriter(b_stream, encode_f=str.encode, max_items=2)
+    >>> (writer.write('a'), writer.write('bc'), writer.write('d'))
+    (4, 5, 4)
+    >>> writer.flush()
+    (1, 7)
+    >>> b_stream.getvalue()
+    b'9:1:a,2:bc,,4:1:d,,'
+
+    """
+    def __init__(self, fd, encode_f=None, max_items=BATCH_MAX_ITEMS, max_bytes=NS_MAX_LEN, max_delay=None,
+                on_flush=None):
+        self.fd = fd
+        self.encode_f = encode_f
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self.segments = []
+        self.items = 0
+        self.nbytes = 0
+        self.started = None
+
+    def write(self, msg):
+        """Appends message to current batch, writes batch if it is closed.
+
+        Returns
+        -------
+        int
+            Size of message netstring inside envelope.
+
+        Raises
+        ------
+        NsMalformed
+            Message alone does not fit into `max_bytes`.
+
+        """
+        payload = msg if self.encode_f is None else self.encode_f(msg)
+        segments = pack_iov(payload, max_len=self.max_bytes)
+        n = len(segments[0]) + (len(payload) if isinstance(payload, bytes) else memoryview(payload).nbytes) + 1
+        if self.items and self.nbytes + n > self.max_bytes:
+            self.flush()
+        if not self.items:
+            self.started = time.monotonic()
+        self.segments.extend(segments)
+        self.items += 1
+        self.nbytes += n
+        if self.items >= self.max_items or self.nbytes >= self.max_bytes:
+            self.flush()
+        elif self.max_delay is not None and time.monotonic() - self.started >= self.max_delay:
+            self.flush()
+        return n
+
+    def flush(self):
+        """Writes current batch as single envelope.
+
+        Blocking call.
+
+        Returns
+        -------
+        tuple (int, int)
+            Number of messages and number of written bytes.
+
+        """
+        if not self.items:
+            return (0, 0)
+        segments = [b'%d:' % self.nbytes]
+        segments.extend(self.segments)
+        segments.append(b',')
+        items = self.items
+        self.segments = []
+        self.items = 0
+        self.nbytes = 0
+        self.started = None
+        nbytes = write_iov(self.fd, segments)
+        if self.on_flush is not None:
+            self.on_flush(items, nbytes)
+        return (items, nbytes)
+
+    def flush_expired(self):
+        """Writes current batch if its oldest message waits for `max_delay` seconds or longer.
+
+        Blocking call if batch is written.
+
+        Returns
+        -------
+        tuple (int, int)
+            Number of messages and number of written bytes, (0, 0) if
+            batch is not written.
+
+        >>> from io import BytesIO
+        >>> writer = BatchWriter(BytesIO(), max_delay=60)
+        >>> writer.write(b'a')
+        4
+        >>> writer.flush_expired()
+        (0, 0)
+        >>> writer.max_delay = 0
+        >>> writer.flush_expired()
+        (1, 7)
+
+        """
+        if self.items and self.max_delay is not None and time.monotonic() - self.started >= self.max_delay:
+            return self.flush()
+        return (0, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+class BatchReader:
+    """
+    Reader of messages from batch envelopes.
+
+    Envelopes are parsed by NsStream, messages are returned one by one
+    as if every message was sent as separate netstring.
+
+    Attributes
+    ----------
+    nstream : NsStream
+        Stream of envelopes.
+    decode_f
+        Function that converts payload bytes to message,
+        None means that messages are bytes.
+    max_len : int
+        Maximum payload length of envelope.
+
+    Methods
+    -------
+    read()
+        Returns the next message.
+    read_batch()
+        Returns all messages of the next envelope.
+    __iter__()
+        Python's Iterator protocol support.
+    __next__()
+        Python's Iterator protocol support.
+
+    >>> from io import BytesIO
+    >>> b_stream = BytesIO(pack_batch([b'a', b'bc']) + pack_batch([b'd']))
+    >>> list(BatchReader(b_stream, decode_f=bytes.decode))
+    ['a', 'bc', 'd']
+
+    """
+    def __init__(self, fd, decode_f=None, max_len=NS_MAX_LEN, max_read=STREAM_MAX_READ):
+        # envelopes are not copied, they are unpacked in receive buffer
+        self.nstream = NsStream(fd, max_read=max_read, unpack_f=make_unpacker(max_len=max_len), views=True)
+        self.decode_f = decode_f
+        self.max_len = max_len
+        self.pending = []
+        self.next_item = 0
+
+    def read_batch(self):
+        """Reads the next envelope and returns all its messages.
+
+        Blocking call.
+
+        Returns
+        -------
+        list
+            Messages, empty list if `fd` reach EOF.
+
+        """
+        payloads = []
+        while not payloads:
+            envelope = self.nstream.read()
+            if envelope is None:
+                return []
+            payloads = unpack_batch(envelope, max_len=self.max_len)
+        if self.decode_f is None:
+            return payloads
+        return [self.decode_f(payload) for payload in payloads]
+
+    def read(self):
+        """Returns the next message.
+
+        Blocking call.
+
+        Returns
+        -------
+        None
+            `fd` reach EOF.
+        Any object
+            Message.
+
+        """
+        if self.next_item == len(self.pending):
+            self.pending = self.read_batch()
+            self.next_item = 0
+            if not self.pending:
+                return None
+        msg = self.pending[self.next_item]
+        self.next_item += 1
+        return msg
+
+    def __iter__(self):
+        # single iteration context, see NsStream
+        return self
+
+    def __next__(self):
+        msg = self.read()
+        if msg is not None:
+            return msg
+        else:
+            raise StopIteration
@@ -0,0 +1,383 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Benchmarks of netstrings packing, unpacking and NsStream transports.
+
+Every case is timed message by message: throughput (msgs/s, MB/s of
+payload) and latency percentiles (p50, p99 in microseconds) are printed
+as JSON lines, one object per case. Results can be saved and later runs
+compared with them, exit status is 1 when some case became slower than
+baseline by more than threshold.
+
+    python -m netstrings.bench --save baseline.json
+    python -m netstrings.bench --baseline baseline.json --threshold 0.1
+    python -m netstrings.bench --filter stream --sizes 0,4096 --format table
+
+Cases:
+    pack, unpack, pack_str, unpack_str -- functions over bytes in memory.
+    stream_write, stream_read -- NsStream over BytesIO, socketpair and
+        loopback TCP; the other end is raw socket served by thread.
+    stream_read over 'fragmented' transport -- every netstring arrives
+        in two parts split at random offset, like
+        server_echo_stream_delay.py does.
+    codec_pack, codec_unpack -- pickle and JSON packers of dict with
+        str field of payload size.
+"""
+
+import argparse
+from io import BytesIO
+import json
+import os
+import pickle
+import random
+import socket
+import sys
+import threading
+import time
+
+from .netstrings import NsStream, make_packer, make_unpacker, pack, pack_str, unpack, unpack_str
+
+# Default payload sizes, bytes
+BENCH_SIZES = [0, 16, 256, 4096, 65536, 1 << 20, 8 << 20]
+
+# Default total payload bytes of single case, number of messages is
+# BENCH_BYTES / size clamped to [BENCH_MIN_MSGS, BENCH_MAX_MSGS]
+BENCH_BYTES = 32 << 20
+BENCH_MIN_MSGS = 10
+BENCH_MAX_MSGS = 20000
+
+# Default number of measurements of case, the fastest one is reported
+BENCH_REPEAT = 1
+
+# Default relative slowdown of msgs/s that is reported as regression
+BENCH_THRESHOLD = 0.1
+
+# length header and terminator are not counted by max_len of unpack,
+# but are counted by pack
+_MAX_LEN_EXTRA = 32
+
+def percentile(samples, q):
+    """Percentile of sorted samples by nearest rank.
+
+    Parameters
+    ----------
+    samples : list
+        Sorted samples.
+    q : float
+        Percentile, 0-100.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+
+    """
+    if not samples:
+        return 0.0
+    rank = max(0, int(-(-q * len(samples) // 100)) - 1)
+    return samples[min(rank, len(samples) - 1)]
+
+def measure(op, count, size):
+    """Calls `op()` `count` times and times every call.
+
+    Parameters
+    ----------
+    op
+        Function that processes single message.
+    count : int
+        Number of messages.
+    size : int
+        Payload size of message, bytes.
+
+    Returns
+    -------
+    dict
+        Keys: msgs, seconds, msgs_s, mb_s, p50_us, p99_us.
+
+    >>> result = measure(lambda: None, 100, 1000)
+    >>> (result['msgs'], result['mb_s'] > 0)
+    (100, True)
+
+    """
+    perf_counter = time.perf_counter
+    samples = []
+    for i in range(count):
+        started = perf_counter()
+        op()
+        samples.append(perf_counter() - started)
+    seconds = sum(samples)
+    samples.sort()
+    # timer resolution bounds too fast operations
+    seconds = max(seconds, 1e-9)
+    return {
+        'msgs': count,
+        'seconds': seconds,
+        'msgs_s': count / seconds,
+        'mb_s': count * size / seconds / 1e6,
+        'p50_us': percentile(samples, 50) * 1e6,
+        'p99_us': percentile(samples, 99) * 1e6,
+    }
+
+def _payload(size):
+    return os.urandom(size)
+
+def _record(size):
+    return {'id': 1, 'tags': ['a', 'b'], 'data': 'x' * size}
+
+def _feed(sock, ns, count, fragmented):
+    # writes `count` copies of netstring, every copy in two parts when fragmented
+    try:
+        for i in range(count):
+            if fragmented:
+                cut = random.randint(0, len(ns))
+                sock.sendall(ns[:cut])
+                sock.sendall(ns[cut:])
+            else:
+                sock.sendall(ns)
+    except OSError:
+        pass
+
+def _drain(sock):
+    # reads and drops everything until EOF
+    try:
+        while sock.recv(1 << 20):
+            pass
+    except OSError:
+        pass
+
+def _connect(transport):
+    # pair of connected sockets (local, remote)
+    if transport == 'tcp':
+        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_sock.bind(('127.0.0.1', 0))
+        server_sock.listen(1)
+        local = socket.create_connection(server_sock.getsockname())
+        (remote, addr) = server_sock.accept()
+        server_sock.close()
+        for sock in (local, remote):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return (local, remote)
+    return socket.socketpair()
+
+# Every group makes cases for payload size, `count` is the number of
+# calls of every case (stream reads need exactly that many netstrings)
+
+def bench_functions(size, count):
+    """Cases of pack, unpack, pack_str, unpack_str.
+    """
+    payload = _payload(size)
+    max_len = size + _MAX_LEN_EXTRA
+    ns = pack(payload, max_len=max_len)
+    s = 'x' * size
+    ns_str = pack_str(s, max_len=max_len)
+    yield ('pack', 'memory', lambda: pack(payload, max_len=max_len))
+    yield ('unpack', 'memory', lambda: unpack(ns, max_len=max_len))
+    yield ('pack_str', 'memory', lambda: pack_str(s, max_len=max_len))
+    yield ('unpack_str', 'memory', lambda: unpack_str(ns_str, max_len=max_len))
+
+def bench_bytesio(size, count):
+    """Cases of NsStream write and read over BytesIO.
+    """
+    payload = _payload(size)
+    max_len = size + _MAX_LEN_EXTRA
+    pack_f = make_packer(max_len=max_len)
+    unpack_f = make_unpacker(max_len=max_len)
+    nstream = NsStream(BytesIO(), pack_f=pack_f, unpack_f=unpack_f)
+    yield ('stream_write', 'bytesio', lambda: nstream.write(payload))
+    nstream = NsStream(BytesIO(pack_f(payload) * count), pack_f=pack_f, unpack_f=unpack_f)
+    yield ('stream_read', 'bytesio', nstream.read)
+
+def bench_sockets(size, count, transports=('socketpair', 'tcp', 'fragmented')):
+    """Cases of NsStream write and read over sockets.
+
+    Remote end is served by thread: it drains written netstrings or
+    feeds netstrings to be read.
+    """
+    payload = _payload(size)
+    max_len = size + _MAX_LEN_EXTRA
+    pack_f = make_packer(max_len=max_len)
+    unpack_f = make_unpacker(max_len=max_len)
+    for transport in transports:
+        if transport != 'fragmented':
+            (local, remote) = _connect(transport)
+            thread = threading.Thread(target=_drain, args=(remote,), daemon=True)
+            thread.start()
+            nstream = NsStream(local.makefile('rwb', buffering=0), pack_f=pack_f, unpack_f=unpack_f)
+            try:
+                yield ('stream_write', transport, lambda: nstream.write(payload))
+            finally:
+                local.shutdown(socket.SHUT_WR)
+                thread.join()
+                nstream.fd.close()
+                local.close()
+                remote.close()
+        (local, remote) = _connect('socketpair' if transport == 'fragmented' else transport)
+        thread = threading.Thread(target=_feed, args=(remote, pack_f(payload), count, transport == 'fragmented'),
+                    daemon=True)
+        thread.start()
+        nstream = NsStream(local.makefile('rwb', buffering=0), pack_f=pack_f, unpack_f=unpack_f)
+        try:
+            yield ('stream_read', transport, nstream.read)
+        finally:
+            # feeder blocked by skipped or unfinished case fails
+            local.shutdown(socket.SHUT_RDWR)
+            thread.join()
+            nstream.fd.close()
+            local.close()
+            remote.close()
+
+def bench_codecs(size, count):
+    """Cases of pickle and JSON packers and unpackers.
+    """
+    obj = _record(size)
+    max_len = size + 2 * _MAX_LEN_EXTRA + 64
+    codecs = [
+        ('pickle', make_packer(pickle.dumps, max_len=max_len), make_unpacker(pickle.loads, max_len=max_len)),
+        ('json', make_packer(lambda x: json.dumps(x).encode('utf8'), max_len=max_len),
+                make_unpacker(json.loads, max_len=max_len)),
+    ]
+    for (codec, pack_f, unpack_f) in codecs:
+        ns = pack_f(obj)
+        yield ('codec_pack', codec, lambda: pack_f(obj))
+        yield ('codec_unpack', codec, lambda: unpack_f(ns))
+
+BENCH_GROUPS = [bench_functions, bench_bytesio, bench_sockets, bench_codecs]
+
+def case_key(result):
+    """Key of case in results and baseline.
+
+    >>> case_key({'name': 'pack', 'transport': 'memory', 'size': 16})
+    'pack/memory/16'
+
+    """
+    return '{}/{}/{}'.format(result['name'], result['transport'], result['size'])
+
+def run(sizes=BENCH_SIZES, pattern=None, total_bytes=BENCH_BYTES, min_msgs=BENCH_MIN_MSGS,
+            max_msgs=BENCH_MAX_MSGS, repeat=BENCH_REPEAT):
+    """Runs benchmark cases.
+
+    Parameters
+    ----------
+    sizes : list of int
+        Payload sizes.
+    pattern : str or None
+        Only cases which keys contain this substring are run.
+    total_bytes, min_msgs, max_msgs
+        Number of messages of single measurement, see BENCH_BYTES.
+    repeat : int
+        Number of measurements, the fastest one is reported.
+
+    Yields
+    ------
+    dict
+        Result of case, see `measure`, with keys name, transport
+        (or codec), size.
+
+    >>> results = list(run(sizes=[16], pattern='pack/memory', max_msgs=100))
+    >>> [case_key(result) for result in results]
+    ['pack/memory/16', 'unpack/memory/16']
+
+    """
+    for size in sizes:
+        count = max(min_msgs, min(max_msgs, total_bytes // max(size, 1)))
+        for group in BENCH_GROUPS:
+            # the first call warms up caches and connections
+            for (name, transport, op) in group(size, 1 + count * repeat):
+                result = {'name': name, 'transport': transport, 'size': size}
+                if pattern is not None and pattern not in case_key(result):
+                    continue
+                op()
+                measures = [measure(op, count, size) for i in range(repeat)]
+                result.update(max(measures, key=lambda m: m['msgs_s']))
+                yield result
+
+def compare(result, baseline, threshold=BENCH_THRESHOLD):
+    """Adds comparison with baseline to result.
+
+    Parameters
+    ----------
+    result : dict
+        Result of case.
+    baseline : dict
+        Baseline results by `case_key`.
+    threshold : float
+        Relative slowdown of msgs/s that is regression.
+
+    Returns
+    -------
+    bool
+        Case is slower than baseline by more than threshold.
+
+    >>> baseline = {'pack/memory/16': {'msgs_s': 1000.0}}
+    >>> result = {'name': 'pack', 'transport': 'memory', 'size': 16, 'msgs_s': 800.0}
+    >>> compare(result, baseline)
+    True
+    >>> (result['baseline_msgs_s'], result['ratio'])
+    (1000.0, 0.8)
+
+    """
+    base = baseline.get(case_key(result))
+    if base is None:
+        return False
+    result['baseline_msgs_s'] = base['msgs_s']
+    result['ratio'] = result['msgs_s'] / base['msgs_s'] if base['msgs_s'] else 0.0
+    result['regression'] = result['ratio'] < 1.0 - threshold
+    return result['regression']
+
+def load_baseline(path):
+    """Loads results saved by `--save` as dict by `case_key`.
+    """
+    with open(path) as f:
+        return {case_key(result): result for result in json.load(f)}
+
+def _format_table_row(result):
+    row = '{:<14} {:<11} {:>9} {:>12.0f} {:>10.2f} {:>10.1f} {:>10.1f}'.format(
+            result['name'], result['transport'], result['size'], result['msgs_s'], result['mb_s'],
+            result['p50_us'], result['p99_us'])
+    if 'ratio' in result:
+        row += ' {:>6.2f}{}'.format(result['ratio'], ' REGRESSION' if result['regression'] else '')
+    return row
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m netstrings.bench',
+                description='Benchmarks of netstrings packing, unpacking and NsStream transports.')
+    parser.add_argument('--sizes', default=','.join(map(str, BENCH_SIZES)),
+                help='comma separated payload sizes, bytes (default: %(default)s)')
+    parser.add_argument('--filter', default=None, help='run only cases which keys name/transport/size contain it')
+    parser.add_argument('--bytes', type=int, default=BENCH_BYTES, help='total payload bytes of case')
+    parser.add_argument('--min-msgs', type=int, default=BENCH_MIN_MSGS)
+    parser.add_argument('--max-msgs', type=int, default=BENCH_MAX_MSGS)
+    parser.add_argument('--repeat', type=int, default=BENCH_REPEAT,
+                help='number of measurements of case, the fastest one is reported (default: %(default)s)')
+    parser.add_argument('--format', choices=['json', 'table'], default='json', help='output format')
+    parser.add_argument('--save', default=None, help='save results to JSON file to be used as baseline')
+    parser.add_argument('--baseline', default=None, help='compare results with saved baseline')
+    parser.add_argument('--threshold', type=float, default=BENCH_THRESHOLD,
+                help='relative slowdown of msgs/s reported as regression (default: %(default)s)')
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    baseline = load_baseline(args.baseline) if args.baseline is not None else {}
+    if args.format == 'table':
+        print('{:<14} {:<11} {:>9} {:>12} {:>10} {:>10} {:>10}{}'.format(
+                'name', 'transport', 'size', 'msgs/s', 'MB/s', 'p50 us', 'p99 us', '  ratio' if baseline else ''))
+    results = []
+    regressions = 0
+    for result in run(sizes, args.filter, args.bytes, args.min_msgs, args.max_msgs, args.repeat):
+        regressions += compare(result, baseline, args.threshold)
+        results.append(result)
+        if args.format == 'table':
+            print(_format_table_row(result))
+        else:
+            print(json.dumps(result))
+        sys.stdout.flush()
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if baseline:
+        print('{} of {} cases are slower than baseline by more than {:.0%}'.format(
+                regressions, len(results), args.threshold), file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Per-message compression of netstring payloads.
+
+Every payload starts with flag byte of codec: 0 - not compressed,
+1 - zlib, 2 - lzma, 3 - bz2, so compressed and raw frames can be mixed
+in one stream. Small payloads and payloads that do not become smaller are
+sent raw. zlib can use preset dictionary trained from sample messages.
+
+    zdict = train_zdict(sample_payloads)
+    pack_f = make_compressing_packer(pickle.dumps, zdict=zdict, max_len=NS_PICKLE_MAX)
+    unpack_f = make_decompressing_unpacker(pickle.loads, zdict=zdict, max_len=NS_PICKLE_MAX)
+    nstream = NsStream(fd, pack_f=pack_f, unpack_f=unpack_f)
+"""
+
+from collections import Counter
+import zlib
+
+from .netstrings import NS_MAX_LEN, NsMalformed, make_packer, make_unpacker
+
+# Flag bytes of codecs
+CODEC_FLAGS = {'raw': 0, 'zlib': 1, 'lzma': 2, 'bz2': 3}
+
+# Default minimum payload length that is compressed
+COMPRESS_THRESHOLD = 256
+
+# Default size of dictionary made by train_zdict(), it is zlib window size
+ZDICT_SIZE = 32768
+
+# Length of substrings counted by train_zdict()
+ZDICT_NGRAM = 8
+
+def _compress_f(codec, level, zdict):
+    # compression function of codec
+    if zdict is not None and codec != 'zlib':
+        raise ValueError('Preset dictionary is supported only by zlib codec')
+    if codec == 'zlib':
+        if level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        if zdict is None:
+            return lambda data: zlib.compress(data, level)
+        def compress(data):
+            compressor = zlib.compressobj(level, zdict=zdict)
+            return compressor.compress(data) + compressor.flush()
+        return compress
+    if codec == 'lzma':
+        import lzma
+        return lambda data: lzma.compress(data, preset=level)
+    if codec == 'bz2':
+        import bz2
+        return lambda data: bz2.compress(data, 9 if level is None else level)
+    raise ValueError('Unknown codec: {!r}'.format(codec))
+
+def _decompressor(flag, zdict):
+    # new decompressor object for flag byte and exceptions of codec
+    if flag == CODEC_FLAGS['zlib']:
+        if zdict is not None:
+            return (zlib.decompressobj(zdict=zdict), zlib.error)
+        return (zlib.decompressobj(), zlib.error)
+    if flag == CODEC_FLAGS['lzma']:
+        import lzma
+        return (lzma.LZMADecompressor(), lzma.LZMAError)
+    if flag == CODEC_FLAGS['bz2']:
+        import bz2
+        return (bz2.BZ2Decompressor(), OSError)
+    raise NsMalformed('Unknown codec flag of compressed payload: {}'.format(flag))
+
+def compress(payload, codec='zlib', level=None, threshold=COMPRESS_THRESHOLD, zdict=None):
+    """Compresses payload and prepends flag byte of codec.
+
+    Parameters
+    ----------
+    payload : bytes-like object
+        Payload to be compressed.
+    codec : str
+        'zlib', 'lzma' or 'bz2'.
+    level : int or None
+        Compression level or preset of codec, None means default one.
+    threshold : int
+        Payloads shorter than `threshold` are not compressed.
+    zdict : bytes or None
+        Preset dictionary of zlib, see `train_zdict`.
+
+    Returns
+    -------
+    bytes
+        Flag byte and compressed payload, or flag 0 and payload if
+        compression does not make payload smaller.
+
+    >>> compress(b'abc')
+    b'\\x00abc'
+    >>> len(compress(b'abc' * 1000)) < 100
+    True
+
+    """
+    return _make_compress(codec, level, threshold, zdict)(payload)
+
+def _make_compress(codec, level, threshold, zdict):
+    compress_f = _compress_f(codec, level, zdict)
+    flag = bytes([CODEC_FLAGS[codec]])
+    raw_flag = bytes([CODEC_FLAGS['raw']])
+
+    def compress(payload):
+        if len(payload) >= threshold:
+            data = compress_f(payload)
+            if len(data) < len(payload):
+                return flag + data
+        return raw_flag + payload
+    return compress
+
+def decompress(data, max_len=NS_MAX_LEN, zdict=None):
+    """Decompresses payload made by `compress`.
+
+    Decompressed payload never exceeds `max_len`, decompression stops
+    as soon as it is reached, so decompression bombs are not expanded.
+
+    Parameters
+    ----------
+    data : bytes-like object
+        Flag byte and payload.
+    max_len : int
+        Maximum length of decompressed payload.
+    zdict : bytes or None
+        Preset dictionary of zlib, the same as used by `compress`.
+
+    Returns
+    -------
+    bytes
+        Decompressed payload.
+
+    Raises
+    ------
+    NsMalformed
+        Unknown flag, corrupted data or decompressed payload is too big.
+
+    >>> decompress(compress(b'abc' * 1000), max_len=3000) == b'abc' * 1000
+    True
+    >>> decompress(compress(b'abc' * 1000), max_len=2999)  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    NsMalformed: Too big decompressed payload. max_len:2999
+
+    """
+    view = memoryview(data)
+    if len(view) == 0:
+        raise NsMalformed('Empty compressed payload, flag byte is missing')
+    flag = view[0]
+    if flag == CODEC_FLAGS['raw']:
+        if len(view) - 1 > max_len:
+            raise NsMalformed('Too big decompressed payload. max_len:{}'.format(max_len))
+        return view[1:].tobytes()
+    (decompressor, codec_error) = _decompressor(flag, zdict)
+    try:
+        # one byte more than allowed shows that payload is too big
+        payload = decompressor.decompress(view[1:], max_len + 1)
+    except codec_error as e:
+        raise NsMalformed('Cannot decompress payload, codec flag {}: {}'.format(flag, e))
+    if len(payload) > max_len:
+        raise NsMalformed('Too big decompressed payload. max_len:{}'.format(max_len))
+    if not decompressor.eof:
+        raise NsMalformed('Incomplete compressed payload, codec flag {}'.format(flag))
+    return payload
+
+def make_compressing_packer(encode_f=None, codec='zlib', level=None, threshold=COMPRESS_THRESHOLD, zdict=None,
+            max_len=NS_MAX_LEN):
+    """Makes packer that compresses payloads, see `make_packer` and `compress`.
+
+    Parameters
+    ----------
+    encode_f
+        Function that converts object to bytes before compression,
+        None means that objects are bytes-like objects.
+    max_len : int
+        Maximum netstring length, see `pack`.
+
+    Returns
+    -------
+    function
+        Packer for NsStream `pack_f`.
+
+    >>> pack_f = make_compressing_packer(str.encode)
+    >>> pack_f('abc')
+    b'4:\\x00abc,'
+
+    """
+    compress_f = _make_compress(codec, level, threshold, zdict)
+    if encode_f is None:
+        return make_packer(compress_f, max_len=max_len)
+    return make_packer(lambda obj: compress_f(encode_f(obj)), max_len=max_len)
+
+def make_decompressing_unpacker(decode_f=None, zdict=None, max_len=NS_MAX_LEN):
+    """Makes unpacker of payloads made by `make_compressing_packer`, see `make_unpacker`.
+
+    Payloads of all codecs are accepted, raw and compressed ones can be mixed.
+
+    Parameters
+    ----------
+    decode_f
+        Function that converts decompressed bytes to object,
+        None means that objects are bytes.
+    zdict : bytes or None
+        Preset dictionary of zlib, the same as used by packer.
+    max_len : int
+        Maximum length of decompressed payload.
+
+    Returns
+    -------
+    function
+        Unpacker for NsStream `unpack_f`.
+
+    >>> from io import BytesIO
+    >>> from netstrings import NsStream
+    >>> b_stream = BytesIO()
+    >>> nstream = NsStream(b_stream, pack_f=make_compressing_packer(str.encode),
+    ...         unpack_f=make_decompressing_unpacker(bytes.decode))
+    >>> nstream.write_many(['a', 'b' * 1000]) < 100
+    True
+    >>> pos = b_stream.seek(0)
+    >>> [len(s) for s in nstream]
+    [1, 1000]
+
+    """
+    if decode_f is None:
+        decompress_f = lambda data: decompress(data, max_len=max_len, zdict=zdict)
+    else:
+        decompress_f = lambda data: decode_f(decompress(data, max_len=max_len, zdict=zdict))
+    # raw payload has flag byte, compressed one is never longer than it
+    return make_unpacker(decompress_f, max_len=max_len + 1)
+
+def train_zdict(samples, size=ZDICT_SIZE):
+    """Makes zlib preset dictionary from sample payloads.
+
+    Substrings that are repeated in many samples are collected: samples
+    that contain the most of such substrings not covered yet are joined,
+    the most useful are placed at the end of dictionary, where zlib
+    finds them at the shortest distance.
+
+    Parameters
+    ----------
+    samples : iterable of bytes-like objects
+        Typical payloads.
+    size : int
+        Maximum dictionary size.
+
+    Returns
+    -------
+    bytes
+        Dictionary for `zdict` argument.
+
+    >>> samples = [b'{"user": %d, "status": "active"}' % i for i in range(100)]
+    >>> zdict = train_zdict(samples)
+    >>> payload = b'{"user": 1000, "status": "active"}'
+    >>> len(compress(payload, threshold=0, zdict=zdict)) < len(compress(payload, threshold=0))
+    True
+
+    """
+    samples = [bytes(sample) for sample in samples]
+    grams = [set([sample[i:i+ZDICT_NGRAM] for i in range(len(sample) - ZDICT_NGRAM + 1)]) for sample in samples]
+    # number of samples that contain substring
+    counts = Counter()
+    for sample_grams in grams:
+        counts.update(sample_grams)
+    order = sorted(range(len(samples)), key=lambda i: -sum([counts[g] for g in grams[i]]))
+    chosen = []
+    total = 0
+    for i in order:
+        # substrings of chosen samples are covered, they are not counted again
+        score = sum([counts[g] for g in grams[i]])
+        if score <= len(grams[i]):
+            # no substrings shared with other samples
+            continue
+        chosen.append(samples[i])
+        total += len(samples[i])
+        for g in grams[i]:
+            counts[g] = 0
+        if total >= size:
+            break
+    return b''.join(reversed(chosen))[-size:]
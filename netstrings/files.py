@@ -0,0 +1,625 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Netstring files.
+
+NsMmapReader walks netstrings of a file in place through mmap, payloads are
+memoryviews of the mapping, so big files are scanned without copying every
+byte through read buffers.
+
+Index of netstring file is sidecar file (`path` + '.idx' by default) with
+array of 64-bit little-endian offsets of netstrings. NsIndexWriter writes it
+while netstring file is written, `build_index` builds or completes it for
+existing file, NsIndexedFile gives random access to netstrings by number.
+
+`scan_parallel` splits netstring file into byte ranges and processes them
+in worker processes.
+
+    python -m netstrings.files index path [path ...]
+"""
+
+from array import array
+from bisect import bisect_right
+from collections import deque
+import mmap
+import os
+import sys
+
+from .netstrings import (NS_MAX_LEN, NsError, NsMalformed, NsStreamUnexpectedEnd, _byte_view, _unpack_view,
+        hex_fragment, make_packer)
+
+# Suffix of sidecar index file
+INDEX_SUFFIX = '.idx'
+
+# Number of chained netstrings that confirm frame boundary
+# found by resynchronization, see scan_parallel()
+RESYNC_CONFIRM = 2
+
+# Minimum size of byte range of scan_parallel() worker
+SCAN_MIN_CHUNK = 1 << 20
+
+class NsMmapReader:
+    """
+    Memory-mapped reader of netstring file.
+
+    Attributes
+    ----------
+    path : str
+        Path of netstring file.
+    decode_f
+        Payload decoder, it gets payloads as memoryviews, None means
+        that memoryviews are yielded.
+    max_len : int
+        Maximum payload length, see `unpack`.
+    offset : int
+        Offset of the next netstring, it can be saved as checkpoint and
+        passed to constructor later.
+    size : int
+        File size.
+
+    Methods
+    -------
+    __iter__()
+        Iterates over payloads from `offset` to the end of file.
+    close()
+        Unmaps and closes file.
+
+    Payloads are memoryviews of the mapping, file stays mapped until
+    all of them are released.
+
+    >>> import tempfile
+    >>> from netstrings import pack, make_unpacker
+    >>> with tempfile.NamedTemporaryFile(delete=False) as f:
+    ...     n = f.write(pack(b'abc') + pack(b'hello'))
+    >>> with NsMmapReader(f.name) as reader:
+    ...     [bytes(payload) for payload in reader]
+    [b'abc', b'hello']
+    >>> with NsMmapReader(f.name, unpack_f=make_unpacker(lambda view: bytes(view).upper())) as reader:
+    ...     list(reader)
+    [b'ABC', b'HELLO']
+    >>> os.remove(f.name)
+
+    """
+    def __init__(self, path, unpack_f=None, max_len=NS_MAX_LEN, offset=0):
+        self.path = path
+        if unpack_f is not None:
+            if not hasattr(unpack_f, 'decode_f'):
+                raise ValueError('NsMmapReader requires unpack_f made by make_unpacker()')
+            self.decode_f = unpack_f.decode_f
+            self.max_len = unpack_f.max_len
+        else:
+            self.decode_f = None
+            self.max_len = max_len
+        self.offset = offset
+        self.fd = open(path, 'rb')
+        self.size = os.fstat(self.fd.fileno()).st_size
+        if self.size > 0:
+            self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self.map, 'madvise'):
+                self.map.madvise(mmap.MADV_SEQUENTIAL)
+            self.view = _byte_view(self.map)
+        else:
+            # empty file cannot be mapped
+            self.map = None
+            self.view = memoryview(b'')
+
+    def __iter__(self):
+        view = self.view
+        decode_f = self.decode_f
+        max_len = self.max_len
+        while True:
+            (payload, offset) = _unpack_view(view, self.offset, max_len)
+            if payload is None:
+                break
+            self.offset = offset
+            yield decode_f(payload) if decode_f is not None else payload
+        if self.offset != self.size:
+            fragment = view[self.offset:self.offset+8].tobytes()
+            raise NsStreamUnexpectedEnd('Unexpected end of byte stream. Buffer fragment (at begin):{} HEX:{}'.format(
+                        repr(fragment),
+                        hex_fragment(fragment)))
+
+    def close(self):
+        """Unmaps and closes file.
+        """
+        self.view.release()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # some payloads are still alive,
+                # mapping is closed when they are released
+                pass
+            self.map = None
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def index_path_for(path):
+    """Default path of sidecar index of netstring file.
+    """
+    return path + INDEX_SUFFIX
+
+def _offsets_to_bytes(offsets):
+    # index is always little-endian
+    if sys.byteorder != 'little':
+        offsets = array('Q', offsets)
+        offsets.byteswap()
+    return offsets.tobytes()
+
+def _load_offsets(index_path):
+    offsets = array('Q')
+    with open(index_path, 'rb') as f:
+        data = f.read()
+    # tail of partially written offset is ignored
+    offsets.frombytes(data[0:len(data) - len(data) % offsets.itemsize])
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    return offsets
+
+def build_index(path, index_path=None, max_len=NS_MAX_LEN):
+    """Builds index of netstring file or completes existing one.
+
+    If index exists, only netstrings after the last indexed one are parsed,
+    so index of growing file is updated without rescan.
+
+    Parameters
+    ----------
+    path : str
+        Path of netstring file.
+    index_path : str or None
+        Path of index, None means `index_path_for(path)`.
+    max_len : int
+        Maximum payload length, see `unpack`.
+
+    Returns
+    -------
+    int
+        Number of indexed netstrings.
+
+    """
+    return _build_index(path, index_path, max_len)[0]
+
+def _build_index(path, index_path, max_len):
+    # build_index() that also returns offset after the last complete netstring
+    if index_path is None:
+        index_path = index_path_for(path)
+    offsets = _load_offsets(index_path) if os.path.exists(index_path) else array('Q')
+    count = len(offsets)
+    offset = 0
+    new_offsets = array('Q')
+    with NsMmapReader(path, max_len=max_len) as reader:
+        if count:
+            # the last indexed netstring is parsed again to find the next one
+            (payload, offset) = _unpack_view(reader.view, offsets[-1], max_len)
+            if payload is None:
+                offset = offsets[-1]
+                count -= 1
+                offsets = offsets[0:count]
+            else:
+                payload.release()
+        while True:
+            (payload, next_offset) = _unpack_view(reader.view, offset, max_len)
+            if payload is None:
+                break
+            payload.release()
+            new_offsets.append(offset)
+            offset = next_offset
+    mode = 'r+b' if os.path.exists(index_path) else 'wb'
+    with open(index_path, mode) as f:
+        f.seek(count * new_offsets.itemsize)
+        f.write(_offsets_to_bytes(new_offsets))
+        f.truncate()
+    return (count + len(new_offsets), offset)
+
+class NsIndexWriter:
+    """
+    Writer of netstring file with index.
+
+    Netstrings are appended to file, offset of every netstring is appended to
+    index at the same time. Existing file is indexed before appending, its
+    incomplete last netstring (torn by crash of previous writer) is
+    truncated, so appended netstrings follow the last complete one.
+
+    Attributes
+    ----------
+    path : str
+        Path of netstring file.
+    index_path : str
+        Path of index.
+    pack_f
+        Packer function, see `NsStream`.
+    offset : int
+        Offset of the next netstring.
+    count : int
+        Number of netstrings in file.
+    truncated : int
+        Number of bytes of incomplete netstring truncated at open.
+
+    Methods
+    -------
+    write(payload)
+        Packs payload and appends it to file and its offset to index.
+    flush()
+        Flushes file and index.
+    close()
+        Closes file and index.
+
+    >>> import tempfile
+    >>> path = tempfile.mktemp()
+    >>> with open(path, 'wb') as f:
+    ...     n = f.write(b'3:abc,3:de')
+    >>> with NsIndexWriter(path) as writer:
+    ...     (writer.count, writer.truncated, writer.write(b'fg'))
+    (1, 4, 1)
+    >>> open(path, 'rb').read()
+    b'3:abc,2:fg,'
+    >>> os.remove(path)
+    >>> with NsIndexWriter(path) as writer:
+    ...     n = writer.write(b'new')
+    >>> os.path.getsize(index_path_for(path))
+    8
+
+    """
+    def __init__(self, path, pack_f=None, index_path=None):
+        self.path = path
+        self.index_path = index_path if index_path is not None else index_path_for(path)
+        self.pack_f = pack_f if pack_f is not None else make_packer()
+        self.truncated = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            # appending, index must be complete
+            (self.count, end) = _build_index(path, self.index_path, getattr(self.pack_f, 'max_len', NS_MAX_LEN))
+            self.truncated = os.path.getsize(path) - end
+            if self.truncated:
+                os.truncate(path, end)
+        else:
+            self.count = 0
+        self.fd = open(path, 'ab')
+        self.index_fd = open(self.index_path, 'ab')
+        # stale offsets (e.g. index of replaced or emptied file) are dropped
+        self.index_fd.truncate(self.count * array('Q').itemsize)
+        self.offset = self.fd.seek(0, os.SEEK_END)
+
+    def write(self, payload):
+        """Packs payload and appends netstring to file and its offset to index.
+
+        Returns
+        -------
+        int
+            Number of netstring in file.
+
+        """
+        ns = self.pack_f(payload)
+        self.fd.write(ns)
+        self.index_fd.write(_offsets_to_bytes(array('Q', [self.offset])))
+        self.offset += len(ns)
+        self.count += 1
+        return self.count - 1
+
+    def flush(self):
+        """Flushes file and index.
+        """
+        # data first, so index never points beyond written data
+        self.fd.flush()
+        self.index_fd.flush()
+
+    def close(self):
+        """Closes file and index.
+        """
+        self.flush()
+        self.fd.close()
+        self.index_fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class NsIndexedFile:
+    """
+    Random access to netstrings of file by index.
+
+    Attributes
+    ----------
+    path : str
+        Path of netstring file.
+    index_path : str
+        Path of index.
+    decode_f
+        Payload decoder, it gets payloads as memoryviews, None means
+        that memoryviews are returned.
+    max_len : int
+        Maximum payload length, see `unpack`.
+    offsets : array or memoryview
+        Offsets of netstrings.
+
+    Methods
+    -------
+    __len__()
+        Number of indexed netstrings.
+    __getitem__(n)
+        Payload of netstring number `n`, list of payloads for slice.
+    offset(n)
+        Offset of netstring number `n`.
+    find(offset)
+        Number of netstring that contains byte at `offset`.
+    close()
+        Closes file.
+
+    >>> import tempfile
+    >>> path = tempfile.mktemp()
+    >>> with NsIndexWriter(path) as writer:
+    ...     for word in [b'zero', b'one', b'two', b'three']:
+    ...         n = writer.write(word)
+    >>> with NsIndexedFile(path) as nsfile:
+    ...     len(nsfile), bytes(nsfile[2]), [bytes(p) for p in nsfile[-2:]]
+    (4, b'two', [b'two', b'three'])
+    >>> build_index(path, path + '.copy')
+    4
+    >>> open(path + '.copy', 'rb').read() == open(index_path_for(path), 'rb').read()
+    True
+    >>> for p in (path, index_path_for(path), path + '.copy'):
+    ...     os.remove(p)
+
+    """
+    def __init__(self, path, unpack_f=None, max_len=NS_MAX_LEN, index_path=None):
+        self.reader = NsMmapReader(path, unpack_f=unpack_f, max_len=max_len)
+        self.path = path
+        self.index_path = index_path if index_path is not None else index_path_for(path)
+        self.decode_f = self.reader.decode_f
+        self.max_len = self.reader.max_len
+        self.index_map = None
+        size = os.path.getsize(self.index_path)
+        size -= size % 8
+        if sys.byteorder == 'little' and size > 0:
+            with open(self.index_path, 'rb') as f:
+                self.index_map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self.offsets = memoryview(self.index_map).cast('B').cast('Q')
+        else:
+            self.offsets = _load_offsets(self.index_path)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def offset(self, n):
+        """Offset of netstring number `n`.
+        """
+        return self.offsets[n]
+
+    def find(self, offset):
+        """Number of netstring that contains byte at `offset`, binary search.
+
+        Returns
+        -------
+        int
+            Number of netstring or -1 if `offset` is before the first one.
+
+        """
+        return bisect_right(self.offsets, offset) - 1
+
+    def _payload(self, n):
+        (payload, next_offset) = _unpack_view(self.reader.view, self.offsets[n], self.max_len)
+        if payload is None:
+            raise NsStreamUnexpectedEnd('Unexpected end of byte stream at offset {}'.format(self.offsets[n]))
+        return self.decode_f(payload) if self.decode_f is not None else payload
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self._payload(i) for i in range(*n.indices(len(self)))]
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError('netstring index out of range')
+        return self._payload(n)
+
+    def close(self):
+        """Unmaps and closes file and index.
+        """
+        if self.index_map is not None:
+            self.offsets.release()
+            self.index_map.close()
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _is_boundary(view, offset, max_len, confirm):
+    # netstring starts at offset and is followed by `confirm` - 1 netstrings
+    # (or end of file)
+    for i in range(confirm):
+        if offset == len(view):
+            return True
+        try:
+            (payload, offset) = _unpack_view(view, offset, max_len)
+        except NsMalformed:
+            return False
+        if payload is None:
+            return False
+        payload.release()
+    return True
+
+def _resync(nsmap, view, start, end, max_len, confirm):
+    # offset of the first netstring that starts in [start, end) or None.
+    # Netstring starts at the beginning of file or after ',' of previous one.
+    if start == 0:
+        return 0
+    offset = start
+    while offset < end:
+        i = nsmap.find(b',', offset - 1, end - 1)
+        if i == -1:
+            return None
+        if _is_boundary(view, i + 1, max_len, confirm):
+            return i + 1
+        offset = i + 2
+    return None
+
+def _scan_chunk(path, start, end, start_offset, max_len, decode_f, map_f, filter_f, confirm):
+    # task of scan_parallel() for worker process:
+    # processes netstrings that start in [start, end),
+    # returns (offset of the first one or None, offset of the next one after range, results),
+    # results are None if netstrings after resynchronization are malformed
+    try:
+        return _scan_range(path, start, end, start_offset, max_len, decode_f, map_f, filter_f, confirm)
+    except NsError:
+        if start_offset is None:
+            return (None, None, None)
+        raise
+
+def _scan_range(path, start, end, start_offset, max_len, decode_f, map_f, filter_f, confirm):
+    with NsMmapReader(path, max_len=max_len) as reader:
+        view = reader.view
+        if start_offset is None:
+            first = _resync(reader.map, view, start, end, max_len, confirm) if reader.map is not None else None
+        else:
+            first = start_offset if start_offset < end else None
+        results = []
+        if first is None:
+            return (None, None, results)
+        offset = first
+        while offset < end:
+            (payload, next_offset) = _unpack_view(view, offset, max_len)
+            if payload is None:
+                fragment = view[offset:offset+8].tobytes()
+                raise NsStreamUnexpectedEnd('Unexpected end of byte stream. Buffer fragment (at begin):{} HEX:{}'.format(
+                            repr(fragment),
+                            hex_fragment(fragment)))
+            obj = decode_f(payload) if decode_f is not None else payload
+            if filter_f is None or filter_f(obj):
+                res = map_f(obj) if map_f is not None else obj
+                if isinstance(res, memoryview):
+                    res = res.tobytes()
+                results.append(res)
+            offset = next_offset
+        return (first, offset, results)
+
+def scan_parallel(path, map_f=None, filter_f=None, unpack_f=None, max_len=NS_MAX_LEN,
+                executor=None, max_workers=None, chunk_size=None, ordered=True, confirm=RESYNC_CONFIRM):
+    """Processes netstring file by many processes.
+
+    File is split into byte ranges. Worker process finds the first
+    netstring of its range: it is an offset after ',' that starts valid
+    netstring followed by `confirm` - 1 valid netstrings. Every worker
+    processes netstrings that start in its range.
+
+    In ordered mode every range must start where the previous one ends,
+    if resynchronization was misled by payload bytes, the range is scanned
+    again from the right offset. In unordered mode results are yielded as
+    soon as range is processed, so misled resynchronization cannot be
+    fixed and raises NsMalformed. Use ordered mode for payloads that
+    contain netstrings themselves.
+
+    Functions and decoder are passed to worker processes, so they must be
+    picklable (e.g. defined at module level).
+
+    Parameters
+    ----------
+    path : str
+        Path of netstring file.
+    map_f
+        Function `map_f(obj)`, its result is yielded, None means `obj`.
+        Payloads as memoryviews are converted to bytes.
+    filter_f
+        Function `filter_f(obj)`, only objects for which it returns True
+        are mapped and yielded, None means all objects.
+    unpack_f
+        Unpacker made by `make_unpacker`, its `decode_f` gets payloads as
+        memoryviews, None means that `obj` is payload memoryview.
+    max_len : int
+        Maximum payload length, see `unpack`, ignored if `unpack_f` is given.
+    executor : concurrent.futures.Executor or None
+        Pool of workers, None means new ProcessPoolExecutor.
+    max_workers : int or None
+        Number of processes of new ProcessPoolExecutor.
+    chunk_size : int or None
+        Size of byte range, None means four ranges per worker.
+    ordered : bool
+        Yields results in order of netstrings in file.
+    confirm : int
+        Number of chained netstrings that confirm resynchronization.
+
+    Yields
+    ------
+    Any object
+        Results of `map_f`.
+
+    """
+    if unpack_f is not None:
+        if not hasattr(unpack_f, 'decode_f'):
+            raise ValueError('scan_parallel requires unpack_f made by make_unpacker()')
+        decode_f = unpack_f.decode_f
+        max_len = unpack_f.max_len
+    else:
+        decode_f = None
+    size = os.path.getsize(path)
+    own_executor = executor is None
+    if own_executor:
+        # multiprocessing is imported only when it is used
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers)
+    workers = max_workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(SCAN_MIN_CHUNK, size // (workers * 4) + 1)
+    ranges = [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+    args = (max_len, decode_f, map_f, filter_f, confirm)
+    try:
+        if ordered:
+            # two ranges per worker are processed at the same time
+            pending = deque()
+            expected = 0
+            for (start, end) in ranges:
+                pending.append((start, end, executor.submit(_scan_chunk, path, start, end, None, *args)))
+                if len(pending) < 2 * workers:
+                    continue
+                expected = yield from _yield_checked(path, pending.popleft(), expected, args)
+            while pending:
+                expected = yield from _yield_checked(path, pending.popleft(), expected, args)
+        else:
+            from concurrent.futures import as_completed
+            futures = {}
+            for (start, end) in ranges:
+                futures[executor.submit(_scan_chunk, path, start, end, None, *args)] = (start, end)
+            spans = []
+            for future in as_completed(futures):
+                (first, last, results) = future.result()
+                if results is None:
+                    raise NsMalformed('Netstrings resynchronization failed in range {}-{}'.format(*futures[future]))
+                spans.append((futures[future][0], first, last))
+                yield from results
+            expected = 0
+            for (start, first, last) in sorted(spans):
+                if first is None:
+                    continue
+                if first != expected:
+                    raise NsMalformed('Netstrings resynchronization failed at offset {}, expected {}'.format(first, expected))
+                expected = last
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+def _yield_checked(path, chunk, expected, args):
+    # yields results of range if it starts where previous range ends,
+    # otherwise scans it again, returns offset where range ends
+    (start, end, future) = chunk
+    (first, last, results) = future.result()
+    if results is None or first != (expected if expected < end else None):
+        (first, last, results) = _scan_chunk(path, start, end, expected, *args)
+    yield from results
+    return last if first is not None else expected
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'index':
+        print(__doc__)
+        sys.exit(1)
+    for path in sys.argv[2:]:
+        count = build_index(path)
+        print('{}: {} netstrings, index {}'.format(path, count, index_path_for(path)))
@@ -1,8 +1,14 @@
 #fileencoding=utf-8
 #!/usr/bin/env python3
 
-from functools import partial
-from io import BytesIO
+from collections import deque
+from functools import lru_cache, partial
+from io import BytesIO, FileIO, RawIOBase
+import os
+import socket
+import stat
+import sys
+import time
 
 # Default maximum assembled netstring len.
 # ascii len digits  +  delemitter ':' + payload + terminator ','
@@ -14,6 +20,20 @@ NS_MAX_LEN = 4096
 # NsStream constructor can redifine it see max_read
 STREAM_MAX_READ = 8192 
 
+# Default maximum number of payloads in a batch that is decoded
+# by single task of process pool, see NsStream.iter_parallel()
+PARALLEL_BATCH_SIZE = 64
+
+# Default size of bytes for single copy operation of
+# NsStream.write_stream()
+STREAM_COPY_SIZE = 65536
+
+# Maximum number of segments for single vectored write operation
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
 def hex_fragment(ba):
     """HEX represenatation of bytes.
 
@@ -29,6 +49,19 @@ def hex_fragment(ba):
     """
     return ' '.join(['{:02X}'.format(i) for i in ba])
 
+@lru_cache(maxsize=None)
+def _max_header(max_len):
+    # maximum number of digits of length header, also limited by maximum
+    # length of str that int() converts (Python 3.11+), so int() of header
+    # never raises ValueError
+    if max_len.bit_length() < 2000:
+        digits = len(str(max_len))
+    else:
+        # str() of huge int is limited too, upper bound of its digits
+        digits = max_len.bit_length() * 30103 // 100000 + 1
+    limit = sys.get_int_max_str_digits() if hasattr(sys, 'get_int_max_str_digits') else 0
+    return min(digits, limit) if limit else digits
+
 class NsError(Exception):
     """
     Base Class for netstring Exceptions.
@@ -75,7 +108,96 @@ def pack(x, max_len=NS_MAX_LEN):
     total_len = len(ascii_dig_len) + len(x) + 2
     if  total_len > max_len:
             raise NsMalformed('Too big netstring. len:{}, max_len:{}'.format(total_len, max_len))
-    return ascii_dig_len + b':' + x + b','
+    # single copy of payload
+    return b''.join((ascii_dig_len, b':', x, b','))
+
+def pack_iov(x, max_len=NS_MAX_LEN):
+    """Packing bytes to netstring segments without concatenation.
+
+    Parameters
+    ----------
+    x : bytes-like object
+        Bytes to be packed.
+    max_len : int
+        See `pack`.
+
+    Returns
+    -------
+    tuple (bytes, bytes-like object, bytes)
+        Length header with ':', payload `x` itself and ',' terminator.
+        Segments are suitable for vectored write operations.
+
+    >>> pack_iov(b'abc')
+    (b'3:', b'abc', b',')
+
+    >>> b''.join(pack_iov(b'abc')) == pack(b'abc')
+    True
+
+    """
+    x_len = len(x) if isinstance(x, bytes) else memoryview(x).nbytes
+    header = b'%d:' % x_len
+    total_len = len(header) + x_len + 1
+    if  total_len > max_len:
+            raise NsMalformed('Too big netstring. len:{}, max_len:{}'.format(total_len, max_len))
+    return (header, x, b',')
+
+def _socket_of(fd):
+    # socket under file-like object or None
+    if isinstance(fd, socket.socket):
+        return fd
+    if isinstance(fd, socket.SocketIO):
+        # fd made by sock.makefile('rwb', buffering=0)
+        return fd._sock
+    return None
+
+def write_iov(fd, segments):
+    """Writes segments of bytes to file-like object with single vectored write.
+
+    Uses `socket.sendmsg` for sockets and `os.writev` for unbuffered files.
+    For other file-like objects segments are joined and written by single
+    `fd.write()`. Blocking call, all bytes are written.
+
+    Parameters
+    ----------
+    fd : file-like object in binary mode or socket
+        See `NsStream`.
+    segments : list of bytes-like objects
+        Bytes to be written in order.
+
+    Returns
+    -------
+    int
+        Number of written bytes.
+
+    >>> b_stream = BytesIO()
+    >>> write_iov(b_stream, [b'3:', b'abc', b','])
+    6
+    >>> b_stream.getvalue()
+    b'3:abc,'
+
+    """
+    sock = _socket_of(fd)
+    if sock is not None and hasattr(sock, 'sendmsg'):
+        send = sock.sendmsg
+    elif isinstance(fd, FileIO) and hasattr(os, 'writev'):
+        fileno = fd.fileno()
+        send = lambda iov: os.writev(fileno, iov)
+    else:
+        return fd.write(b''.join(segments))
+    iov = [memoryview(seg).cast('B') for seg in segments if len(seg)]
+    total = 0
+    i = 0
+    while i < len(iov):
+        n = send(iov[i:i+IOV_MAX])
+        total += n
+        # skip written segments, the rest of partially written one
+        # is sent by the next call
+        while n and n >= len(iov[i]):
+            n -= len(iov[i])
+            i += 1
+        if n:
+            iov[i] = iov[i][n:]
+    return total
 
 def unpack(x, max_len=NS_MAX_LEN):
     """Unpacking netesring to bytes.
@@ -259,8 +381,642 @@ def unpack_str(x, errors='strict', max_len=NS_MAX_LEN):
     else:
         return (None, x)
 
-pack_str_strict = partial(pack_str, errors='strict', max_len=NS_MAX_LEN)
-unpack_str_strict = partial(unpack_str, errors='strict', max_len=NS_MAX_LEN)
+def unpack_view(buf, offset=0, max_len=NS_MAX_LEN):
+    """Unpacking netstring from any buffer without copying payload.
+
+    Parameters
+    ----------
+    buf : bytes-like object
+        Any object that supports buffer protocol: bytes, bytearray, mmap,
+        memoryview.
+    offset : int
+        Offset of netstring in `buf`.
+    max_len : int
+        See `unpack`.
+
+    Returns
+    -------
+    tuple (memoryview, int)
+        Payload as memoryview of `buf` and offset of the next netstring.
+    tuple (None, int)
+        Not all bytes arrived yet, `offset` is returned unchanged.
+
+    >>> (payload, offset) = unpack_view(b'3:abc,5:hello,')
+    >>> payload.tobytes(), offset
+    (b'abc', 6)
+    >>> (payload, offset) = unpack_view(b'3:abc,5:hello,', offset)
+    >>> payload.tobytes(), offset
+    (b'hello', 14)
+    >>> unpack_view(b'3:abc,5:hello,', offset)
+    (None, 14)
+
+    >>> unpack_view(bytearray(b'3:abc'))
+    (None, 0)
+
+    >>> unpack_view(b'3:abcd,')  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    NsMalformed: Not found comma "," as delimiter. Buffer fragment (at begin):b'3:abcd,' HEX:33 3A 61 62 63 64 2C
+
+    """
+    return _unpack_view(_byte_view(buf), offset, max_len)
+
+def _byte_view(buf):
+    # memoryview of single bytes over any buffer-protocol object
+    view = memoryview(buf)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+def _unpack_view(view, offset, max_len):
+    size = len(view)
+    # length header is short, it is searched by small pieces
+    # to avoid copying of payload
+    max_header = _max_header(max_len)
+    i = -1
+    scan = offset
+    scan_end = min(size, offset + max_header + 1)
+    while i == -1 and scan < scan_end:
+        piece = view[scan:min(scan + 32, scan_end)].tobytes()
+        i = piece.find(b':')
+        if i != -1:
+            i += scan
+        elif not piece.isdigit():
+            break
+        scan += len(piece)
+    if i == -1:
+        if scan == size and scan - offset <= max_header:
+            # not all bytes arrived yet
+            return (None, offset)
+        fragment = view[offset:offset+8].tobytes()
+        raise NsMalformed('Not found semicolon ":" as delimiter. Buffer fragment (at begin):{} HEX:{}'.format(
+                        repr(fragment),
+                        hex_fragment(fragment)))
+    header = view[offset:i].tobytes()
+    if not header.isdigit():
+        fragment = view[offset:offset+8].tobytes()
+        raise NsMalformed('Cannot parse ASCII digits giving the length of netstring. Buffer fragment (at begin):{} HEX:{}'.format(
+                        repr(fragment),
+                        hex_fragment(fragment)))
+    payload_l = int(header)
+    if payload_l > max_len:
+        raise NsMalformed('Too big netstring. len:{}, max_len:{}'.format(payload_l, max_len))
+    payload_end = i + 1 + payload_l
+    if size <= payload_end:
+        # payload or ',' not arrived yet
+        return (None, offset)
+    if view[payload_end] != ord(b','):
+        fragment = view[offset:offset+8].tobytes()
+        raise NsMalformed('Not found comma "," as delimiter. Buffer fragment (at begin):{} HEX:{}'.format(
+                        repr(fragment),
+                        hex_fragment(fragment)))
+    return (view[i+1:payload_end], payload_end + 1)
+
+def iter_unpack(buf, offset=0, max_len=NS_MAX_LEN):
+    """Iterates over all complete netstrings in buffer without copying payloads.
+
+    Parameters
+    ----------
+    buf : bytes-like object
+        Any object that supports buffer protocol, see `unpack_view`.
+    offset : int
+        Offset of the first netstring in `buf`.
+    max_len : int
+        See `unpack`.
+
+    Yields
+    ------
+    tuple (memoryview, int)
+        Payload as memoryview of `buf` and offset of the next netstring.
+        The offset yielded last is the beginning of unconsumed remainder.
+
+    >>> [(payload.tobytes(), offset) for (payload, offset) in iter_unpack(b'1:a,2:bc,3:d')]
+    [(b'a', 4), (b'bc', 9)]
+
+    """
+    view = _byte_view(buf)
+    while True:
+        (payload, offset) = _unpack_view(view, offset, max_len)
+        if payload is None:
+            return
+        yield (payload, offset)
+
+def unpack_all(buf, offset=0, max_len=NS_MAX_LEN):
+    """Unpacking all complete netstrings in buffer.
+
+    Parameters
+    ----------
+    buf : bytes-like object
+        Any object that supports buffer protocol, see `unpack_view`.
+    offset : int
+        Offset of the first netstring in `buf`.
+    max_len : int
+        See `unpack`.
+
+    Returns
+    -------
+    tuple (list, int)
+        List of payloads as bytes and offset of unconsumed remainder of `buf`.
+
+    >>> unpack_all(b'1:a,2:bc,3:d')
+    ([b'a', b'bc'], 9)
+
+    >>> unpack_all(b'')
+    ([], 0)
+
+    """
+    view = _byte_view(buf)
+    payloads = []
+    while True:
+        (payload, next_offset) = _unpack_view(view, offset, max_len)
+        if payload is None:
+            return (payloads, offset)
+        payloads.append(payload.tobytes())
+        offset = next_offset
+
+def make_packer(encode_f=None, max_len=NS_MAX_LEN):
+    """Makes packer function for `NsStream` from payload encoder.
+
+    Parameters
+    ----------
+    encode_f : callable or None
+        Single argument function that converts object to bytes.
+        None means that objects are bytes already.
+    max_len : int
+        See `pack`.
+
+    Returns
+    -------
+    callable
+        Packer function `pack_f(x)` that returns netstring as bytes.
+        Encoder and max_len are available as `pack_f.encode_f` and
+        `pack_f.max_len`.
+
+    >>> pack_f = make_packer(lambda x: bytes(str(x), 'utf8'))
+    >>> pack_f(123)
+    b'3:123,'
+
+    """
+    def pack_f(x):
+        if encode_f is not None:
+            x = encode_f(x)
+        return pack(x, max_len=max_len)
+    pack_f.encode_f = encode_f
+    pack_f.max_len = max_len
+    return pack_f
+
+def make_unpacker(decode_f=None, max_len=NS_MAX_LEN):
+    """Makes unpacker function for `NsStream` from payload decoder.
+
+    Unpackers made by this function follow `unpack` contract,
+    but `NsStream` recognizes them and parses netstrings with
+    `NsDecoder`, so `decode_f` is called only for complete payloads.
+
+    Parameters
+    ----------
+    decode_f : callable or None
+        Single argument function that converts payload bytes to object.
+        None means that payload bytes are returned as is.
+    max_len : int
+        See `unpack`.
+
+    Returns
+    -------
+    callable
+        Unpacker function `unpack_f(x)` that returns tuple:
+            - in case of success (any_object, rest_of_buff_bytes)
+            - in case of failure (None, buff)
+        Decoder and max_len are available as `unpack_f.decode_f` and
+        `unpack_f.max_len`.
+
+    >>> unpack_f = make_unpacker(int)
+    >>> unpack_f(b'3:123,4:')
+    (123, b'4:')
+
+    >>> unpack_f(b'3:12')
+    (None, b'3:12')
+
+    """
+    def unpack_f(x):
+        (payload, tail) = unpack(x, max_len=max_len)
+        if payload is not None:
+            if decode_f is not None:
+                payload = decode_f(payload)
+            return (payload, tail)
+        else:
+            return (None, x)
+    unpack_f.decode_f = decode_f
+    unpack_f.max_len = max_len
+    return unpack_f
+
+pack_str_strict = make_packer(partial(str.encode, encoding='utf8', errors='strict'), max_len=NS_MAX_LEN)
+unpack_str_strict = make_unpacker(partial(str, encoding='utf8', errors='strict'), max_len=NS_MAX_LEN)
+
+class NsDecoder:
+    """
+    Incremental netstring decoder.
+
+    Bytes are fed by chunks as they arrive, complete payloads are taken
+    one by one. Decoder remembers parsed length header of incomplete
+    netstring and position where search of ':' must be continued, so
+    every chunk is scanned only once.
+
+    Received bytes are stored in preallocated `buff` between `start`
+    (consume offset) and `end` (fill offset). Taking a payload only moves
+    `start`, bytes waiting behind the payload are not copied. Pending bytes
+    are moved to the beginning of `buff` (or `buff` is grown) only when
+    there is no free space at the end of it for the next chunk.
+
+    Attributes
+    ----------
+    max_len : int
+        Maximum payload length, see `unpack`.
+    buff : bytearray
+        Receive buffer, its size is capacity of decoder.
+    start : int
+        Offset of the first byte that is not consumed yet, it is the
+        beginning of the header of incomplete netstring.
+    end : int
+        Offset after the last received byte.
+
+    Methods
+    -------
+    feed(data)
+        Copies bytes to internal buffer.
+    get_buffer(size)
+        Returns writable memoryview for receiving up to `size` bytes
+        directly into internal buffer, e.g. with `fd.readinto()`.
+    buffer_updated(nbytes)
+        Confirms that `nbytes` were written to memoryview of `get_buffer`.
+    next_frame()
+        Returns next complete payload or None.
+    next_frame_view()
+        Returns next complete payload as memoryview or None.
+    next_header(max_len, max_header)
+        Parses length header of the next netstring without its payload.
+    take(nbytes)
+        Consumes up to `nbytes` received bytes without parsing.
+    pending()
+        Number of received bytes that are not consumed yet.
+
+    >>> decoder = NsDecoder()
+    >>> decoder.feed(b'3:abc,5:he')
+    >>> decoder.next_frame()
+    b'abc'
+    >>> decoder.next_frame() is None
+    True
+    >>> decoder.feed(b'llo,0:')
+    >>> list(decoder)
+    [b'hello']
+    >>> decoder.feed(b',')
+    >>> decoder.next_frame()
+    b''
+    >>> decoder.pending()
+    0
+
+    Receiving without intermediate bytes objects
+    >>> from io import BytesIO
+    >>> fd = BytesIO(b'3:abc,3:def,')
+    >>> decoder.buffer_updated(fd.readinto(decoder.get_buffer(8)))
+    >>> list(decoder)
+    [b'abc']
+    >>> decoder.buffer_updated(fd.readinto(decoder.get_buffer(8)))
+    >>> list(decoder)
+    [b'def']
+
+    >>> decoder = NsDecoder(max_len=10)
+    >>> decoder.feed(b'12:123456789ABC,')
+    >>> decoder.next_frame()  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    NsMalformed: Too big netstring. len:12, max_len:10
+
+    >>> decoder = NsDecoder(max_len=10)
+    >>> decoder.feed(b'0001:a,')
+    >>> decoder.next_frame()  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    NsMalformed: Too long length header of netstring, max digits:2. Buffer fragment (at begin):b'0001:a,' HEX:30 30 30 31 3A 61 2C
+
+    """
+    def __init__(self, max_len=NS_MAX_LEN, size=STREAM_MAX_READ):
+        self.max_len = max_len
+        self.max_header = _max_header(max_len)
+        self.buff = bytearray(size)
+        self.start = 0
+        self.end = 0
+        # offsets below are relative to `start`
+        # offset of ':' is not known yet, search is continued from `scanned`
+        self.scanned = 0
+        # parsed length header of incomplete netstring
+        self.payload_l = None
+        self.payload_start = 0
+
+    def pending(self):
+        """Number of received bytes that are not consumed yet.
+        """
+        return self.end - self.start
+
+    def get_buffer(self, size):
+        """Returns writable memoryview for receiving bytes into internal buffer.
+
+        Pending bytes are moved to the beginning of internal buffer or
+        internal buffer is reallocated only if there is less than `size`
+        bytes of free space after `end`. When length header of incomplete
+        netstring is already parsed, buffer is reallocated to fit whole
+        netstring at once.
+
+        Parameters
+        ----------
+        size : int
+            Number of bytes to be received.
+
+        Returns
+        -------
+        memoryview
+            View of `size` free bytes at `end` of internal buffer.
+            Call `buffer_updated` with number of bytes actually written.
+
+        """
+        if len(self.buff) - self.end < size:
+            pending = self.end - self.start
+            need = pending + size
+            if self.payload_l is not None:
+                need = max(need, self.payload_start + self.payload_l + 1)
+            if need <= len(self.buff):
+                # compact: move pending bytes to the beginning
+                view = memoryview(self.buff)
+                view[0:pending] = view[self.start:self.end]
+            else:
+                buff = bytearray(max(need, 2 * len(self.buff)))
+                buff[0:pending] = memoryview(self.buff)[self.start:self.end]
+                self.buff = buff
+            self.start = 0
+            self.end = pending
+        return memoryview(self.buff)[self.end:self.end+size]
+
+    def buffer_updated(self, nbytes):
+        """Confirms that `nbytes` were written to memoryview of `get_buffer`.
+
+        Parameters
+        ----------
+        nbytes : int
+            Number of received bytes.
+
+        """
+        self.end += nbytes
+
+    def feed(self, data):
+        """Copies bytes to internal buffer.
+
+        Parameters
+        ----------
+        data : bytes-like object
+            Bytes received from stream.
+
+        """
+        n = len(data)
+        self.get_buffer(n)[:] = data
+        self.end += n
+
+    def _fragment(self):
+        fragment = bytes(self.buff[self.start:min(self.start+8, self.end)])
+        return '{} HEX:{}'.format(repr(fragment), hex_fragment(fragment))
+
+    def next_frame(self):
+        """Returns next complete payload.
+
+        Returns
+        -------
+        None
+            Not all bytes of netstring arrived yet.
+        bytes
+            Payload of complete netstring.
+
+        Raises
+        ------
+        NsMalformed
+            Buffer does not start with valid netstring.
+
+        """
+        span = self._next_span()
+        if span is None:
+            return None
+        return bytes(memoryview(self.buff)[span[0]:span[1]])
+
+    def next_frame_view(self):
+        """Returns next complete payload as memoryview of internal buffer.
+
+        Payload is not copied. The view is valid only until the next call of
+        `feed` or `get_buffer`, after that its bytes can be overwritten.
+
+        Returns
+        -------
+        None
+            Not all bytes of netstring arrived yet.
+        memoryview
+            Payload of complete netstring.
+
+        Raises
+        ------
+        NsMalformed
+            Buffer does not start with valid netstring.
+
+        >>> decoder = NsDecoder()
+        >>> decoder.feed(b'3:abc,')
+        >>> bytes(decoder.next_frame_view())
+        b'abc'
+
+        """
+        span = self._next_span()
+        if span is None:
+            return None
+        return memoryview(self.buff)[span[0]:span[1]]
+
+    def _next_span(self):
+        # parses next netstring and consumes it,
+        # returns (payload_start, payload_end) offsets in `buff`
+        if self.payload_l is None and not self._parse_header(self.max_len, self.max_header):
+            return None
+        buff = self.buff
+        payload_start = self.start + self.payload_start
+        payload_end = payload_start + self.payload_l
+        if self.end <= payload_end:
+            # payload or ',' not arrived yet
+            return None
+        if buff[payload_end] != ord(b','):
+            raise NsMalformed('Not found comma "," as delimiter. Buffer fragment (at begin):{}'.format(
+                            self._fragment()))
+        self._consume(payload_end + 1)
+        return (payload_start, payload_end)
+
+    def _parse_header(self, max_len, max_header):
+        # parses length header of the next netstring,
+        # returns False if ':' did not arrive yet
+        buff = self.buff
+        start = self.start
+        i = buff.find(b':', start + self.scanned, self.end)
+        if i == -1:
+            # only ascii digits are valid until ':' arrived
+            pending = self.end - start
+            if pending <= max_header and (self.scanned == pending or buff[start+self.scanned:self.end].isdigit()):
+                self.scanned = pending
+                return False
+            raise NsMalformed('Not found semicolon ":" as delimiter. Buffer fragment (at begin):{}'.format(
+                            self._fragment()))
+        if i - start > max_header:
+            # int() of very long header is slow or raises ValueError
+            raise NsMalformed('Too long length header of netstring, max digits:{}. Buffer fragment (at begin):{}'.format(
+                            max_header, self._fragment()))
+        header = buff[start:i]
+        if not header.isdigit():
+            raise NsMalformed('Cannot parse ASCII digits giving the length of netstring. Buffer fragment (at begin):{}'.format(
+                            self._fragment()))
+        payload_l = int(header)
+        if payload_l > max_len:
+            raise NsMalformed('Too big netstring. len:{}, max_len:{}'.format(payload_l, max_len))
+        self.payload_l = payload_l
+        self.payload_start = i + 1 - start
+        return True
+
+    def next_header(self, max_len, max_header):
+        """Parses length header of the next netstring and consumes it.
+
+        Payload bytes are not consumed, they are taken by `take()`, e.g.
+        when payload is too big for internal buffer.
+
+        Parameters
+        ----------
+        max_len : int
+            Maximum payload length.
+        max_header : int
+            Maximum number of bytes before ':'.
+
+        Returns
+        -------
+        None
+            Header did not arrive yet.
+        int
+            Payload length.
+
+        >>> decoder = NsDecoder(max_len=4)
+        >>> decoder.feed(b'10:0123')
+        >>> decoder.next_header(100, 3)
+        10
+        >>> bytes(decoder.take(100))
+        b'0123'
+
+        """
+        if self.payload_l is None and not self._parse_header(max_len, max_header):
+            return None
+        payload_l = self.payload_l
+        self._consume(self.start + self.payload_start)
+        return payload_l
+
+    def take(self, nbytes):
+        """Consumes up to `nbytes` received bytes without parsing.
+
+        Returns
+        -------
+        memoryview
+            View of consumed bytes, valid only until the next call of
+            `feed` or `get_buffer`.
+
+        """
+        start = self.start
+        end = min(self.end, start + nbytes)
+        view = memoryview(self.buff)[start:end]
+        self._consume(end)
+        return view
+
+    def _consume(self, new_start):
+        # netstring is taken, next one starts at `new_start`
+        if new_start == self.end:
+            # buffer is empty, next chunk is received from the beginning
+            self.start = 0
+            self.end = 0
+        else:
+            self.start = new_start
+        self.scanned = 0
+        self.payload_l = None
+
+    def __iter__(self):
+        # yields all complete payloads from internal buffer
+        payload = self.next_frame()
+        while payload is not None:
+            yield payload
+            payload = self.next_frame()
+
+
+def _decode_batch(decode_f, payloads):
+    # task of NsStream.iter_parallel() for worker process
+    return [decode_f(payload) for payload in payloads]
+
+class NsPayloadReader(RawIOBase):
+    """
+    File-like reader of single payload streamed by `NsStream.read_stream()`.
+
+    Payload bytes are read from the stream on demand, so payload can be
+    bigger than memory. Terminating ',' is checked when the last payload
+    byte is read. Payload that is not read completely is skipped by the
+    next read operation of NsStream.
+
+    Like other raw files, `read(n)` can return less than `n` bytes,
+    `io.BufferedReader` can be used over it.
+
+    Attributes
+    ----------
+    length : int
+        Payload length.
+    remaining : int
+        Number of payload bytes that are not read yet.
+
+    """
+    def __init__(self, nstream, length):
+        self.nstream = nstream
+        self.length = length
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        if self.remaining == 0:
+            self._end()
+            return 0
+        view = memoryview(b).cast('B')[:self.remaining]
+        n = self.nstream._readinto_raw(view)
+        if not n:
+            raise NsStreamUnexpectedEnd('Unexpected end of byte stream. Payload bytes missing:{}'.format(self.remaining))
+        self.remaining -= n
+        if self.remaining == 0:
+            self._end()
+        return n
+
+    def _end(self):
+        # payload is read, checks terminator and releases the stream
+        nstream = self.nstream
+        if nstream is None:
+            return
+        comma = bytearray(1)
+        n = nstream._readinto_raw(comma)
+        self.nstream = None
+        nstream.payload_reader = None
+        if not n:
+            raise NsStreamUnexpectedEnd('Unexpected end of byte stream. Not found comma "," after payload, len:{}'.format(
+                        self.length))
+        if comma != b',':
+            raise NsMalformed('Not found comma "," as delimiter after payload, len:{}'.format(self.length))
+
+    def _skip(self):
+        # NsStream needs the next netstring, rest of payload is discarded
+        buff = bytearray(min(self.remaining, STREAM_COPY_SIZE))
+        while self.remaining:
+            n = self.nstream._readinto_raw(memoryview(buff)[:self.remaining])
+            if not n:
+                raise NsStreamUnexpectedEnd('Unexpected end of byte stream. Payload bytes missing:{}'.format(
+                            self.remaining))
+            self.remaining -= n
+        self._end()
 
 class NsStream:
     """
@@ -282,21 +1038,72 @@ class NsStream:
         that accepts buff:bytes and returns tuple: 
             - in case of success (any_object, rest_of_buff_bytes) 
             - in case of failure (None, buff) 
+        Unpackers made by `make_unpacker` are parsed incrementally by `decoder`.
     max_read : int
         Default size of bytes for NsStream single read operation from `fd`, 
         is initialized by constructor.
+    views : bool
+        If True payloads are passed to `decode_f` (or returned when `decode_f`
+        is None) as memoryviews of `decoder` buffer without copying.
+        The views are valid only until the next read from NsStream.
+        Requires `unpack_f` made by `make_unpacker`.
     buff : bytes
         Internal buffer to store intermediate bytes that already was 
         readed/received from `fd` but not processed yet.
+    flush_bytes : int or None
+        Buffered mode threshold: buffered netstrings are flushed when their
+        total size reaches `flush_bytes`.
+    flush_delay : float or None
+        Buffered mode threshold: buffered netstrings are flushed by the next
+        `write()` or read (`read()`, `read_batch()`, `read_stream()`) when
+        the oldest of them waits for `flush_delay` seconds or longer. There
+        is no timer: it is not a latency bound, netstrings wait for the
+        next call or explicit `flush()`.
+        When `flush_bytes` or `flush_delay` is not None, NsStream works in
+        buffered mode. Buffered netstrings also are flushed before any
+        blocking read from `fd`, other cases require explicit `flush()`.
+    on_flush
+        Function `on_flush(frames, nbytes)` that is called after every flush.
+    wbuff : list
+        Buffered segments of netstrings that are not written yet.
+    decoder : NsDecoder or None
+        Incremental parser and receive buffer used instead of `buff` when
+        `unpack_f` was made by `make_unpacker`. It is filled by
+        `fd.readinto()` if `fd` supports it.
+    decode_f
+        Payload decoder of `unpack_f` made by `make_unpacker`.
+    instr : netstrings.stats.NsStreamStats or None
+        Counters and histograms of instrumented stream. Constructor
+        argument `instrument` is True (new NsStreamStats), NsStreamStats
+        shared with other streams, False, or None that means
+        `netstrings.stats.set_instrument_default()` setting.
+        Instrumented streams are registered in `netstrings.stats.REGISTRY`.
 
     Methods
     -------
     write(pyload) 
         Converts payload to netstring using `pack_f` and writes it to file-like
         objet `fd`.
+    write_many(payloads)
+        Converts payloads to netstrings and writes them with single vectored write.
+    flush()
+        Writes all buffered netstrings to `fd`.
     read()
         Reads data form file-like object `fd` into internal buffer, parses it as netstring, 
         unpacks it using `unpack_f` and returns to caller.
+    read_batch(max_items)
+        Reads all netstrings that can be parsed after single read operation.
+    read_stream(max_len)
+        Parses length header of the next netstring and returns file-like
+        reader of its payload.
+    write_stream(fileobj, length)
+        Writes netstring with payload copied from file-like object by chunks.
+    write_file(path_or_fd, offset, count)
+        Writes netstring with file contents as payload, using sendfile for sockets.
+    iter_parallel(executor, max_workers, batch_size, max_in_flight)
+        Iterates over objects decoded by process pool.
+    stats()
+        Counters and histograms of instrumented stream.
     __iter__()
         Python's Iterator protocol support.
     __next__()
@@ -316,6 +1123,12 @@ class NsStream:
     >>> req == resp
     True
 
+    Zero-copy payloads
+    >>> b_stream = BytesIO(pack(b'abc') + pack(b'def'))
+    >>> ns_stream = NsStream(b_stream, unpack_f=make_unpacker(), views=True)
+    >>> [bytes(view) for view in ns_stream]
+    [b'abc', b'def']
+
     Exception test: NsStreamUnexpectedEnd
     >>> b_stream = BytesIO()
     >>> ns_stream = NsStream(b_stream)
@@ -332,14 +1145,70 @@ class NsStream:
     NsStreamUnexpectedEnd: Unexpected end of byte stream. Buffer fragment (at begin):b'200:\xd0\x96\xd0\x96' HEX:32 30 30 3A D0 96 D0 96
 
     """
-    def __init__(self, fd, max_read=STREAM_MAX_READ, pack_f=pack_str_strict, unpack_f=unpack_str_strict):
+    # `instrument` of streams created without it,
+    # see netstrings.stats.set_instrument_default()
+    instrument_default = False
+
+    def __init__(self, fd, max_read=STREAM_MAX_READ, pack_f=pack_str_strict, unpack_f=unpack_str_strict, views=False,
+                flush_bytes=None, flush_delay=None, on_flush=None, instrument=None):
         self.fd = fd 
         self.pack_f = pack_f
         self.unpack_f = unpack_f
         self.max_read = max_read 
+        self.views = views
+        self.flush_bytes = flush_bytes
+        self.flush_delay = flush_delay
+        self.on_flush = on_flush
+        self.buffered = flush_bytes is not None or flush_delay is not None
+        # segments of netstrings waiting for flush()
+        self.wbuff = []
+        self.wbuff_frames = 0
+        self.wbuff_bytes = 0
+        self.wbuff_time = None
         self.buff = b''
         self.eof = False
         self.buff_processed = False
+        # NsPayloadReader of payload that is not read completely
+        self.payload_reader = None
+        # unpackers made by make_unpacker() are split into
+        # incremental netstring parsing and payload decoding
+        if hasattr(unpack_f, 'decode_f'):
+            self.decoder = NsDecoder(max_len=unpack_f.max_len, size=max_read)
+            self.decode_f = unpack_f.decode_f
+        else:
+            self.decoder = None
+            self.decode_f = None
+            if views:
+                raise ValueError('views mode requires unpack_f made by make_unpacker()')
+        if instrument is None:
+            instrument = self.instrument_default
+        if instrument:
+            # instrumentation is imported only when it is used
+            from .stats import REGISTRY, NsStreamStats
+            if instrument is True:
+                instrument = NsStreamStats('{}-{:x}'.format(type(fd).__name__, id(self)))
+            self.instr = REGISTRY.register(instrument, self)
+        else:
+            self.instr = None
+
+    def stats(self):
+        """Counters and histograms of instrumented stream.
+
+        Returns
+        -------
+        dict or None
+            See `netstrings.stats.NsStreamStats.snapshot`,
+            None if stream is not instrumented.
+
+        See `netstrings.stats` for example.
+
+        >>> NsStream(BytesIO(), instrument=False).stats() is None
+        True
+
+        """
+        if self.instr is None:
+            return None
+        return self.instr.snapshot()
 
     def write(self, payload):
         """Converts payload to netstring using `pack_f` and write it to file-like
@@ -354,8 +1223,168 @@ class NsStream:
         payload 
             Object to be packed.
     
+        In buffered mode netstring is appended to `wbuff` and written by
+        `flush()` when `flush_bytes` or `flush_delay` threshold is reached,
+        see `flush_delay`.
+
+        Returns
+        -------
+        int
+            Number of written (or buffered) bytes.
+
+        """
+        instr = self.instr
+        if instr is not None:
+            started = time.perf_counter()
+            ns = self.pack_f(payload)
+            instr.on_frame_out(len(ns), time.perf_counter() - started)
+        else:
+            ns = self.pack_f(payload)
+        if self.buffered:
+            return self._buffer_segments([ns], 1)
+        if instr is not None:
+            started = time.perf_counter()
+            n = self.fd.write(ns)
+            instr.on_write(n or 0, time.perf_counter() - started)
+            return n
+        return self.fd.write(ns)
+
+    def write_many(self, payloads):
+        """Converts payloads to netstrings and writes them with single vectored write.
+
+        Blocking call.
+        If `pack_f` was made by `make_packer`, payloads are not copied: length
+        headers, payloads and terminators are written as separate segments
+        by `write_iov`. Otherwise netstrings made by `pack_f` are segments.
+
+        Parameters
+        ----------
+        payloads : iterable
+            Objects to be packed.
+
+        Returns
+        -------
+        int
+            Number of written bytes.
+
+        >>> b_stream = BytesIO()
+        >>> ns_stream = NsStream(b_stream)
+        >>> ns_stream.write_many(['a', 'bc'])
+        9
+        >>> b_stream.getvalue()
+        b'1:a,2:bc,'
+
         """
-        return self.fd.write(self.pack_f(payload))
+        pack_f = self.pack_f
+        segments = []
+        if self.instr is not None:
+            segments = self._pack_many_instrumented(payloads)
+        elif hasattr(pack_f, 'encode_f'):
+            encode_f = pack_f.encode_f
+            for payload in payloads:
+                if encode_f is not None:
+                    payload = encode_f(payload)
+                segments.extend(pack_iov(payload, max_len=pack_f.max_len))
+        else:
+            segments = [pack_f(payload) for payload in payloads]
+        if not segments:
+            return 0
+        if self.buffered:
+            return self._buffer_segments(segments, len(segments) // 3 if hasattr(pack_f, 'encode_f') else len(segments))
+        return self._write_iov(segments)
+
+    def _pack_many_instrumented(self, payloads):
+        # write_many() packing with time of every netstring counted
+        pack_f = self.pack_f
+        instr = self.instr
+        perf_counter = time.perf_counter
+        segments = []
+        if hasattr(pack_f, 'encode_f'):
+            encode_f = pack_f.encode_f
+            for payload in payloads:
+                started = perf_counter()
+                if encode_f is not None:
+                    payload = encode_f(payload)
+                iov = pack_iov(payload, max_len=pack_f.max_len)
+                instr.on_frame_out(len(iov[0]) + len(payload) + 1, perf_counter() - started)
+                segments.extend(iov)
+        else:
+            for payload in payloads:
+                started = perf_counter()
+                ns = pack_f(payload)
+                instr.on_frame_out(len(ns), perf_counter() - started)
+                segments.append(ns)
+        return segments
+
+    def _write_iov(self, segments):
+        # write_iov() to `fd`, counted by instrumentation
+        instr = self.instr
+        if instr is None:
+            return write_iov(self.fd, segments)
+        started = time.perf_counter()
+        n = write_iov(self.fd, segments)
+        instr.on_write(n, time.perf_counter() - started)
+        return n
+
+    def _buffer_segments(self, segments, frames):
+        # buffered mode: collects netstrings and flushes them by thresholds
+        nbytes = sum([len(seg) for seg in segments])
+        if self.wbuff_time is None:
+            self.wbuff_time = time.monotonic()
+        self.wbuff.extend(segments)
+        self.wbuff_frames += frames
+        self.wbuff_bytes += nbytes
+        if self.flush_bytes is not None and self.wbuff_bytes >= self.flush_bytes:
+            self.flush()
+        elif self.flush_delay is not None and time.monotonic() - self.wbuff_time >= self.flush_delay:
+            self.flush()
+        return nbytes
+
+    def _flush_expired(self):
+        # reads flush buffered netstrings that wait for `flush_delay`,
+        # even if they do not block
+        if self.flush_delay is not None and time.monotonic() - self.wbuff_time >= self.flush_delay:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered netstrings to `fd` with single vectored write.
+
+        Blocking call.
+        Calls `on_flush(frames, nbytes)` if it was passed to constructor.
+
+        Returns
+        -------
+        tuple (int, int)
+            Number of netstrings and number of bytes written.
+
+        >>> b_stream = BytesIO()
+        >>> ns_stream = NsStream(b_stream, flush_bytes=10)
+        >>> ns_stream.write('abc')
+        6
+        >>> b_stream.getvalue()
+        b''
+        >>> ns_stream.write('defg')
+        7
+        >>> b_stream.getvalue()
+        b'3:abc,4:defg,'
+        >>> ns_stream.write('h')
+        4
+        >>> ns_stream.flush()
+        (1, 4)
+
+        """
+        if not self.wbuff:
+            return (0, 0)
+        segments = self.wbuff
+        frames = self.wbuff_frames
+        self.wbuff = []
+        self.wbuff_frames = 0
+        self.wbuff_bytes = 0
+        self.wbuff_time = None
+        nbytes = self._write_iov(segments)
+        if self.on_flush is not None:
+            self.on_flush(frames, nbytes)
+        return (frames, nbytes)
 
     def read(self):
         """Reads data form file-like object `fd` into internal buffer, parses it as netstring, 
@@ -374,22 +1403,35 @@ class NsStream:
         Any object
             The result of parsing netstring and unpacking it by `unpack_f`. 
             
+        In buffered mode buffered netstrings are flushed before blocking
+        read from `fd` or when `flush_delay` is expired.
+
         """
+        if self.wbuff:
+            self._flush_expired()
+        if self.payload_reader is not None:
+            self.payload_reader._skip()
+        if self.decoder is not None:
+            return self._read_decoder()
         if not self.buff_processed:
-            (payload, tail) = self.unpack_f(self.buff)
+            (payload, tail) = self._unpack_buff()
             if payload is not None:
                 self.buff = tail
                 return payload
             elif not self.eof:
                 # not all bytes arrived yet
+                if self.wbuff:
+                    self.flush()
                 while not self.eof:
-                    raw_b = self.fd.read(self.max_read)
+                    raw_b = self._fd_read(self.max_read)
                     # socket was closed
                     # file or stream  reach EOF
                     if raw_b == b'':
                         self.eof = True
                     self.buff += raw_b
-                    (payload, tail) = self.unpack_f(self.buff)
+                    if self.instr is not None:
+                        self.instr.on_buffer(len(self.buff))
+                    (payload, tail) = self._unpack_buff()
                     if payload is not None:
                         self.buff = tail
                         return payload
@@ -406,6 +1448,551 @@ class NsStream:
         else:
             return None
 
+    def _unpack_buff(self):
+        # custom unpack_f() of `buff`, counted by instrumentation
+        instr = self.instr
+        if instr is None:
+            return self.unpack_f(self.buff)
+        size = len(self.buff)
+        started = time.perf_counter()
+        (payload, tail) = self.unpack_f(self.buff)
+        if payload is not None:
+            instr.on_frame_in(size - len(tail), time.perf_counter() - started)
+        else:
+            # incomplete netstring is parsed again after the next read
+            instr.framing_time += time.perf_counter() - started
+        return (payload, tail)
+
+    def _fd_read(self, size):
+        # fd.read(), counted by instrumentation
+        instr = self.instr
+        if instr is None:
+            return self.fd.read(size)
+        started = time.perf_counter()
+        raw_b = self.fd.read(size)
+        instr.on_read(len(raw_b), time.perf_counter() - started)
+        return raw_b
+
+    def _fd_readinto(self, readinto, view):
+        # fd.readinto(), counted by instrumentation
+        instr = self.instr
+        if instr is None:
+            return readinto(view)
+        started = time.perf_counter()
+        n = readinto(view)
+        instr.on_read(n or 0, time.perf_counter() - started)
+        return n
+
+    def _fill(self):
+        # single read operation from `fd` into `decoder` buffer
+        # returns False if `fd` reach EOF
+        if self.eof:
+            return False
+        if self.wbuff:
+            # peer can wait for buffered requests before it responds
+            self.flush()
+        readinto = getattr(self.fd, 'readinto', None)
+        if readinto is not None:
+            n = self._fd_readinto(readinto, self.decoder.get_buffer(self.max_read))
+        else:
+            raw_b = self._fd_read(self.max_read)
+            n = len(raw_b)
+            self.decoder.feed(raw_b)
+        # socket was closed
+        # file or stream  reach EOF
+        if n == 0:
+            self.eof = True
+            return False
+        if readinto is not None:
+            self.decoder.buffer_updated(n)
+        if self.instr is not None:
+            self.instr.on_buffer(self.decoder.pending())
+        return True
+
+    def _read_decoder(self):
+        # the same as read(), but every received chunk is parsed only once
+        if self.instr is not None:
+            return self._read_decoder_instrumented()
+        next_frame = self.decoder.next_frame_view if self.views else self.decoder.next_frame
+        payload = next_frame()
+        while payload is None and self._fill():
+            payload = next_frame()
+        if payload is not None:
+            if self.decode_f is not None:
+                return self.decode_f(payload)
+            return payload
+        self._decoder_end()
+        return None
+
+    def _read_decoder_instrumented(self):
+        # _read_decoder() with framing and decoding time counted
+        instr = self.instr
+        started = time.perf_counter()
+        read_time = instr.read_time
+        next_frame = self.decoder.next_frame_view if self.views else self.decoder.next_frame
+        payload = next_frame()
+        while payload is None and self._fill():
+            payload = next_frame()
+        # time of reads from `fd` is already counted
+        instr.framing_time += time.perf_counter() - started - (instr.read_time - read_time)
+        if payload is None:
+            self._decoder_end()
+            return None
+        size = len(payload)
+        size += len(str(size)) + 2
+        if self.decode_f is None:
+            instr.on_frame_in(size)
+            return payload
+        started = time.perf_counter()
+        obj = self.decode_f(payload)
+        instr.on_frame_in(size, time.perf_counter() - started)
+        return obj
+
+    def _decoder_end(self):
+        # `fd` reach EOF, all received bytes must be parsed
+        if self.decoder.pending() == 0:
+            self.buff_processed = True
+        else:
+            raise NsStreamUnexpectedEnd('Unexpected end of byte stream. Buffer fragment (at begin):{}'.format(
+                        self.decoder._fragment()))
+
+    def _read_frames(self, max_items, views):
+        # raw payloads that can be parsed after single read operation,
+        # empty list means EOF
+        if self.wbuff:
+            self._flush_expired()
+        if self.payload_reader is not None:
+            self.payload_reader._skip()
+        instr = self.instr
+        if instr is not None:
+            started = time.perf_counter()
+            read_time = instr.read_time
+        next_frame = self.decoder.next_frame_view if views else self.decoder.next_frame
+        payload = next_frame()
+        while payload is None and self._fill():
+            payload = next_frame()
+        if payload is None:
+            self._decoder_end()
+            return []
+        frames = [payload]
+        while max_items is None or len(frames) < max_items:
+            payload = next_frame()
+            if payload is None:
+                break
+            frames.append(payload)
+        if instr is not None:
+            # payloads are decoded by caller
+            instr.framing_time += time.perf_counter() - started - (instr.read_time - read_time)
+            for payload in frames:
+                size = len(payload)
+                instr.on_frame_in(size + len(str(size)) + 2)
+        return frames
+
+    def read_batch(self, max_items=None):
+        """Reads all netstrings that can be parsed after single read operation.
+
+        Blocking call.
+        Waits for the first netstring like `read()`, then unpacks all
+        netstrings that already are in internal buffer without any more
+        read operations from `fd`.
+
+        Parameters
+        ----------
+        max_items : int or None
+            Maximum number of objects to return, None means no limit.
+
+        Returns
+        -------
+        list
+            Objects unpacked by `unpack_f`, empty list if `fd` reach EOF.
+
+        >>> b_stream = BytesIO(pack_str('a') + pack_str('b') + pack_str('c'))
+        >>> ns_stream = NsStream(b_stream)
+        >>> ns_stream.read_batch(max_items=2)
+        ['a', 'b']
+        >>> ns_stream.read_batch()
+        ['c']
+        >>> ns_stream.read_batch()
+        []
+
+        """
+        if self.decoder is not None:
+            frames = self._read_frames(max_items, self.views)
+            if self.decode_f is None:
+                return frames
+            if self.instr is not None:
+                return self._decode_instrumented(frames)
+            return [self.decode_f(payload) for payload in frames]
+        first = self.read()
+        if first is None:
+            return []
+        batch = [first]
+        while max_items is None or len(batch) < max_items:
+            (payload, tail) = self._unpack_buff()
+            if payload is None:
+                break
+            self.buff = tail
+            batch.append(payload)
+        return batch
+
+    def _decode_instrumented(self, frames):
+        # decode_f() of payloads counted by _read_frames()
+        decode_f = self.decode_f
+        unpack_time = self.instr.unpack_time
+        perf_counter = time.perf_counter
+        objs = []
+        for payload in frames:
+            started = perf_counter()
+            objs.append(decode_f(payload))
+            unpack_time.add(perf_counter() - started)
+        return objs
+
+    def read_stream(self, max_len=None):
+        """Parses length header of the next netstring and returns file-like
+        reader of its payload.
+
+        Blocking call.
+        Payload is not stored in memory: reader takes its bytes from `fd`
+        on demand, so payload can be bigger than memory. Until the payload
+        is read completely NsStream must not be read by other methods,
+        otherwise the rest of payload is skipped.
+
+        Parameters
+        ----------
+        max_len : int or None
+            Maximum payload length, None means no limit.
+
+        Returns
+        -------
+        None
+            Underlying `fd` object reach EOF and internal buffer is empty.
+        NsPayloadReader
+            Readable file-like object, its `length` is payload length.
+
+        >>> b_stream = BytesIO()
+        >>> ns_stream = NsStream(b_stream)
+        >>> ns_stream.write_stream(BytesIO(b'x' * 100000), 100000)
+        100008
+        >>> n = ns_stream.write('end')
+        >>> pos = b_stream.seek(0)
+        >>> reader = ns_stream.read_stream()
+        >>> reader.length
+        100000
+        >>> (len(reader.read(100)), len(reader.read()))
+        (100, 99900)
+        >>> ns_stream.read()
+        'end'
+        >>> ns_stream.read_stream() is None
+        True
+
+        """
+        if self.wbuff:
+            self._flush_expired()
+        if self.payload_reader is not None:
+            self.payload_reader._skip()
+        if self.buff_processed:
+            return None
+        if max_len is None:
+            max_len = sys.maxsize
+        max_header = _max_header(max_len)
+        if self.decoder is not None:
+            length = self.decoder.next_header(max_len, max_header)
+            while length is None and self._fill():
+                length = self.decoder.next_header(max_len, max_header)
+            if length is None:
+                self._decoder_end()
+                return None
+        else:
+            length = self._read_header(max_len, max_header)
+            if length is None:
+                return None
+        if self.instr is not None:
+            self.instr.on_frame_in(length + len(str(length)) + 2)
+        self.payload_reader = NsPayloadReader(self, length)
+        return self.payload_reader
+
+    def _read_header(self, max_len, max_header):
+        # read_stream() for custom `unpack_f`: parses header in `buff`
+        i = self.buff.find(b':')
+        while i == -1 and len(self.buff) <= max_header and not self.eof:
+            if self.wbuff:
+                self.flush()
+            raw_b = self._fd_read(self.max_read)
+            if raw_b == b'':
+                self.eof = True
+            self.buff += raw_b
+            if self.instr is not None:
+                self.instr.on_buffer(len(self.buff))
+            i = self.buff.find(b':')
+        fragment = '{} HEX:{}'.format(repr(self.buff[0:8]), hex_fragment(self.buff[0:8]))
+        if i == -1:
+            if self.buff == b'':
+                self.buff_processed = True
+                return None
+            if self.eof and self.buff.isdigit():
+                raise NsStreamUnexpectedEnd('Unexpected end of byte stream. Buffer fragment (at begin):{}'.format(
+                            fragment))
+            raise NsMalformed('Not found semicolon ":" as delimiter. Buffer fragment (at begin):{}'.format(fragment))
+        if i > max_header:
+            raise NsMalformed('Too long length header of netstring, max digits:{}. Buffer fragment (at begin):{}'.format(
+                            max_header, fragment))
+        header = self.buff[0:i]
+        if not header.isdigit():
+            raise NsMalformed('Cannot parse ASCII digits giving the length of netstring. Buffer fragment (at begin):{}'.format(
+                            fragment))
+        length = int(header)
+        if length > max_len:
+            raise NsMalformed('Too big netstring. len:{}, max_len:{}'.format(length, max_len))
+        self.buff = self.buff[i+1:]
+        return length
+
+    def _readinto_raw(self, view):
+        # reads bytes without parsing: received bytes first, then `fd`
+        if self.decoder is not None:
+            if self.decoder.pending():
+                chunk = self.decoder.take(len(view))
+                n = len(chunk)
+                view[0:n] = chunk
+                return n
+        elif self.buff:
+            n = min(len(view), len(self.buff))
+            view[0:n] = self.buff[0:n]
+            self.buff = self.buff[n:]
+            return n
+        if self.eof:
+            return 0
+        if self.wbuff:
+            self.flush()
+        readinto = getattr(self.fd, 'readinto', None)
+        if readinto is not None:
+            n = self._fd_readinto(readinto, view)
+        else:
+            raw_b = self._fd_read(len(view))
+            n = len(raw_b)
+            view[0:n] = raw_b
+        if not n:
+            self.eof = True
+        return n
+
+    def write_stream(self, fileobj, length):
+        """Writes netstring with payload copied from file-like object by chunks.
+
+        Blocking call.
+        Payload is not stored in memory, it is read from `fileobj` and
+        written to `fd` by chunks of STREAM_COPY_SIZE bytes, e.g. payload
+        of other NsStream returned by `read_stream()`. Buffered netstrings
+        are flushed before it.
+
+        Parameters
+        ----------
+        fileobj : file-like object in binary mode
+            Source of payload.
+        length : int
+            Payload length, exactly `length` bytes are read from `fileobj`.
+
+        Returns
+        -------
+        int
+            Number of written bytes.
+
+        Raises
+        ------
+        NsStreamUnexpectedEnd
+            `fileobj` has less than `length` bytes, incomplete netstring
+            is already written.
+
+        """
+        if self.wbuff:
+            self.flush()
+        segments = [b'%d:' % length]
+        buff = memoryview(bytearray(min(length, STREAM_COPY_SIZE)))
+        readinto = getattr(fileobj, 'readinto', None)
+        remaining = length
+        n = 0
+        while remaining:
+            chunk = buff[0:min(remaining, len(buff))]
+            if readinto is not None:
+                k = readinto(chunk)
+            else:
+                raw_b = fileobj.read(len(chunk))
+                k = len(raw_b)
+                chunk[0:k] = raw_b
+            if not k:
+                raise NsStreamUnexpectedEnd('Unexpected end of file object. Payload bytes missing:{}'.format(remaining))
+            remaining -= k
+            segments.append(chunk[0:k])
+            if not remaining:
+                segments.append(b',')
+            n += self._write_iov(segments)
+            segments = []
+        if segments:
+            # empty payload
+            segments.append(b',')
+            n += self._write_iov(segments)
+        if self.instr is not None:
+            self.instr.on_frame_out(n)
+        return n
+
+    def write_file(self, path_or_fd, offset=0, count=None):
+        """Writes netstring with file contents as payload.
+
+        Blocking call.
+        If `fd` is socket (or made by `sock.makefile()`), payload is sent by
+        `socket.sendfile`: file contents are copied by kernel without
+        passing through user space. Otherwise payload is copied by chunks,
+        see `write_stream`. Buffered netstrings are flushed before it.
+
+        Parameters
+        ----------
+        path_or_fd : str, path-like object, int or file object in binary mode
+            File to be sent. File that is opened by path is closed at the
+            end, file descriptor or file object is not closed, its current
+            position is not used.
+        offset : int
+            Offset of payload in file.
+        count : int or None
+            Payload length, None means up to the end of regular file.
+
+        Returns
+        -------
+        int
+            Number of written bytes.
+
+        Raises
+        ------
+        ValueError
+            Negative `offset` or `count`, `count` is None and file is not
+            regular or `offset` is beyond its end. Nothing is written.
+        NsStreamUnexpectedEnd
+            File has less than `count` bytes after `offset`, incomplete
+            netstring is already written.
+
+        >>> import tempfile
+        >>> with tempfile.NamedTemporaryFile() as f:
+        ...     n = f.write(b'hello world')
+        ...     f.flush()
+        ...     (a, b) = socket.socketpair()
+        ...     with a, b:
+        ...         NsStream(a.makefile('rwb', buffering=0)).write_file(f.name, offset=6)
+        ...         b.recv(100)
+        8
+        b'5:world,'
+        >>> with tempfile.NamedTemporaryFile() as f:
+        ...     NsStream(BytesIO()).write_file(f.name, offset=10)  # doctest: +IGNORE_EXCEPTION_DETAIL
+        Traceback (most recent call last):
+        ValueError: Offset 10 is beyond end of file of size 0
+
+        """
+        if offset < 0 or (count is not None and count < 0):
+            raise ValueError('Negative offset or count: {}, {}'.format(offset, count))
+        if isinstance(path_or_fd, int):
+            f = open(path_or_fd, 'rb', closefd=False)
+            own_file = True
+        elif hasattr(path_or_fd, 'fileno'):
+            f = path_or_fd
+            own_file = False
+        else:
+            f = open(path_or_fd, 'rb')
+            own_file = True
+        try:
+            if count is None:
+                st = os.fstat(f.fileno())
+                if not stat.S_ISREG(st.st_mode):
+                    raise ValueError('Count is required for file that is not regular')
+                if offset > st.st_size:
+                    raise ValueError('Offset {} is beyond end of file of size {}'.format(offset, st.st_size))
+                count = st.st_size - offset
+            sock = _socket_of(self.fd)
+            if sock is None:
+                f.seek(offset)
+                return self.write_stream(f, count)
+            if self.wbuff:
+                self.flush()
+            header = b'%d:' % count
+            started = time.perf_counter()
+            # header is coalesced with the first bytes of payload
+            sock.sendall(header, getattr(socket, 'MSG_MORE', 0))
+            sent = sock.sendfile(f, offset, count) if count else 0
+            if sent < count:
+                raise NsStreamUnexpectedEnd('Unexpected end of file object. Payload bytes missing:{}'.format(
+                            count - sent))
+            sock.sendall(b',')
+            n = len(header) + sent + 1
+            if self.instr is not None:
+                self.instr.on_write(n, time.perf_counter() - started)
+                self.instr.on_frame_out(n)
+            return n
+        finally:
+            if own_file:
+                f.close()
+
+    def iter_parallel(self, executor=None, max_workers=None, batch_size=PARALLEL_BATCH_SIZE, max_in_flight=None):
+        """Iterates over objects decoded by process pool.
+
+        Blocking call.
+        Calling thread only reads and parses netstrings, batches of raw
+        payloads are decoded by `decode_f` in worker processes. Objects are
+        yielded in order of arrival. When `max_in_flight` batches are being
+        decoded reading from `fd` waits for the oldest one.
+        Requires `unpack_f` made by `make_unpacker` with picklable `decode_f`.
+
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor or None
+            Pool for decoding, None means new ProcessPoolExecutor
+            that is shut down at the end of iteration.
+        max_workers : int or None
+            Number of processes of new ProcessPoolExecutor.
+        batch_size : int
+            Maximum number of payloads decoded by single task.
+        max_in_flight : int or None
+            Maximum number of batches being decoded,
+            None means two batches per worker.
+
+        Yields
+        ------
+        Any object
+            Payload decoded by `decode_f`.
+
+        >>> b_stream = BytesIO(b''.join([pack(bytes(str(i), 'utf8')) for i in range(100)]))
+        >>> ns_stream = NsStream(b_stream, max_read=64, unpack_f=make_unpacker(int))
+        >>> list(ns_stream.iter_parallel(max_workers=2)) == list(range(100))
+        True
+
+        """
+        if self.decoder is None:
+            raise ValueError('iter_parallel requires unpack_f made by make_unpacker()')
+        if self.decode_f is None:
+            # nothing to decode
+            frames = self._read_frames(batch_size, False)
+            while frames:
+                yield from frames
+                frames = self._read_frames(batch_size, False)
+            return
+        own_executor = executor is None
+        if own_executor:
+            # multiprocessing is imported only when it is used
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(max_workers)
+        if max_in_flight is None:
+            max_in_flight = 2 * (max_workers or os.cpu_count() or 1)
+        in_flight = deque()
+        try:
+            frames = self._read_frames(batch_size, False)
+            while frames:
+                in_flight.append(executor.submit(_decode_batch, self.decode_f, frames))
+                # waits for the oldest batch only if the window is full
+                while len(in_flight) >= max_in_flight or (in_flight and in_flight[0].done()):
+                    yield from in_flight.popleft().result()
+                frames = self._read_frames(batch_size, False)
+            while in_flight:
+                yield from in_flight.popleft().result()
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
+
     def __iter__(self):
         # This breaks best practice regarding
         # distinct iterators over iterable.
@@ -0,0 +1,273 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Pickle protocol 5 with out-of-band buffers over netstrings.
+
+Large buffers of pickled object (`pickle.PickleBuffer` wrappers, objects
+that are reduced to them, e.g. numpy arrays, and bytes, bytearray and
+1-d byte memoryview objects) are not copied into pickle stream. Message is a metadata netstring followed by a netstring
+for every out-of-band buffer:
+
+    <len>:<count netstring><pickle data>,<len>:<buffer 1>,<len>:<buffer 2>,...
+
+Buffers are sent by single vectored write without copying and received
+directly into their own bytearrays (or taken as memoryviews of buffer by
+`unpack_oob`). Requires Python 3.8 or newer.
+
+    write_oob(nstream, {'name': 'frame', 'pixels': pixels})
+    obj = read_oob(nstream, max_len=1 << 30)
+"""
+
+import io
+import pickle
+
+from .netstrings import NS_MAX_LEN, NsMalformed, NsStreamUnexpectedEnd, pack_iov, unpack_view, write_iov
+
+# Default minimum size of buffer that is sent out-of-band,
+# smaller buffers are pickled in-band
+OOB_MIN_SIZE = 4096
+
+class _OobPickler(pickle.Pickler):
+    # C pickler saves bytes and bytearray without calling reducer_override,
+    # so large ones are replaced by persistent ids with PickleBuffer,
+    # that is passed to buffer_callback
+    def __init__(self, file, threshold, buffer_callback):
+        super().__init__(file, protocol=5, buffer_callback=buffer_callback)
+        self.threshold = threshold
+
+    def persistent_id(self, obj):
+        obj_type = type(obj)
+        if obj_type is bytes or obj_type is bytearray:
+            if len(obj) >= self.threshold:
+                return (obj_type.__name__, pickle.PickleBuffer(obj))
+        elif obj_type is memoryview:
+            if obj.ndim == 1 and obj.format == 'B' and obj.c_contiguous and obj.nbytes >= self.threshold:
+                return ('memoryview', pickle.PickleBuffer(obj))
+        return None
+
+class _OobUnpickler(pickle.Unpickler):
+    # restores types of buffers replaced by _OobPickler, out-of-band
+    # buffer is bytearray of read_oob or memoryview of unpack_oob
+    # (read-only for bytes)
+    def persistent_load(self, pid):
+        (kind, buf) = pid
+        if kind == 'bytes':
+            return bytes(buf)
+        if kind == 'bytearray':
+            return buf if type(buf) is bytearray else bytearray(buf)
+        if kind == 'memoryview':
+            return memoryview(buf)
+        raise pickle.UnpicklingError('Unknown persistent id kind {!r} of out-of-band buffer'.format(kind))
+
+def _loads(data, buffers):
+    return _OobUnpickler(io.BytesIO(data), buffers=buffers).load()
+
+def pack_oob(obj, threshold=OOB_MIN_SIZE, max_len=NS_MAX_LEN, auto=True):
+    """Pickles object with protocol 5 to segments of netstrings.
+
+    Parameters
+    ----------
+    obj
+        Object to be pickled.
+    threshold : int
+        Minimum size of buffer that is sent out-of-band.
+    max_len : int
+        Maximum length of every netstring, see `pack`.
+    auto : bool
+        Send bytes, bytearray and 1-d byte memoryview objects of at least
+        `threshold` bytes out-of-band, they are unpickled as the same
+        types (bytes are copied). It costs Python call for every pickled
+        object, so objects of many small items are pickled faster with
+        False, then only `pickle.PickleBuffer` is sent out-of-band.
+
+    Returns
+    -------
+    list
+        Segments of metadata netstring and netstrings of buffers,
+        see `write_iov`. Buffers are memoryviews of `obj` data.
+
+    >>> data = bytearray(b'x' * 10)
+    >>> segments = pack_oob([1, pickle.PickleBuffer(data)], threshold=0)
+    >>> len(segments)
+    7
+    >>> (segments[-3], segments[-2].obj is data, segments[-1])
+    (b'10:', True, b',')
+    >>> len(pack_oob({'raw': b'x' * 5000}, max_len=10000))
+    7
+
+    """
+    buffers = []
+
+    def buffer_callback(pickle_buffer):
+        # returns True for buffers that are pickled in-band
+        try:
+            raw = pickle_buffer.raw()
+        except BufferError:
+            # not contiguous
+            return True
+        if raw.nbytes < threshold:
+            return True
+        buffers.append(raw)
+        return False
+
+    if auto:
+        f = io.BytesIO()
+        _OobPickler(f, threshold, buffer_callback).dump(obj)
+        data = f.getbuffer()
+    else:
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffer_callback)
+    count = b'%d' % len(buffers)
+    count_ns = b'%d:%s,' % (len(count), count)
+    meta_header = b'%d:' % (len(count_ns) + len(data))
+    total_len = len(meta_header) + len(count_ns) + len(data) + 1
+    if total_len > max_len:
+        raise NsMalformed('Too big netstring. len:{}, max_len:{}'.format(total_len, max_len))
+    segments = [meta_header, count_ns, data, b',']
+    for raw in buffers:
+        segments.extend(pack_iov(raw, max_len=max_len))
+    return segments
+
+def _parse_meta(meta, max_len):
+    # number of out-of-band buffers and pickle data of metadata payload
+    (count, offset) = unpack_view(meta, 0, max_len)
+    if count is None or not count.tobytes().isdigit():
+        raise NsMalformed('Cannot parse number of out-of-band buffers of pickle metadata')
+    return (int(count.tobytes()), memoryview(meta)[offset:])
+
+def unpack_oob(buf, offset=0, max_len=NS_MAX_LEN):
+    """Unpickles object made by `pack_oob` from buffer.
+
+    Out-of-band buffers are memoryviews of `buf`, they are not copied.
+
+    Parameters
+    ----------
+    buf : bytes-like object
+        Any object that supports buffer protocol, see `unpack_view`.
+    offset : int
+        Offset of metadata netstring in `buf`.
+    max_len : int
+        Maximum payload length of every netstring, see `unpack`.
+
+    Returns
+    -------
+    tuple
+        Unpickled object and offset after its netstrings, or (None, offset)
+        if not all its netstrings are in `buf`.
+
+    >>> buf = b''.join(pack_oob({'data': pickle.PickleBuffer(b'x' * 10)}, threshold=0))
+    >>> (obj, offset) = unpack_oob(buf)
+    >>> (bytes(obj['data']), obj['data'].obj is buf, offset)
+    (b'xxxxxxxxxx', True, 46)
+    >>> unpack_oob(buf[:-1])
+    (None, 0)
+    >>> buf = b''.join(pack_oob([b'x' * 10, bytearray(b'y' * 10)], threshold=0))
+    >>> unpack_oob(buf)[0]
+    [b'xxxxxxxxxx', bytearray(b'yyyyyyyyyy')]
+
+    """
+    (meta, next_offset) = unpack_view(buf, offset, max_len)
+    if meta is None:
+        return (None, offset)
+    (count, data) = _parse_meta(meta, max_len)
+    buffers = []
+    for i in range(count):
+        (payload, next_offset) = unpack_view(buf, next_offset, max_len)
+        if payload is None:
+            return (None, offset)
+        buffers.append(payload)
+    return (_loads(data, buffers), next_offset)
+
+def write_oob(nstream, obj, threshold=OOB_MIN_SIZE, max_len=NS_MAX_LEN, auto=True):
+    """Writes object pickled by `pack_oob` to NsStream with single vectored write.
+
+    Blocking call.
+    Buffered netstrings of `nstream` are flushed before it.
+
+    Parameters
+    ----------
+    nstream : NsStream
+        Destination stream.
+    obj
+        Object to be pickled.
+    threshold : int
+        Minimum size of buffer that is sent out-of-band.
+    max_len : int
+        Maximum length of every netstring, see `pack`.
+    auto : bool
+        See `pack_oob`.
+
+    Returns
+    -------
+    int
+        Number of written bytes.
+
+    """
+    segments = pack_oob(obj, threshold=threshold, max_len=max_len, auto=auto)
+    if nstream.wbuff:
+        nstream.flush()
+    return write_iov(nstream.fd, segments)
+
+def _read_payload(reader):
+    # reads streamed payload into its own buffer
+    buff = bytearray(reader.length)
+    view = memoryview(buff)
+    n = 0
+    while n < reader.length:
+        n += reader.readinto(view[n:])
+    # zero length payload, terminator is checked by the last read
+    reader.read()
+    return buff
+
+def read_oob(nstream, max_len=NS_MAX_LEN):
+    """Reads object written by `write_oob` from NsStream.
+
+    Blocking call.
+    Every out-of-band buffer is read from `fd` directly into its own
+    bytearray by `NsStream.read_stream()`.
+
+    Parameters
+    ----------
+    nstream : NsStream
+        Source stream.
+    max_len : int
+        Maximum payload length of every netstring, see `unpack`.
+
+    Returns
+    -------
+    None
+        `fd` reach EOF.
+    Any object
+        Unpickled object.
+
+    >>> from io import BytesIO
+    >>> from netstrings import NsStream
+    >>> nstream = NsStream(BytesIO())
+    >>> write_oob(nstream, ('abc', pickle.PickleBuffer(bytearray(10000))), max_len=20000)
+    10036
+    >>> pos = nstream.fd.seek(0)
+    >>> (name, data) = read_oob(nstream, max_len=10000)
+    >>> (name, len(data))
+    ('abc', 10000)
+    >>> pos = nstream.fd.tell()
+    >>> write_oob(nstream, bytearray(10000), max_len=20000)
+    10043
+    >>> pos = nstream.fd.seek(pos)
+    >>> type(read_oob(nstream, max_len=10000))
+    <class 'bytearray'>
+    >>> read_oob(nstream) is None
+    True
+
+    """
+    reader = nstream.read_stream(max_len)
+    if reader is None:
+        return None
+    (count, data) = _parse_meta(_read_payload(reader), max_len)
+    buffers = []
+    for i in range(count):
+        reader = nstream.read_stream(max_len)
+        if reader is None:
+            raise NsStreamUnexpectedEnd('Unexpected end of byte stream. Out-of-band buffers missing:{}'.format(
+                        count - i))
+        buffers.append(_read_payload(reader))
+    return _loads(data, buffers)
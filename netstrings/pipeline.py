@@ -0,0 +1,464 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Pipelined request/response clients.
+
+Requests are written back-to-back without waiting for responses, so one
+connection is not limited to one round-trip per RTT. Requests submitted
+while the previous batch is being sent are joined into single send.
+Server must respond to every request in order of arrival: responses are
+matched to requests in FIFO order.
+
+    client = NsPipelineClient(NsStream(sock.makefile('rwb', buffering=0)))
+    futures = [client.submit('req {}'.format(i)) for i in range(1000)]
+    responses = [f.result() for f in futures]
+    client.close()
+
+    client = await open_pipeline('127.0.0.1', 9000)
+    future = await client.submit('req')
+    resp = await future
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import Future
+import socket
+import threading
+import time
+
+from .netstrings import NsMalformed, NsStreamUnexpectedEnd, _socket_of, write_iov
+
+# Default maximum number of requests waiting for responses
+PIPELINE_MAX_IN_FLIGHT = 128
+
+class _PipelineStats:
+    # counters shared by sync and asyncio clients
+    # container of requests waiting for responses
+    in_flight_type = deque
+
+    def _init_stats(self, on_latency):
+        self.on_latency = on_latency
+        self.counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'batches': 0,
+                         'latency': 0.0, 'max_latency': 0.0}
+
+    def _record(self, future, started):
+        latency = time.perf_counter() - started
+        future.latency = latency
+        counters = self.counters
+        counters['completed'] += 1
+        counters['latency'] += latency
+        if latency > counters['max_latency']:
+            counters['max_latency'] = latency
+        if self.on_latency is not None:
+            self.on_latency(latency)
+
+    def _in_flight_entries(self):
+        # (future, submit time) of all requests waiting for responses
+        return list(self.in_flight)
+
+    def _take_in_flight(self):
+        in_flight = self._in_flight_entries()
+        self.in_flight.clear()
+        return in_flight
+
+    def stats(self):
+        """Statistics of client.
+
+        Returns
+        -------
+        dict
+            Keys: submitted, completed, failed (requests), in_flight,
+            batches (send operations), avg_batch (requests per send),
+            latency (total seconds), avg_latency, max_latency.
+
+        """
+        stats = dict(self.counters)
+        stats['in_flight'] = len(self.in_flight)
+        stats['avg_batch'] = stats['submitted'] / stats['batches'] if stats['batches'] else 0.0
+        stats['avg_latency'] = stats['latency'] / stats['completed'] if stats['completed'] else 0.0
+        return stats
+
+class NsPipelineClient(_PipelineStats):
+    """
+    Pipelined client over NsStream, thread-safe.
+
+    Writer thread sends all requests submitted so far by single vectored
+    write, reader thread reads responses and resolves futures in order
+    of requests. `submit()` blocks when `max_in_flight` requests wait
+    for responses. If connection fails, all waiting futures get the
+    exception and new requests are rejected.
+
+    Connection must be a socket (or its unbuffered file object), `close()`
+    shuts it down to stop the reader thread.
+
+    Attributes
+    ----------
+    nstream : NsStream
+        Connection, its `pack_f` and `unpack_f` are used.
+    max_in_flight : int
+        Maximum number of requests waiting for responses.
+    on_latency
+        Function `on_latency(seconds)` called for every response or None.
+        Latency is also set as `latency` attribute of future.
+    error : Exception or None
+        Exception that broke connection.
+
+    Methods
+    -------
+    submit(req)
+        Sends request, returns concurrent.futures.Future of response.
+    request(req, timeout)
+        Sends request and waits for response.
+    stats()
+        Statistics of client.
+    close(timeout)
+        Waits for responses and stops client.
+
+    >>> from netstrings import NsStream
+    >>> from netstrings.reactor import NsReactor
+    >>> reactor = NsReactor(lambda conn, obj: obj.upper())
+    >>> server_sock = reactor.listen('127.0.0.1', 0)
+    >>> thread = threading.Thread(target=reactor.run, args=(0.1,))
+    >>> thread.start()
+    >>> sock = socket.create_connection(server_sock.getsockname())
+    >>> client = NsPipelineClient(NsStream(sock.makefile('rwb', buffering=0)))
+    >>> futures = [client.submit(req) for req in ['a', 'b', 'c']]
+    >>> [f.result() for f in futures]
+    ['A', 'B', 'C']
+    >>> client.stats()['completed']
+    3
+    >>> client.close()
+    >>> client.error is None
+    True
+    >>> sock.close()
+    >>> reactor.stop()
+    >>> thread.join()
+    >>> reactor.close()
+
+    None is valid response, e.g. of pickle unpacker:
+
+    >>> import pickle
+    >>> from netstrings import make_packer, make_unpacker
+    >>> (a, b) = socket.socketpair()
+    >>> client = NsPipelineClient(NsStream(a.makefile('rwb', buffering=0),
+    ...         pack_f=make_packer(pickle.dumps), unpack_f=make_unpacker(pickle.loads)))
+    >>> future = client.submit('req')
+    >>> b.sendall(make_packer(pickle.dumps)(None))
+    >>> (future.result(timeout=5), client.error)
+    (None, None)
+    >>> client.close()
+    >>> (a.close(), b.close())
+    (None, None)
+
+    Other file objects are refused, nothing could stop the reader:
+
+    >>> import io
+    >>> NsPipelineClient(NsStream(io.BytesIO()))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ValueError: NsPipelineClient needs socket connection
+
+    """
+    def __init__(self, nstream, max_in_flight=PIPELINE_MAX_IN_FLIGHT, on_latency=None):
+        if _socket_of(nstream.fd) is None:
+            raise ValueError('{} needs socket connection'.format(type(self).__name__))
+        self.nstream = nstream
+        self.max_in_flight = max_in_flight
+        self._init_stats(on_latency)
+        self.window = threading.BoundedSemaphore(max_in_flight)
+        self.cond = threading.Condition()
+        # packed requests that are not sent yet
+        self.pending = []
+        # (future, submit time) of requests waiting for responses
+        self.in_flight = self.in_flight_type()
+        self.error = None
+        self.closing = False
+        self.writer = threading.Thread(target=self._write_loop, name='ns-pipeline-writer', daemon=True)
+        self.reader = threading.Thread(target=self._read_loop, name='ns-pipeline-reader', daemon=True)
+        self.writer.start()
+        self.reader.start()
+
+    def submit(self, req):
+        """Sends request without waiting for response.
+
+        Blocking call if `max_in_flight` requests wait for responses.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of response.
+
+        """
+        ns = self.nstream.pack_f(req)
+        self.window.acquire()
+        future = Future()
+        with self.cond:
+            if self.error is not None or self.closing:
+                self.window.release()
+                raise self.error if self.error is not None else ValueError('NsPipelineClient is closed')
+            self.in_flight.append((future, time.perf_counter()))
+            self.pending.append(ns)
+            self.counters['submitted'] += 1
+            self.cond.notify_all()
+        return future
+
+    def request(self, req, timeout=None):
+        """Sends request and waits for response.
+        """
+        return self.submit(req).result(timeout)
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closing and self.error is None:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                segments = self.pending
+                self.pending = []
+                self.counters['batches'] += 1
+            try:
+                write_iov(self.nstream.fd, segments)
+            except OSError as e:
+                self._fail(e)
+                return
+
+    def _read_loop(self):
+        try:
+            while True:
+                resp = self.nstream.read()
+                with self.cond:
+                    # None is valid response of e.g. pickle unpacker
+                    if resp is None and self.nstream.buff_processed:
+                        raise NsStreamUnexpectedEnd('Connection is closed, requests in flight:{}'.format(
+                                    len(self.in_flight)))
+                    if not self.in_flight:
+                        raise NsMalformed('Unexpected response without request')
+                    (future, started) = self.in_flight.popleft()
+                    self._record(future, started)
+                    if not self.in_flight:
+                        # close() waits for it
+                        self.cond.notify_all()
+                self.window.release()
+                future.set_result(resp)
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        # connection is broken, all waiting requests fail
+        with self.cond:
+            if self.closing and not self.in_flight:
+                # end of connection shut down by close()
+                return
+            if self.error is None:
+                self.error = error
+            in_flight = self._take_in_flight()
+            self.pending = []
+            self.counters['failed'] += len(in_flight)
+            self.cond.notify_all()
+        for (future, started) in in_flight:
+            self.window.release()
+            future.set_exception(error)
+
+    def close(self, timeout=None):
+        """Waits for responses to submitted requests and stops client.
+
+        Blocking call.
+        Socket is shut down (not closed) to stop reader thread.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time of waiting for responses, seconds.
+
+        """
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self.in_flight and self.error is None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+        self.writer.join(timeout)
+        try:
+            _socket_of(self.nstream.fd).shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.reader.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class _TimedFuture(asyncio.Future):
+    # asyncio.Future with `latency` attribute
+    latency = None
+
+class AsyncNsPipelineClient(_PipelineStats):
+    """
+    Pipelined client over AsyncNsStream.
+
+    Requests submitted during one iteration of event loop are written to
+    transport together. Must be created in running event loop, reader
+    task is started by constructor.
+
+    Attributes
+    ----------
+    nstream : AsyncNsStream
+        Connection, its `pack_f` and `unpack_f` are used.
+    max_in_flight : int
+        Maximum number of requests waiting for responses.
+    on_latency
+        Function `on_latency(seconds)` called for every response or None.
+        Latency is also set as `latency` attribute of future.
+    error : Exception or None
+        Exception that broke connection.
+
+    Methods
+    -------
+    submit(req)
+        Coroutine, sends request, returns asyncio.Future of response.
+    request(req)
+        Coroutine, sends request and waits for response.
+    stats()
+        Statistics of client.
+    close()
+        Coroutine, waits for responses and closes connection.
+
+    >>> from netstrings.server import serve
+    >>> async def demo():
+    ...     async def handler(conn, obj):
+    ...         return obj.upper()
+    ...     server = await serve(handler, '127.0.0.1', 0)
+    ...     client = await open_pipeline('127.0.0.1', server.sockets[0].getsockname()[1])
+    ...     futures = [await client.submit(req) for req in ['a', 'b', 'c']]
+    ...     responses = await asyncio.gather(*futures)
+    ...     await client.close()
+    ...     server.close()
+    ...     await server.wait_closed()
+    ...     return (responses, client.stats()['batches'], client.error)
+    >>> asyncio.run(demo())
+    (['A', 'B', 'C'], 1, None)
+
+    """
+    def __init__(self, nstream, max_in_flight=PIPELINE_MAX_IN_FLIGHT, on_latency=None):
+        self.nstream = nstream
+        self.max_in_flight = max_in_flight
+        self._init_stats(on_latency)
+        self.loop = asyncio.get_running_loop()
+        self.window = asyncio.Semaphore(max_in_flight)
+        self.pending = []
+        self.in_flight = self.in_flight_type()
+        self.flush_scheduled = False
+        self.error = None
+        self.closing = False
+        self.reader = self.loop.create_task(self._read_loop())
+
+    async def submit(self, req):
+        """Sends request without waiting for response.
+
+        Waits if `max_in_flight` requests wait for responses.
+
+        Returns
+        -------
+        asyncio.Future
+            Future of response.
+
+        """
+        ns = self.nstream.pack_f(req)
+        await self.window.acquire()
+        if self.error is not None:
+            self.window.release()
+            raise self.error
+        future = _TimedFuture()
+        self.in_flight.append((future, time.perf_counter()))
+        self.pending.append(ns)
+        self.counters['submitted'] += 1
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self._flush)
+        return future
+
+    async def request(self, req):
+        """Sends request and waits for response.
+        """
+        return await (await self.submit(req))
+
+    def _flush(self):
+        # all requests submitted during loop iteration
+        self.flush_scheduled = False
+        if self.pending and self.error is None:
+            self.nstream.writer.writelines(self.pending)
+            self.counters['batches'] += 1
+        self.pending = []
+
+    async def _read_loop(self):
+        try:
+            while True:
+                resp = await self.nstream.read()
+                if resp is None and self.nstream.buff_processed:
+                    raise NsStreamUnexpectedEnd('Connection is closed, requests in flight:{}'.format(
+                                len(self.in_flight)))
+                if not self.in_flight:
+                    raise NsMalformed('Unexpected response without request')
+                (future, started) = self.in_flight.popleft()
+                self._record(future, started)
+                self.window.release()
+                if not future.done():
+                    future.set_result(resp)
+        except asyncio.CancelledError:
+            self._fail(NsStreamUnexpectedEnd('Connection is closed'))
+            raise
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        if self.closing and not self.in_flight:
+            # reader cancelled by close()
+            return
+        if self.error is None:
+            self.error = error
+        in_flight = self._take_in_flight()
+        self.pending = []
+        self.counters['failed'] += len(in_flight)
+        for (future, started) in in_flight:
+            self.window.release()
+            if not future.done():
+                future.set_exception(error)
+
+    async def close(self):
+        """Waits for responses to submitted requests and closes connection.
+        """
+        in_flight = self._in_flight_entries()
+        if in_flight:
+            await asyncio.gather(*[future for (future, started) in in_flight], return_exceptions=True)
+        self.closing = True
+        self.reader.cancel()
+        try:
+            await self.reader
+        except asyncio.CancelledError:
+            pass
+        await self.nstream.close()
+
+async def open_pipeline(host, port, max_in_flight=PIPELINE_MAX_IN_FLIGHT, on_latency=None, **kwargs):
+    """Opens TCP connection and returns AsyncNsPipelineClient over it.
+
+    Parameters
+    ----------
+    host, port
+        Server address.
+    kwargs
+        Passed to `netstrings.aio.open_connection`.
+
+    Returns
+    -------
+    AsyncNsPipelineClient
+
+    """
+    from .aio import open_connection
+    nstream = await open_connection(host, port, **kwargs)
+    return AsyncNsPipelineClient(nstream, max_in_flight=max_in_flight, on_latency=on_latency)
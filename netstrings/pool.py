@@ -0,0 +1,357 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Pool of client netstring connections.
+
+NsClientPool keeps warm NsStream connections for every endpoint, so
+short exchanges do not pay for TCP handshake. Connections are checked
+out by one thread at a time, the pool is thread-safe.
+
+    pool = NsClientPool(max_size=8)
+    with pool.connection(('127.0.0.1', 9000)) as nstream:
+        nstream.write('Hello')
+        resp = nstream.read()
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import socket
+import threading
+import time
+
+from .netstrings import STREAM_MAX_READ, NsError, NsStream, pack_str_strict, unpack_str_strict
+
+# Default maximum number of connections per endpoint
+POOL_MAX_SIZE = 8
+
+# Default maximum idle time of pooled connection, seconds
+POOL_MAX_IDLE = 60.0
+
+class NsPoolTimeout(NsError):
+    """
+    No connection became available in time.
+    """
+    pass
+
+class PooledNsStream(NsStream):
+    """
+    NsStream over pooled socket connection.
+
+    Attributes
+    ----------
+    sock : socket.socket
+        Connected socket.
+    address : tuple
+        Endpoint of connection.
+    created : float
+        `time.monotonic()` of connection.
+    last_used : float
+        `time.monotonic()` of the last check in.
+    uses : int
+        Number of check outs.
+
+    """
+    def __init__(self, sock, address, **kwargs):
+        super().__init__(sock.makefile('rwb', buffering=0), **kwargs)
+        self.sock = sock
+        self.address = address
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.uses = 0
+
+    def is_clean(self):
+        """Connection has no unread or unwritten data.
+        """
+        if self.eof or self.buff or self.wbuff or self.payload_reader is not None:
+            return False
+        return self.decoder is None or self.decoder.pending() == 0
+
+    def is_alive(self):
+        """Checks without blocking that peer did not close connection
+        and did not send unexpected data.
+        """
+        try:
+            self.sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+        # b'' is closed connection, any byte is stale response
+        return False
+
+    def close(self):
+        """Closes socket.
+        """
+        self.fd.close()
+        self.sock.close()
+
+class _Endpoint:
+    # connections of single endpoint
+    def __init__(self, lock):
+        self.idle = deque()
+        # idle and checked out connections and connections being opened
+        self.size = 0
+        # waiters for connection to this endpoint only, lock is shared by pool
+        self.cond = threading.Condition(lock)
+
+class NsClientPool:
+    """
+    Thread-safe pool of NsStream connections to many endpoints.
+
+    Checked out connection is used by single thread until it is checked
+    in. Idle connections are reused in LIFO order, so the warmest one is
+    taken first. Connections that are idle longer than `max_idle`,
+    closed by peer or have unread data are retired on check out, broken
+    ones are retired on check in.
+
+    Attributes
+    ----------
+    max_size : int
+        Maximum number of connections per endpoint, check out waits
+        when all of them are in use.
+    max_idle : float or None
+        Maximum idle time of connection, seconds.
+    timeout : float or None
+        Default maximum time of waiting for connection, seconds.
+    connect_timeout : float or None
+        Timeout of `socket.create_connection`.
+    stream_kwargs : dict
+        Arguments of NsStream (pack_f, unpack_f, max_read, ...).
+
+    Methods
+    -------
+    acquire(address, timeout)
+        Checks out connection.
+    release(nstream, broken)
+        Checks in connection.
+    connection(address, timeout)
+        Context manager that checks out and checks in connection.
+    prune()
+        Closes connections idle longer than `max_idle`.
+    stats()
+        Statistics of pool.
+    close()
+        Closes idle connections, connections in use are closed on check in.
+
+    >>> from netstrings.reactor import NsReactor
+    >>> reactor = NsReactor(lambda conn, obj: obj.upper())
+    >>> server_sock = reactor.listen('127.0.0.1', 0)
+    >>> thread = threading.Thread(target=reactor.run, args=(0.1,))
+    >>> thread.start()
+    >>> pool = NsClientPool(max_size=2)
+    >>> for req in ['a', 'b']:
+    ...     with pool.connection(server_sock.getsockname()) as nstream:
+    ...         n = nstream.write(req)
+    ...         nstream.read()
+    'A'
+    'B'
+    >>> stats = pool.stats()
+    >>> (stats['acquired'], stats['created'], stats['idle'])
+    (2, 1, 1)
+    >>> pool.close()
+    >>> reactor.stop()
+    >>> thread.join()
+    >>> reactor.close()
+
+    """
+    def __init__(self, max_size=POOL_MAX_SIZE, max_idle=POOL_MAX_IDLE, timeout=None, connect_timeout=None,
+                pack_f=pack_str_strict, unpack_f=unpack_str_strict, max_read=STREAM_MAX_READ, **kwargs):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.stream_kwargs = dict(kwargs, pack_f=pack_f, unpack_f=unpack_f, max_read=max_read)
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.counters = {'acquired': 0, 'created': 0, 'retired': 0, 'broken': 0, 'timeouts': 0,
+                         'wait_time': 0.0, 'max_wait_time': 0.0}
+
+    def acquire(self, address, timeout=None):
+        """Checks out connection to endpoint.
+
+        Blocking call.
+        Returns idle connection or opens new one, waits when `max_size`
+        connections to endpoint are in use.
+
+        Parameters
+        ----------
+        address : tuple
+            Endpoint (host, port).
+        timeout : float or None
+            Maximum time of waiting, None means `timeout` of pool.
+
+        Returns
+        -------
+        PooledNsStream
+
+        Raises
+        ------
+        NsPoolTimeout
+            No connection became available in time.
+        OSError
+            Cannot connect to endpoint.
+
+        """
+        if timeout is None:
+            timeout = self.timeout
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
+        nstream = None
+        with self.lock:
+            endpoint = self.endpoints.get(address)
+            if endpoint is None:
+                endpoint = self.endpoints[address] = _Endpoint(self.lock)
+            while True:
+                if self.closed:
+                    raise ValueError('NsClientPool is closed')
+                nstream = self._take_idle(endpoint)
+                if nstream is not None:
+                    break
+                if endpoint.size < self.max_size:
+                    # slot is reserved, connection is opened without lock
+                    endpoint.size += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise NsPoolTimeout('No connection to {} became available in {} seconds'.format(
+                                address, timeout))
+                endpoint.cond.wait(remaining)
+        if nstream is None:
+            try:
+                sock = socket.create_connection(address, self.connect_timeout)
+                sock.settimeout(None)
+                nstream = PooledNsStream(sock, address, **self.stream_kwargs)
+            except BaseException:
+                with self.lock:
+                    endpoint.size -= 1
+                    endpoint.cond.notify()
+                raise
+            created = True
+        else:
+            created = False
+        waited = time.monotonic() - started
+        with self.lock:
+            counters = self.counters
+            counters['acquired'] += 1
+            counters['created'] += created
+            counters['wait_time'] += waited
+            counters['max_wait_time'] = max(counters['max_wait_time'], waited)
+        nstream.uses += 1
+        return nstream
+
+    def _take_idle(self, endpoint):
+        # the warmest healthy idle connection, others are retired
+        now = time.monotonic()
+        while endpoint.idle:
+            nstream = endpoint.idle.pop()
+            if (self.max_idle is None or now - nstream.last_used <= self.max_idle) and nstream.is_alive():
+                return nstream
+            self._retire(endpoint, nstream)
+        return None
+
+    def _retire(self, endpoint, nstream):
+        nstream.close()
+        endpoint.size -= 1
+        self.counters['retired'] += 1
+        endpoint.cond.notify()
+
+    def release(self, nstream, broken=False):
+        """Checks in connection.
+
+        Connection with unread or unwritten data is closed.
+
+        Parameters
+        ----------
+        nstream : PooledNsStream
+            Connection returned by `acquire`.
+        broken : bool
+            Connection must be closed, e.g. exchange failed.
+
+        """
+        with self.lock:
+            endpoint = self.endpoints[nstream.address]
+            if broken or self.closed or not nstream.is_clean():
+                self.counters['broken'] += broken
+                self._retire(endpoint, nstream)
+                return
+            nstream.last_used = time.monotonic()
+            endpoint.idle.append(nstream)
+            endpoint.cond.notify()
+
+    @contextmanager
+    def connection(self, address, timeout=None):
+        """Context manager that checks out connection and checks it in.
+
+        Connection is closed if exception is raised in `with` block.
+
+        Yields
+        ------
+        PooledNsStream
+
+        """
+        nstream = self.acquire(address, timeout)
+        try:
+            yield nstream
+        except BaseException:
+            self.release(nstream, broken=True)
+            raise
+        self.release(nstream)
+
+    def prune(self):
+        """Closes connections idle longer than `max_idle`.
+
+        Returns
+        -------
+        int
+            Number of closed connections.
+
+        """
+        if self.max_idle is None:
+            return 0
+        n = 0
+        with self.lock:
+            deadline = time.monotonic() - self.max_idle
+            for endpoint in self.endpoints.values():
+                # the oldest idle connections are at the left
+                while endpoint.idle and endpoint.idle[0].last_used < deadline:
+                    self._retire(endpoint, endpoint.idle.popleft())
+                    n += 1
+        return n
+
+    def stats(self):
+        """Statistics of pool.
+
+        Returns
+        -------
+        dict
+            Keys: size, idle, in_use (connections now), acquired, created,
+            retired, broken, timeouts (counters), wait_time, max_wait_time
+            (seconds of waiting in `acquire`), avg_wait_time.
+
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats['size'] = sum([endpoint.size for endpoint in self.endpoints.values()])
+            stats['idle'] = sum([len(endpoint.idle) for endpoint in self.endpoints.values()])
+        stats['in_use'] = stats['size'] - stats['idle']
+        stats['avg_wait_time'] = stats['wait_time'] / stats['acquired'] if stats['acquired'] else 0.0
+        return stats
+
+    def close(self):
+        """Closes idle connections, connections in use are closed on check in.
+        """
+        with self.lock:
+            self.closed = True
+            for endpoint in self.endpoints.values():
+                while endpoint.idle:
+                    self._retire(endpoint, endpoint.idle.pop())
+                endpoint.cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,291 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Multi-process netstrings server.
+
+NsPreforkServer forks N worker processes, every worker binds the same port
+with SO_REUSEPORT and runs its own NsReactor accept loop, so kernel spreads
+connections between processes and unpacking is not limited by single GIL.
+Requires SO_REUSEPORT and fork (Linux, BSD). `serve_forever()` logs exits
+of workers and forks replacements.
+
+    server = NsPreforkServer(on_message, '127.0.0.1', 9000, workers=4)
+    server.serve_forever()
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import time
+
+from .netstrings import STREAM_MAX_READ, pack_str_strict, unpack_str_strict
+from .reactor import NsReactor
+
+# Maximum time of single wait of worker reactor, seconds.
+# Worker checks stop flag between waits.
+WORKER_POLL_TIMEOUT = 0.5
+
+logger = logging.getLogger(__name__)
+
+class NsPreforkServer:
+    """
+    Netstrings server that runs NsReactor in many worker processes.
+
+    Callbacks are called in worker processes, they are inherited by fork,
+    so closures and lambdas are accepted.
+
+    Attributes
+    ----------
+    on_message
+        Function `on_message(conn, obj)`, see `NsReactor`.
+    host, port
+        Address to listen on.
+    workers : int
+        Number of worker processes.
+    pack_f, unpack_f
+        Packer and unpacker functions, see `NsStream`.
+    max_read : int
+        See `NsReactor`.
+    processes : list
+        Running worker processes.
+    stats : list
+        Statistics of stopped workers, dicts with keys: worker, pid,
+        connections, messages, errors, uptime. Workers killed by signal
+        have no statistics.
+    respawns : int
+        Number of workers forked by `serve_forever()` to replace exited ones.
+
+    Methods
+    -------
+    start()
+        Forks worker processes.
+    stop(timeout)
+        Gracefully stops workers and collects their statistics.
+    check_workers()
+        Logs exited workers and forks replacements.
+    serve_forever()
+        Starts workers, replaces exited ones until SIGINT/SIGTERM, then stops them.
+
+    >>> import socket
+    >>> import netstrings as ns
+    >>> server = NsPreforkServer(lambda conn, obj: obj.upper(), '127.0.0.1', 0, workers=2)
+    >>> server.start()
+    >>> with socket.create_connection(('127.0.0.1', server.port)) as sock:
+    ...     nstream = ns.NsStream(sock.makefile('rwb', buffering=0))
+    ...     n = nstream.write('abc')
+    ...     nstream.read()
+    'ABC'
+    >>> stats = server.stop()
+    >>> sum([s['messages'] for s in stats])
+    1
+
+    """
+    def __init__(self, on_message, host, port, workers=None, pack_f=pack_str_strict, unpack_f=unpack_str_strict,
+                max_read=STREAM_MAX_READ):
+        self.on_message = on_message
+        self.host = host
+        self.port = port
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.pack_f = pack_f
+        self.unpack_f = unpack_f
+        self.max_read = max_read
+        self.processes = []
+        self.stats = []
+        self.respawns = 0
+        self.context = multiprocessing.get_context('fork')
+        self.stats_q = None
+        self.ready = None
+        self.reserved = None
+
+    def start(self):
+        """Forks worker processes and waits until they listen.
+        """
+        # port 0 means any free port, all workers must bind the same one.
+        # Parent keeps bound socket until workers are started, so port cannot
+        # be taken by somebody else. It does not listen, otherwise connections
+        # are queued to it too.
+        self.reserved = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.reserved.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.reserved.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.reserved.bind((self.host, self.port))
+        self.port = self.reserved.getsockname()[1]
+        self.stats_q = self.context.Queue()
+        # released by every worker that listens
+        self.ready = self.context.Semaphore(0)
+        self.stats = []
+        try:
+            for worker in range(self.workers):
+                self.processes.append(self._spawn(worker))
+            self._wait_ready()
+        finally:
+            self.reserved.close()
+
+    def _wait_ready(self):
+        # otherwise connections made right after start() may be refused
+        n = 0
+        while n < len(self.processes):
+            if self.ready.acquire(timeout=WORKER_POLL_TIMEOUT):
+                n += 1
+            elif not all([process.is_alive() for process in self.processes]):
+                # exited worker never listens, check_workers() replaces it
+                return
+
+    def _spawn(self, worker):
+        process = self.context.Process(target=self._worker, args=(worker, self.stats_q, self.ready),
+                name='ns-worker-{}'.format(worker))
+        # worker unblocks SIGTERM when its handler is set, so worker that is
+        # stopped right after fork still stops gracefully
+        mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+        try:
+            process.start()
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+        return process
+
+    def check_workers(self):
+        """Logs exited workers and forks replacements with the same worker numbers.
+
+        Replacements bind the port that is kept by other workers, so
+        server with single worker may lose its port to another process.
+
+        Returns
+        -------
+        int
+            Number of forked workers.
+
+        >>> server = NsPreforkServer(lambda conn, obj: obj, '127.0.0.1', 0, workers=2)
+        >>> server.start()
+        >>> killed = server.processes[1]
+        >>> killed.kill()
+        >>> killed.join()
+        >>> server.check_workers()
+        1
+        >>> (server.processes[1].is_alive(), server.respawns)
+        (True, 1)
+        >>> [s['worker'] for s in server.stop()]
+        [0, 1]
+
+        """
+        self._collect_stats()
+        n = 0
+        for (worker, process) in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            process.join()
+            logger.warning('worker %d (pid %d) exited with code %s, respawning',
+                    worker, process.pid, process.exitcode)
+            self.processes[worker] = self._spawn(worker)
+            n += 1
+        self.respawns += n
+        return n
+
+    def _collect_stats(self):
+        # statistics of exited workers, without waiting
+        while True:
+            try:
+                self.stats.append(self.stats_q.get_nowait())
+            except queue.Empty:
+                return
+
+    def _worker(self, worker, stats_q, ready):
+        self.reserved.close()
+        stats = {'worker': worker, 'pid': os.getpid(),
+                 'connections': 0, 'messages': 0, 'errors': 0, 'uptime': 0.0}
+        on_message = self.on_message
+
+        def count_message(conn, obj):
+            stats['messages'] += 1
+            return on_message(conn, obj)
+
+        def count_connect(conn):
+            stats['connections'] += 1
+
+        def count_close(conn):
+            if conn.error is not None:
+                stats['errors'] += 1
+
+        reactor = NsReactor(count_message, pack_f=self.pack_f, unpack_f=self.unpack_f,
+                on_connect=count_connect, on_close=count_close, max_read=self.max_read)
+        # graceful shutdown: current events are processed, then sockets are closed
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+        started = time.monotonic()
+        reactor.listen(self.host, self.port, reuse_port=True)
+        ready.release()
+        try:
+            while not stopping:
+                reactor.run_once(WORKER_POLL_TIMEOUT)
+        finally:
+            reactor.close()
+            stats['uptime'] = time.monotonic() - started
+            stats_q.put(stats)
+
+    def stop(self, timeout=5.0):
+        """Gracefully stops workers and collects their statistics.
+
+        Workers get SIGTERM, workers that are not stopped in `timeout`
+        seconds are killed.
+
+        Returns
+        -------
+        list
+            Statistics of workers, see `stats`.
+
+        """
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        stats = self.stats
+        pids = set([process.pid for process in self.processes])
+        pids.difference_update([s['pid'] for s in stats])
+        while pids:
+            try:
+                s = self.stats_q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                # worker was not stopped gracefully or was killed
+                break
+            stats.append(s)
+            pids.discard(s['pid'])
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.processes = []
+        self._collect_stats()
+        self.stats = sorted(stats, key=lambda s: (s['worker'], s['pid']))
+        return self.stats
+
+    def serve_forever(self):
+        """Starts workers and waits until SIGINT or SIGTERM, then stops workers.
+
+        Workers that exit before are logged and replaced, see `check_workers()`.
+
+        Returns
+        -------
+        list
+            Statistics of workers, see `stats`.
+
+        """
+        stopping = []
+        handler = lambda signum, frame: stopping.append(signum)
+        old_int = signal.signal(signal.SIGINT, handler)
+        old_term = signal.signal(signal.SIGTERM, handler)
+        try:
+            self.start()
+            while not stopping:
+                time.sleep(WORKER_POLL_TIMEOUT)
+                if not stopping:
+                    self.check_workers()
+        finally:
+            signal.signal(signal.SIGINT, old_int)
+            signal.signal(signal.SIGTERM, old_term)
+            stats = self.stop()
+        return stats
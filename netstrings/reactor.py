@@ -0,0 +1,468 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Event-loop server for netstrings without asyncio.
+
+NsReactor serves many non-blocking sockets in one thread with
+`selectors.DefaultSelector` (epoll on Linux). Every connection has its
+own incremental decoder and write queue, callback is called for every
+unpacked object.
+
+    def on_message(conn, obj):
+        # returned object is packed and sent back, None means no response
+        return obj
+
+    reactor = NsReactor(on_message)
+    reactor.listen('127.0.0.1', 9000)
+    reactor.run()
+"""
+
+from collections import deque
+from itertools import islice
+import logging
+import selectors
+import socket
+
+from .netstrings import (STREAM_MAX_READ, IOV_MAX, NsDecoder,
+        pack_str_strict, unpack_str_strict)
+
+# Default backlog of listening socket
+REACTOR_BACKLOG = 1024
+
+logger = logging.getLogger(__name__)
+
+# selector key data of wakeup socket
+_WAKEUP = object()
+
+class NsConnection:
+    """
+    Connection served by NsReactor.
+
+    Attributes
+    ----------
+    sock : socket.socket
+        Non-blocking socket.
+    addr : tuple
+        Remote address.
+    reactor : NsReactor
+        Reactor that serves connection.
+    decoder : NsDecoder or None
+        Incremental parser used when `unpack_f` was made by `make_unpacker`.
+    buff : bytes
+        Receive buffer for custom `unpack_f`.
+    wqueue : collections.deque
+        Packed netstrings that are not sent yet.
+    read_closed : bool
+        Peer closed its side of connection (e.g. SHUT_WR), queued
+        responses are still sent before connection is closed.
+    closed : bool
+        Connection is closed.
+    error : Exception or None
+        Exception that closed connection.
+    data
+        Free slot for user data.
+
+    Methods
+    -------
+    write(obj)
+        Packs object and sends it, the rest is queued until socket is writable.
+    close()
+        Unregisters and closes socket.
+
+    """
+    def __init__(self, reactor, sock, addr):
+        self.reactor = reactor
+        self.sock = sock
+        self.addr = addr
+        self.buff = b''
+        if hasattr(reactor.unpack_f, 'decode_f'):
+            self.decoder = NsDecoder(max_len=reactor.unpack_f.max_len, size=reactor.max_read)
+        else:
+            self.decoder = None
+        self.wqueue = deque()
+        self.events = selectors.EVENT_READ
+        self.read_closed = False
+        self.closed = False
+        self.error = None
+        self.data = None
+
+    def write(self, obj):
+        """Packs object using `pack_f` of reactor and sends it.
+
+        Bytes that cannot be sent without blocking are queued and sent
+        when socket becomes writable.
+
+        Returns
+        -------
+        int
+            Number of bytes sent or queued.
+
+        """
+        if self.closed:
+            return 0
+        ns = self.reactor.pack_f(obj)
+        self.wqueue.append(memoryview(ns))
+        if len(self.wqueue) == 1:
+            self._send()
+        return len(ns)
+
+    def _send(self):
+        # sends queued netstrings while socket accepts them
+        wqueue = self.wqueue
+        while wqueue:
+            try:
+                if len(wqueue) > 1 and hasattr(self.sock, 'sendmsg'):
+                    n = self.sock.sendmsg(list(islice(wqueue, IOV_MAX)))
+                else:
+                    n = self.sock.send(wqueue[0])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self.close(e)
+                return
+            while n and n >= len(wqueue[0]):
+                n -= len(wqueue.popleft())
+            if n:
+                wqueue[0] = wqueue[0][n:]
+                break
+        if self.read_closed:
+            if not wqueue:
+                self.close()
+                return
+            events = selectors.EVENT_WRITE
+        else:
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if wqueue else selectors.EVENT_READ
+        if events != self.events:
+            self.events = events
+            self.reactor.selector.modify(self.sock, events, self)
+
+    def _recv(self):
+        # single read operation, dispatches all complete objects
+        try:
+            if self.decoder is not None:
+                n = self.sock.recv_into(self.decoder.get_buffer(self.reactor.max_read))
+                if n:
+                    self.decoder.buffer_updated(n)
+            else:
+                raw_b = self.sock.recv(self.reactor.max_read)
+                n = len(raw_b)
+                self.buff += raw_b
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self.close(e)
+            return
+        if n == 0:
+            # remote socket is closed or half-closed, queued responses are sent first
+            self.read_closed = True
+            self._send()
+            return
+        try:
+            for obj in self._unpack():
+                resp = self.reactor.on_message(self, obj)
+                if resp is not None:
+                    self.write(resp)
+                if self.closed:
+                    return
+        except Exception as e:
+            # malformed netstring, decode_f or on_message failure
+            # closes only this connection
+            self.close(e)
+
+    def _unpack(self):
+        if self.decoder is not None:
+            decode_f = self.reactor.decode_f
+            for payload in self.decoder:
+                yield decode_f(payload) if decode_f is not None else payload
+        else:
+            (obj, tail) = self.reactor.unpack_f(self.buff)
+            while obj is not None:
+                self.buff = tail
+                yield obj
+                (obj, tail) = self.reactor.unpack_f(self.buff)
+
+    def close(self, error=None):
+        """Unregisters and closes socket, calls `on_close` of reactor.
+
+        Parameters
+        ----------
+        error : Exception or None
+            Reason of closing.
+
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.error = error
+        self.reactor._remove(self)
+
+class NsReactor:
+    """
+    Single thread event loop for many netstrings connections.
+
+    NsReactor is not thread-safe, all its methods and methods of its
+    connections must be called from callbacks or from the thread that runs it.
+    Other threads pass work to it by `call_soon_threadsafe()`.
+
+    Attributes
+    ----------
+    on_message
+        Function `on_message(conn, obj)` called for every unpacked object,
+        `conn` is NsConnection. Object returned by it is sent back unless it
+        is None.
+    on_connect
+        Function `on_connect(conn)` called for accepted connections or None.
+    on_close
+        Function `on_close(conn)` called for closed connections or None.
+        `conn.error` is the reason of closing.
+    pack_f, unpack_f
+        Packer and unpacker functions, see `NsStream`.
+    max_read : int
+        Default size of bytes for single read operation.
+    selector : selectors.BaseSelector
+        Selector of registered sockets.
+    connections : set
+        Open NsConnection objects.
+
+    Methods
+    -------
+    listen(host, port, backlog)
+        Creates listening socket, accepted connections are served by reactor.
+    add(sock, addr)
+        Serves connected socket.
+    run_once(timeout)
+        Waits for socket events once and processes them.
+    run(timeout)
+        Processes socket events until `stop()`.
+    call_soon_threadsafe(callback, *args)
+        Schedules callback from another thread.
+    stop()
+        Stops `run()`.
+    close()
+        Closes all sockets.
+
+    >>> (a, b) = socket.socketpair()
+    >>> reactor = NsReactor(lambda conn, obj: obj.upper())
+    >>> conn = reactor.add(a)
+    >>> b.sendall(b'3:abc,3:de')
+    >>> reactor.run_once(timeout=1)
+    >>> b.recv(100)
+    b'3:ABC,'
+
+    Peer that half-closes its socket still gets responses, invalid input
+    (here not UTF-8) closes only its connection:
+
+    >>> b.sendall(b'f,2:gh,')
+    >>> b.shutdown(socket.SHUT_WR)
+    >>> (c, d) = socket.socketpair()
+    >>> conn_c = reactor.add(c)
+    >>> d.sendall(b'1:\\xff,')
+    >>> reactor.run_once(timeout=1)
+    >>> reactor.run_once(timeout=1)
+    >>> (b.recv(100), b.recv(100), conn.closed)
+    (b'3:DEF,2:GH,', b'', True)
+    >>> (conn_c.closed, type(conn_c.error).__name__)
+    (True, 'UnicodeDecodeError')
+    >>> reactor.close()
+    >>> (b.close(), d.close())
+    (None, None)
+
+    """
+    def __init__(self, on_message, pack_f=pack_str_strict, unpack_f=unpack_str_strict,
+                on_connect=None, on_close=None, max_read=STREAM_MAX_READ):
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.on_close = on_close
+        self.pack_f = pack_f
+        self.unpack_f = unpack_f
+        self.decode_f = getattr(unpack_f, 'decode_f', None)
+        self.max_read = max_read
+        self.selector = selectors.DefaultSelector()
+        self.listeners = []
+        self.connections = set()
+        self.running = False
+        # callbacks scheduled by other threads, the wakeup socket interrupts select()
+        self.calls = deque()
+        (self.wakeup_r, self.wakeup_w) = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.wakeup_w.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, _WAKEUP)
+
+    def listen(self, host, port, backlog=REACTOR_BACKLOG, reuse_port=False):
+        """Creates non-blocking listening socket served by reactor.
+
+        Parameters
+        ----------
+        host, port
+            Address to listen on.
+        backlog : int
+            Backlog of listening socket.
+        reuse_port : bool
+            Sets SO_REUSEPORT, so many processes can listen on the same port.
+
+        Returns
+        -------
+        socket.socket
+            Listening socket.
+
+        """
+        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server_sock.bind((host, port))
+        server_sock.listen(backlog)
+        server_sock.setblocking(False)
+        self.selector.register(server_sock, selectors.EVENT_READ, None)
+        self.listeners.append(server_sock)
+        return server_sock
+
+    def add(self, sock, addr=None):
+        """Serves connected socket.
+
+        Parameters
+        ----------
+        sock : socket.socket
+            Connected socket, it is switched to non-blocking mode.
+        addr : tuple or None
+            Remote address, None means `sock.getpeername()`.
+
+        Returns
+        -------
+        NsConnection
+
+        """
+        sock.setblocking(False)
+        if addr is None:
+            try:
+                addr = sock.getpeername()
+            except OSError:
+                addr = None
+        conn = NsConnection(self, sock, addr)
+        self.connections.add(conn)
+        self.selector.register(sock, selectors.EVENT_READ, conn)
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def _accept(self, server_sock):
+        # accepts all pending connections
+        while True:
+            try:
+                (sock, addr) = server_sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. too many open files, try on next event
+                return
+            self.add(sock, addr)
+
+    def _remove(self, conn):
+        self.connections.discard(conn)
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        if self.on_close is not None:
+            self.on_close(conn)
+
+    def run_once(self, timeout=None):
+        """Waits for socket events once and processes them.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time to wait in seconds, None means wait forever.
+
+        """
+        for (key, events) in self.selector.select(timeout):
+            conn = key.data
+            if conn is None:
+                self._accept(key.fileobj)
+                continue
+            if conn is _WAKEUP:
+                self._run_calls()
+                continue
+            if events & selectors.EVENT_WRITE and not conn.closed:
+                conn._send()
+            if events & selectors.EVENT_READ and not conn.closed:
+                conn._recv()
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Schedules `callback(*args)` to be called by the thread that runs reactor.
+
+        The only method of reactor that can be called from any thread,
+        e.g. worker thread sends response by scheduled `conn.write`.
+        Exception of callback is logged (`netstrings.reactor` logger),
+        reactor keeps running.
+
+        >>> (a, b) = socket.socketpair()
+        >>> reactor = NsReactor(lambda conn, obj: None)
+        >>> conn = reactor.add(a)
+        >>> import threading
+        >>> thread = threading.Thread(target=reactor.call_soon_threadsafe, args=(conn.write, 'done'))
+        >>> thread.start()
+        >>> thread.join()
+        >>> reactor.run_once(timeout=1)
+        >>> b.recv(100)
+        b'4:done,'
+        >>> reactor.close()
+        >>> b.close()
+
+        """
+        self.calls.append((callback, args))
+        try:
+            self.wakeup_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # wakeup socket is full, reactor is woken up anyway
+            pass
+
+    def _run_calls(self):
+        # drains wakeup socket, then calls scheduled callbacks
+        try:
+            while self.wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        calls = self.calls
+        while calls:
+            (callback, args) = calls.popleft()
+            try:
+                callback(*args)
+            except Exception:
+                # the same isolation as exceptions of on_message
+                logger.exception('exception in callback %r of reactor', callback)
+
+    def run(self, timeout=None):
+        """Processes socket events until `stop()` is called.
+
+        Parameters
+        ----------
+        timeout : float or None
+            Maximum time of single wait, e.g. to check `running` flag.
+
+        """
+        self.running = True
+        while self.running:
+            self.run_once(timeout)
+
+    def stop(self):
+        """Stops `run()` after processing of current events.
+        """
+        self.running = False
+
+    def close(self):
+        """Closes all connections and listening sockets.
+        """
+        for conn in list(self.connections):
+            conn.close()
+        for server_sock in self.listeners:
+            self.selector.unregister(server_sock)
+            server_sock.close()
+        self.listeners = []
+        self.selector.unregister(self.wakeup_r)
+        self.wakeup_r.close()
+        self.wakeup_w.close()
+        self.selector.close()
@@ -0,0 +1,313 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Schema-driven record codec over netstrings.
+
+Record is a tuple of fields declared by RecordSchema. Fixed-width fields
+(ints, floats, bools) are packed together by precompiled `struct.Struct`,
+variable fields (bytes, str) follow them as nested netstrings:
+
+    [fixed fields]<len>:<bytes>,<len>:<str>,
+
+    schema = RecordSchema([('id', 'int'), ('price', 'float'), ('name', 'str')])
+    nstream = NsStream(fd, pack_f=schema.make_packer(), unpack_f=schema.make_unpacker())
+    nstream.write((1, 9.5, 'apple'))
+"""
+
+from collections import namedtuple
+import struct
+
+from .netstrings import (NS_MAX_LEN, NsMalformed, _byte_view, _unpack_view, hex_fragment,
+        iter_unpack, make_packer, make_unpacker)
+
+# Field types of RecordSchema and their struct format codes,
+# None means variable field packed as nested netstring.
+# Any single struct format code of standard size (e.g. 'i', 'H', 'f') is
+# also accepted, native-only 'n' and 'N' are not.
+FIELD_TYPES = {
+    'int': 'q',
+    'uint': 'Q',
+    'float': 'd',
+    'bool': '?',
+    'bytes': None,
+    'str': None,
+}
+
+def _decode_bytes(view):
+    return view.tobytes()
+
+def _decode_str(view):
+    return str(view, 'utf8')
+
+def _encode_str(x):
+    return x.encode('utf8')
+
+def _malformed(msg, view, offset):
+    fragment = view[offset:offset+8].tobytes()
+    return NsMalformed('{}. Buffer fragment (at offset {}):{} HEX:{}'.format(
+                msg, offset, repr(fragment), hex_fragment(fragment)))
+
+class RecordSchema:
+    """
+    Codec of records with declared fields.
+
+    Records are decoded to namedtuples of class `Record`, any sequence
+    with fields in declared order can be encoded. Fixed fields use
+    little-endian standard sizes without alignment, str fields are
+    encoded in UTF-8.
+
+    Attributes
+    ----------
+    fields : list of tuples (str, str)
+        Field names and types, see FIELD_TYPES.
+    Record : namedtuple class
+        Class of decoded records.
+    fixed : struct.Struct
+        Format of fixed-width fields.
+
+    Methods
+    -------
+    encode(record)
+        Encodes record to payload bytes.
+    decode(buf)
+        Decodes record from payload in any bytes-like object.
+    encode_many(records, max_len)
+        Encodes records to run of netstrings.
+    decode_many(buf, max_len)
+        Decodes run of netstrings to list of records.
+    make_packer(max_len)
+        Packer for NsStream `pack_f`.
+    make_unpacker(max_len)
+        Unpacker for NsStream `unpack_f`.
+
+    >>> schema = RecordSchema([('id', 'int'), ('name', 'str'), ('price', 'float')], name='Item')
+    >>> payload = schema.encode((1, 'apple', 0.5))
+    >>> payload
+    b'\\x01\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\xe0?5:apple,'
+    >>> schema.decode(payload)
+    Item(id=1, name='apple', price=0.5)
+
+    >>> schema.decode(payload[:-1])  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    NsMalformed: Incomplete variable field "name" of record. Buffer fragment (at offset 16):b'5:apple' HEX:35 3A 61 70 70 6C 65
+
+    >>> RecordSchema([('size', 'n')])  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ValueError: Unknown type of field "size": 'n'
+
+    """
+    def __init__(self, fields, name='Record'):
+        self.fields = list(fields)
+        self.Record = namedtuple(name, [field_name for (field_name, field_type) in self.fields])
+        fixed_codes = []
+        fixed_idx = []
+        var_idx = []
+        self.var_names = []
+        self.var_encoders = []
+        self.var_decoders = []
+        for (i, (field_name, field_type)) in enumerate(self.fields):
+            code = FIELD_TYPES.get(field_type, field_type)
+            if code is None:
+                var_idx.append(i)
+                self.var_names.append(field_name)
+                self.var_encoders.append(_encode_str if field_type == 'str' else None)
+                self.var_decoders.append(_decode_str if field_type == 'str' else _decode_bytes)
+            elif isinstance(code, str) and len(code) == 1 and code in 'bBhHiIlLqQefd?':
+                fixed_idx.append(i)
+                fixed_codes.append(code)
+            else:
+                raise ValueError('Unknown type of field "{}": {!r}'.format(field_name, field_type))
+        self.fixed = struct.Struct('<' + ''.join(fixed_codes))
+        self.fixed_idx = fixed_idx
+        self.var_idx = var_idx
+        # position of every declared field in (fixed fields + variable fields)
+        order = fixed_idx + var_idx
+        self.perm = [order.index(i) for i in range(len(self.fields))]
+        if self.perm == list(range(len(self.fields))):
+            self.perm = None
+        if not var_idx:
+            # framed record has constant size, header and terminator are
+            # skipped by pad bytes, see decode_many()
+            self.frame_header = b'%d:' % self.fixed.size
+            self.framed = struct.Struct('<{}x{}x'.format(len(self.frame_header), ''.join(fixed_codes)))
+        else:
+            self.frame_header = None
+            self.framed = None
+
+    def encode(self, record):
+        """Encodes record to payload bytes.
+
+        Parameters
+        ----------
+        record : sequence
+            Field values in declared order.
+
+        Returns
+        -------
+        bytes
+            Payload of record netstring.
+
+        """
+        fixed = self.fixed.pack(*[record[i] for i in self.fixed_idx])
+        if not self.var_idx:
+            return fixed
+        parts = [fixed]
+        for (i, encode_f) in zip(self.var_idx, self.var_encoders):
+            payload = record[i] if encode_f is None else encode_f(record[i])
+            parts.append(b'%d:' % len(payload))
+            parts.append(payload)
+            parts.append(b',')
+        return b''.join(parts)
+
+    def decode(self, buf):
+        """Decodes record from payload.
+
+        Fixed fields are unpacked directly from `buf`, only variable
+        fields are copied.
+
+        Parameters
+        ----------
+        buf : bytes-like object
+            Payload of record netstring, e.g. memoryview of receive buffer.
+
+        Returns
+        -------
+        Record
+
+        Raises
+        ------
+        NsMalformed
+            Payload does not match schema.
+
+        """
+        view = _byte_view(buf)
+        size = len(view)
+        offset = self.fixed.size
+        if size < offset:
+            raise _malformed('Too short record. len:{}, fixed fields len:{}'.format(size, offset), view, 0)
+        values = self.fixed.unpack_from(view)
+        if self.var_idx:
+            values = list(values)
+            for (field_name, decode_f) in zip(self.var_names, self.var_decoders):
+                (payload, next_offset) = _unpack_view(view, offset, size)
+                if payload is None:
+                    raise _malformed('Incomplete variable field "{}" of record'.format(field_name), view, offset)
+                values.append(decode_f(payload))
+                offset = next_offset
+        if offset != size:
+            raise _malformed('Unexpected bytes after the last field of record', view, offset)
+        if self.perm is not None:
+            values = [values[i] for i in self.perm]
+        return self.Record._make(values)
+
+    def encode_many(self, records, max_len=NS_MAX_LEN):
+        """Encodes records to run of netstrings.
+
+        Parameters
+        ----------
+        records : iterable
+            Records, see `encode`.
+        max_len : int
+            Maximum netstring length, see `pack`.
+
+        Returns
+        -------
+        bytes
+            Netstrings of records.
+
+        >>> schema = RecordSchema([('x', 'int'), ('y', 'int')])
+        >>> buf = schema.encode_many([(1, 2), (3, 4)])
+        >>> schema.decode_many(buf)
+        [Record(x=1, y=2), Record(x=3, y=4)]
+
+        """
+        if self.framed is not None:
+            if len(self.frame_header) + self.fixed.size + 1 > max_len:
+                raise NsMalformed('Too big netstring. len:{}, max_len:{}'.format(
+                            len(self.frame_header) + self.fixed.size + 1, max_len))
+            header = self.frame_header
+            pack = self.fixed.pack
+            fixed_idx = self.fixed_idx
+            return b''.join([header + pack(*[record[i] for i in fixed_idx]) + b',' for record in records])
+        parts = []
+        for record in records:
+            payload = self.encode(record)
+            header = b'%d:' % len(payload)
+            if len(header) + len(payload) + 1 > max_len:
+                raise NsMalformed('Too big netstring. len:{}, max_len:{}'.format(
+                            len(header) + len(payload) + 1, max_len))
+            parts.append(header)
+            parts.append(payload)
+            parts.append(b',')
+        return b''.join(parts)
+
+    def decode_many(self, buf, max_len=NS_MAX_LEN):
+        """Decodes run of netstrings to list of records.
+
+        Records of schema without variable fields have constant size,
+        they are unpacked by single `struct.iter_unpack` call.
+
+        Parameters
+        ----------
+        buf : bytes-like object
+            Netstrings of records, e.g. made by `encode_many`.
+        max_len : int
+            Maximum payload length, see `unpack`.
+
+        Returns
+        -------
+        list
+            Records.
+
+        Raises
+        ------
+        NsMalformed
+            `buf` is not a run of complete netstrings of records.
+
+        """
+        view = _byte_view(buf)
+        if self.framed is not None and self.fixed.size <= max_len and self._check_frames(view):
+            return list(map(self.Record._make, self.framed.iter_unpack(view)))
+        records = []
+        offset = 0
+        for (payload, offset) in iter_unpack(view, max_len=max_len):
+            records.append(self.decode(payload))
+        if offset != len(view):
+            raise _malformed('Incomplete netstring of record', view, offset)
+        return records
+
+    def _check_frames(self, view):
+        # all netstrings have the same header and terminator at the same
+        # positions, they are compared by strided slices
+        frame_size = self.framed.size
+        size = len(view)
+        if size % frame_size:
+            return False
+        count = size // frame_size
+        header = self.frame_header
+        for (i, c) in enumerate(header):
+            if view[i::frame_size] != bytes([c]) * count:
+                return False
+        return view[frame_size-1::frame_size] == b',' * count
+
+    def make_packer(self, max_len=NS_MAX_LEN):
+        """Makes packer of records for NsStream `pack_f`, see `make_packer`.
+        """
+        return make_packer(self.encode, max_len=max_len)
+
+    def make_unpacker(self, max_len=NS_MAX_LEN):
+        """Makes unpacker of records for NsStream `unpack_f`, see `make_unpacker`.
+
+        >>> from io import BytesIO
+        >>> from netstrings import NsStream
+        >>> schema = RecordSchema([('key', 'bytes'), ('value', 'uint')])
+        >>> b_stream = BytesIO()
+        >>> nstream = NsStream(b_stream, pack_f=schema.make_packer(), unpack_f=schema.make_unpacker())
+        >>> n = nstream.write((b'k', 7))
+        >>> pos = b_stream.seek(0)
+        >>> nstream.read()
+        Record(key=b'k', value=7)
+
+        """
+        return make_unpacker(self.decode, max_len=max_len)
@@ -0,0 +1,548 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Multiplexed RPC over netstrings.
+
+Every message carries request id, so many requests share one connection
+and server answers them concurrently, in order of completion. Message
+payload is request id as nested netstring, kind byte and body:
+
+    <len>:<id len>:<id>,<kind><body>,
+
+Kind is 'Q' (request), 'R' (result) or 'E' (error, body is UTF-8 text).
+Bodies are converted by `encode_f`/`decode_f`, the codec is packer and
+unpacker of NsStream, so framing and buffering are NsStream ones.
+
+    server = NsRpcServer(handler, encode_f=str.encode, decode_f=bytes.decode)
+    server.listen('127.0.0.1', 9000)
+    server.run()
+
+    client = NsRpcClient(sock.makefile('rwb', buffering=0), encode_f=str.encode, decode_f=bytes.decode)
+    futures = [client.submit('req {}'.format(i)) for i in range(1000)]
+"""
+
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+import itertools
+import threading
+import time
+
+from .netstrings import (NS_MAX_LEN, STREAM_MAX_READ, NsError, NsMalformed, NsStream, NsStreamUnexpectedEnd,
+        make_packer, make_unpacker, unpack_view)
+from .pipeline import PIPELINE_MAX_IN_FLIGHT, AsyncNsPipelineClient, NsPipelineClient, _TimedFuture
+from .reactor import NsReactor
+from .server import SERVER_MAX_QUEUE, NsProtocol, _EOF
+
+# Message kinds
+RPC_REQUEST = 'Q'
+RPC_RESULT = 'R'
+RPC_ERROR = 'E'
+
+# Maximum length of request id netstring payload, ids are 64-bit
+RPC_ID_MAX_LEN = 20
+
+class NsRpcError(NsError):
+    """
+    Handler of request raised exception, message is its text.
+    """
+    pass
+
+def _error_text(e):
+    return '{}: {}'.format(type(e).__name__, e)
+
+def make_rpc_packer(encode_f=None, max_len=NS_MAX_LEN):
+    """Makes packer of RPC messages, see `make_packer`.
+
+    Parameters
+    ----------
+    encode_f
+        Function that converts body of request or result to bytes,
+        None means that bodies are bytes-like objects.
+    max_len : int
+        Maximum netstring length, see `pack`.
+
+    Returns
+    -------
+    function
+        Packer of tuples (request id, kind, body) for NsStream `pack_f`.
+
+    >>> pack_f = make_rpc_packer(str.encode)
+    >>> pack_f((7, RPC_REQUEST, 'abc'))
+    b'8:1:7,Qabc,'
+    >>> pack_f((7, RPC_ERROR, 'ValueError: x'))
+    b'18:1:7,EValueError: x,'
+
+    Error text is trimmed to fit into `max_len`:
+
+    >>> make_rpc_packer(max_len=20)((7, RPC_ERROR, 'ValueError: ' + 'x' * 100))
+    b'16:1:7,EValueError:,'
+
+    """
+    # payload of the longest netstring that fits into max_len
+    max_payload = max_len - len(b'%d' % max_len) - 2
+
+    def encode(msg):
+        (msg_id, kind, body) = msg
+        id_b = b'%d' % msg_id
+        prefix = b'%d:%s,%s' % (len(id_b), id_b, kind.encode('ascii'))
+        if kind == RPC_ERROR:
+            # cut UTF-8 sequence is replaced by decoder of client
+            body = body.encode('utf8')[0:max(0, max_payload - len(prefix))]
+        elif encode_f is not None:
+            body = encode_f(body)
+        return prefix + body
+    return make_packer(encode, max_len=max_len)
+
+def make_rpc_unpacker(decode_f=None, max_len=NS_MAX_LEN):
+    """Makes unpacker of RPC messages, see `make_unpacker`.
+
+    Parameters
+    ----------
+    decode_f
+        Function that converts body of request or result from bytes,
+        None means that bodies are bytes.
+    max_len : int
+        Maximum payload length, see `unpack`.
+
+    Returns
+    -------
+    function
+        Unpacker of tuples (request id, kind, body) for NsStream `unpack_f`.
+
+    >>> unpack_f = make_rpc_unpacker(bytes.decode)
+    >>> unpack_f(b'8:1:7,Rabc,')
+    ((7, 'R', 'abc'), b'')
+    >>> unpack_f(b'4:abcd,')  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    NsMalformed: Cannot parse request id of RPC message
+
+    """
+    def decode(payload):
+        (id_view, offset) = unpack_view(payload, 0, RPC_ID_MAX_LEN)
+        if id_view is None or offset >= len(payload):
+            raise NsMalformed('Cannot parse request id of RPC message')
+        id_b = id_view.tobytes()
+        if not id_b.isdigit():
+            raise NsMalformed('Cannot parse request id of RPC message')
+        kind = chr(payload[offset])
+        body = payload[offset+1:]
+        if kind == RPC_ERROR:
+            body = str(body, 'utf8', 'replace')
+        elif kind == RPC_REQUEST or kind == RPC_RESULT:
+            if decode_f is not None:
+                body = decode_f(body)
+        else:
+            raise NsMalformed('Unknown kind of RPC message: {!r}'.format(kind))
+        return (int(id_b), kind, body)
+    return make_unpacker(decode, max_len=max_len)
+
+def _resolve(future, kind, body):
+    # result or error message of handler
+    if kind == RPC_RESULT:
+        future.set_result(body)
+    elif kind == RPC_ERROR:
+        future.set_exception(NsRpcError(body))
+    else:
+        future.set_exception(NsMalformed('Unexpected RPC message kind {!r} of response'.format(kind)))
+
+class NsRpcClient(NsPipelineClient):
+    """
+    Multiplexed RPC client, thread-safe.
+
+    Like NsPipelineClient, but responses are matched to requests by id,
+    so server may answer in any order. Handler exceptions are raised by
+    futures as NsRpcError.
+
+    Attributes
+    ----------
+    nstream : NsStream
+        Connection with RPC packer and unpacker.
+    in_flight : dict
+        (future, submit time) of requests waiting for responses by request id.
+
+    Methods
+    -------
+    submit(req)
+        Sends request, returns concurrent.futures.Future of response.
+    request(req, timeout)
+        Sends request and waits for response.
+    stats()
+        Statistics of client, see `NsPipelineClient.stats`.
+    close(timeout)
+        Waits for responses and stops client.
+
+    >>> import socket
+    >>> server = NsRpcServer(lambda s: str(10 // int(s)), encode_f=str.encode, decode_f=bytes.decode)
+    >>> server_sock = server.listen('127.0.0.1', 0)
+    >>> thread = threading.Thread(target=server.run, args=(0.1,))
+    >>> thread.start()
+    >>> sock = socket.create_connection(server_sock.getsockname())
+    >>> client = NsRpcClient(sock.makefile('rwb', buffering=0), encode_f=str.encode, decode_f=bytes.decode)
+    >>> futures = [client.submit(req) for req in ['1', '2', '5']]
+    >>> [f.result() for f in futures]
+    ['10', '5', '2']
+    >>> client.request('0')  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    NsRpcError: ZeroDivisionError: integer division or modulo by zero
+    >>> client.close()
+    >>> sock.close()
+    >>> server.stop()
+    >>> thread.join()
+    >>> server.close()
+
+    """
+    def __init__(self, fd, encode_f=None, decode_f=None, max_len=NS_MAX_LEN, max_in_flight=PIPELINE_MAX_IN_FLIGHT,
+                on_latency=None, max_read=STREAM_MAX_READ):
+        nstream = NsStream(fd, pack_f=make_rpc_packer(encode_f, max_len), unpack_f=make_rpc_unpacker(decode_f, max_len),
+                max_read=max_read)
+        self.ids = itertools.count(1)
+        super().__init__(nstream, max_in_flight=max_in_flight, on_latency=on_latency)
+
+    def submit(self, req):
+        """Sends request without waiting for response.
+
+        Blocking call if `max_in_flight` requests wait for responses.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of response.
+
+        """
+        msg_id = next(self.ids)
+        ns = self.nstream.pack_f((msg_id, RPC_REQUEST, req))
+        self.window.acquire()
+        future = Future()
+        with self.cond:
+            if self.error is not None or self.closing:
+                self.window.release()
+                raise self.error if self.error is not None else ValueError('NsRpcClient is closed')
+            self.in_flight[msg_id] = (future, time.perf_counter())
+            self.pending.append(ns)
+            self.counters['submitted'] += 1
+            self.cond.notify_all()
+        return future
+
+    def _read_loop(self):
+        try:
+            while True:
+                msg = self.nstream.read()
+                with self.cond:
+                    if msg is None:
+                        raise NsStreamUnexpectedEnd('Connection is closed, requests in flight:{}'.format(
+                                    len(self.in_flight)))
+                    (msg_id, kind, body) = msg
+                    entry = self.in_flight.pop(msg_id, None)
+                    if entry is None:
+                        raise NsMalformed('Unexpected response to unknown request id:{}'.format(msg_id))
+                    (future, started) = entry
+                    self._record(future, started)
+                    if not self.in_flight:
+                        # close() waits for it
+                        self.cond.notify_all()
+                self.window.release()
+                _resolve(future, kind, body)
+        except Exception as e:
+            self._fail(e)
+
+    in_flight_type = dict
+
+    def _in_flight_entries(self):
+        return list(self.in_flight.values())
+
+class AsyncNsRpcClient(AsyncNsPipelineClient):
+    """
+    Multiplexed RPC client over AsyncNsStream, see NsRpcClient.
+
+    Must be created in running event loop, use `open_rpc`.
+
+    >>> async def demo():
+    ...     async def handler(obj):
+    ...         # the first request is answered last
+    ...         await asyncio.sleep(0.05 if obj == 'a' else 0)
+    ...         return obj.upper()
+    ...     server = await serve_rpc(handler, '127.0.0.1', 0, encode_f=str.encode, decode_f=bytes.decode)
+    ...     client = await open_rpc('127.0.0.1', server.sockets[0].getsockname()[1],
+    ...             encode_f=str.encode, decode_f=bytes.decode)
+    ...     futures = [await client.submit(req) for req in ['a', 'b', 'c']]
+    ...     done = []
+    ...     for future in futures:
+    ...         future.add_done_callback(lambda f: done.append(f.result()))
+    ...     responses = await asyncio.gather(*futures)
+    ...     await client.close()
+    ...     server.close()
+    ...     await server.wait_closed()
+    ...     return (responses, done)
+    >>> asyncio.run(demo())
+    (['A', 'B', 'C'], ['B', 'C', 'A'])
+
+    """
+    def __init__(self, nstream, max_in_flight=PIPELINE_MAX_IN_FLIGHT, on_latency=None):
+        self.ids = itertools.count(1)
+        super().__init__(nstream, max_in_flight=max_in_flight, on_latency=on_latency)
+
+    async def submit(self, req):
+        """Sends request without waiting for response.
+
+        Waits if `max_in_flight` requests wait for responses.
+
+        Returns
+        -------
+        asyncio.Future
+            Future of response.
+
+        """
+        msg_id = next(self.ids)
+        ns = self.nstream.pack_f((msg_id, RPC_REQUEST, req))
+        await self.window.acquire()
+        if self.error is not None:
+            self.window.release()
+            raise self.error
+        future = _TimedFuture()
+        self.in_flight[msg_id] = (future, time.perf_counter())
+        self.pending.append(ns)
+        self.counters['submitted'] += 1
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self._flush)
+        return future
+
+    async def _read_loop(self):
+        try:
+            while True:
+                msg = await self.nstream.read()
+                if msg is None:
+                    raise NsStreamUnexpectedEnd('Connection is closed, requests in flight:{}'.format(
+                                len(self.in_flight)))
+                (msg_id, kind, body) = msg
+                entry = self.in_flight.pop(msg_id, None)
+                if entry is None:
+                    raise NsMalformed('Unexpected response to unknown request id:{}'.format(msg_id))
+                (future, started) = entry
+                self._record(future, started)
+                self.window.release()
+                if not future.done():
+                    _resolve(future, kind, body)
+        except asyncio.CancelledError:
+            self._fail(NsStreamUnexpectedEnd('Connection is closed'))
+            raise
+        except Exception as e:
+            self._fail(e)
+
+    in_flight_type = dict
+
+    def _in_flight_entries(self):
+        return list(self.in_flight.values())
+
+async def open_rpc(host, port, encode_f=None, decode_f=None, max_len=NS_MAX_LEN,
+            max_in_flight=PIPELINE_MAX_IN_FLIGHT, on_latency=None, **kwargs):
+    """Opens TCP connection and returns AsyncNsRpcClient over it.
+
+    Parameters
+    ----------
+    host, port
+        Server address.
+    encode_f, decode_f, max_len
+        See `make_rpc_packer` and `make_rpc_unpacker`.
+    kwargs
+        Passed to `netstrings.aio.open_connection`.
+
+    Returns
+    -------
+    AsyncNsRpcClient
+
+    """
+    from .aio import open_connection
+    nstream = await open_connection(host, port, pack_f=make_rpc_packer(encode_f, max_len),
+                unpack_f=make_rpc_unpacker(decode_f, max_len), **kwargs)
+    return AsyncNsRpcClient(nstream, max_in_flight=max_in_flight, on_latency=on_latency)
+
+class NsRpcServer:
+    """
+    Multiplexed RPC server, handlers run on thread pool.
+
+    NsReactor thread reads requests of all connections and submits them
+    to executor, responses are written by reactor thread as soon as
+    handlers return, in order of completion. Exception of handler is
+    sent to client as error message.
+
+    Attributes
+    ----------
+    handler
+        Function `handler(obj)` called in worker thread for every request,
+        it returns body of result.
+    reactor : NsReactor
+        Event loop of connections.
+    executor : concurrent.futures.Executor
+        Executor of handlers.
+
+    Methods
+    -------
+    listen(host, port, backlog)
+        Creates listening socket, see `NsReactor.listen`.
+    run(timeout)
+        Serves connections until `stop()`.
+    stop()
+        Stops `run()`.
+    close()
+        Closes sockets and shuts down own executor.
+
+    """
+    def __init__(self, handler, encode_f=None, decode_f=None, max_len=NS_MAX_LEN, executor=None, max_workers=None,
+                **kwargs):
+        self.handler = handler
+        self.own_executor = executor is None
+        self.executor = ThreadPoolExecutor(max_workers) if executor is None else executor
+        self.reactor = NsReactor(self._on_message, pack_f=make_rpc_packer(encode_f, max_len),
+                unpack_f=make_rpc_unpacker(decode_f, max_len), **kwargs)
+
+    def _on_message(self, conn, msg):
+        (msg_id, kind, body) = msg
+        if kind != RPC_REQUEST:
+            conn.close(NsMalformed('Unexpected RPC message kind {!r} of request'.format(kind)))
+            return None
+        future = self.executor.submit(self.handler, body)
+        future.add_done_callback(partial(self._done, conn, msg_id))
+        return None
+
+    def _done(self, conn, msg_id, future):
+        # called in worker thread, response is written by reactor thread
+        self.reactor.call_soon_threadsafe(self._respond, conn, msg_id, future)
+
+    def _respond(self, conn, msg_id, future):
+        if conn.closed:
+            return
+        error = future.exception()
+        if error is None:
+            try:
+                conn.write((msg_id, RPC_RESULT, future.result()))
+                return
+            except Exception as e:
+                # result cannot be packed
+                error = e
+        try:
+            conn.write((msg_id, RPC_ERROR, _error_text(error)))
+        except Exception as e:
+            # exception must not stop reactor, only this connection is closed
+            conn.close(e)
+
+    def listen(self, host, port, **kwargs):
+        """Creates listening socket, see `NsReactor.listen`.
+        """
+        return self.reactor.listen(host, port, **kwargs)
+
+    def run(self, timeout=None):
+        """Serves connections until `stop()` is called.
+        """
+        self.reactor.run(timeout)
+
+    def stop(self):
+        """Stops `run()`.
+        """
+        self.reactor.stop()
+
+    def close(self):
+        """Closes sockets, shuts down executor unless it was passed to constructor.
+        """
+        if self.own_executor:
+            self.executor.shutdown(wait=True)
+        self.reactor.close()
+
+class NsRpcProtocol(NsProtocol):
+    """
+    asyncio Protocol of multiplexed RPC server.
+
+    Every request is handled by its own task, up to `max_queue` requests
+    of connection are handled concurrently, reading from transport is
+    paused above it. Responses are written in order of completion. Tasks
+    of requests are cancelled when connection is lost.
+
+    Attributes
+    ----------
+    handler
+        Coroutine function `handler(obj)` called for every request,
+        it returns body of result. Its exception is sent to client as
+        error message.
+    tasks : set
+        Tasks of requests that are not completed.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tasks = set()
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        for task in list(self.tasks):
+            task.cancel()
+
+    async def _dispatch(self):
+        # starts task for every request
+        running = asyncio.Semaphore(self.max_queue)
+        while True:
+            msg = await self.queue.get()
+            if msg is _EOF:
+                break
+            if self.reading_paused and self.queue.qsize() <= self.max_queue // 2:
+                self.reading_paused = False
+                self.transport.resume_reading()
+            (msg_id, kind, body) = msg
+            if kind != RPC_REQUEST:
+                self.error = NsMalformed('Unexpected RPC message kind {!r} of request'.format(kind))
+                self.transport.close()
+                break
+            await running.acquire()
+            task = asyncio.ensure_future(self._call(running, msg_id, body))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _call(self, running, msg_id, body):
+        try:
+            resp = (msg_id, RPC_RESULT, await self.handler(body))
+        except Exception as e:
+            resp = (msg_id, RPC_ERROR, _error_text(e))
+        finally:
+            running.release()
+        if self.transport.is_closing():
+            return
+        try:
+            self.write(resp)
+        except Exception as e:
+            # result cannot be packed
+            try:
+                self.write((msg_id, RPC_ERROR, _error_text(e)))
+            except Exception as e:
+                self.error = e
+                self.transport.abort()
+                return
+        await self.drain()
+
+async def serve_rpc(handler, host, port, encode_f=None, decode_f=None, max_len=NS_MAX_LEN,
+            max_queue=SERVER_MAX_QUEUE, **kwargs):
+    """Starts multiplexed RPC server in running event loop.
+
+    Parameters
+    ----------
+    handler
+        Coroutine function `handler(obj)`, see NsRpcProtocol.
+    host, port
+        Address to listen on.
+    encode_f, decode_f, max_len
+        See `make_rpc_packer` and `make_rpc_unpacker`.
+    max_queue : int
+        Maximum number of concurrent requests of connection.
+    kwargs
+        Passed to `loop.create_server`.
+
+    Returns
+    -------
+    asyncio.Server
+
+    """
+    pack_f = make_rpc_packer(encode_f, max_len)
+    unpack_f = make_rpc_unpacker(decode_f, max_len)
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: NsRpcProtocol(handler, pack_f=pack_f, unpack_f=unpack_f,
+                max_queue=max_queue), host, port, **kwargs)
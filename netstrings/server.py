@@ -0,0 +1,250 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+asyncio server framework for netstrings.
+
+NsProtocol is asyncio.Protocol for `loop.create_server`. Received chunks are
+fed to incremental decoder, complete netstrings are unpacked and dispatched
+to async handler. All connections are served by single event loop, without
+thread per connection.
+
+    async def handler(conn, obj):
+        # returned object is packed and sent back, None means no response
+        return obj
+
+    server = await serve(handler, '127.0.0.1', 9000)
+    await server.serve_forever()
+"""
+
+import asyncio
+
+from .netstrings import NsDecoder, pack_str_strict, unpack_str_strict
+
+# Default number of unpacked objects waiting for handler,
+# NsProtocol pauses reading from transport when it is reached.
+SERVER_MAX_QUEUE = 64
+
+# end of connection mark for dispatcher queue
+_EOF = object()
+
+class NsProtocol(asyncio.Protocol):
+    """
+    asyncio Protocol of netstrings server.
+
+    Objects are passed to `handler` in order of arrival, one by one for
+    every connection. Reading from transport is paused when
+    `max_queue` objects are waiting for handler.
+
+    Attributes
+    ----------
+    handler
+        Coroutine function `handler(conn, obj)`, where `conn` is this
+        NsProtocol instance and `obj` is unpacked object. Object returned
+        by handler is packed and written to connection unless it is None.
+    pack_f
+        Packer function, see `NsStream`.
+    unpack_f
+        Unpacker function, see `NsStream`.
+    max_queue : int
+        Maximum number of objects waiting for handler.
+    transport : asyncio.Transport
+        Connection transport.
+    peername : tuple
+        Remote address.
+    error : Exception or None
+        Exception that closed connection: malformed netstring, exception
+        raised by `unpack_f` or by handler.
+
+    Methods
+    -------
+    write(obj)
+        Packs object and writes it to transport.
+    drain()
+        Coroutine, waits while transport write buffer is full, any number
+        of tasks can wait.
+    close()
+        Closes connection.
+
+    >>> async def demo():
+    ...     async def handler(conn, obj):
+    ...         return obj.upper()
+    ...     server = await serve(handler, '127.0.0.1', 0)
+    ...     port = server.sockets[0].getsockname()[1]
+    ...     (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+    ...     writer.write(b'3:abc,')
+    ...     resp = await reader.readexactly(6)
+    ...     writer.close()
+    ...     server.close()
+    ...     await server.wait_closed()
+    ...     return resp
+    >>> asyncio.run(demo())
+    b'3:ABC,'
+
+    """
+    def __init__(self, handler, pack_f=pack_str_strict, unpack_f=unpack_str_strict, max_queue=SERVER_MAX_QUEUE):
+        self.handler = handler
+        self.pack_f = pack_f
+        self.unpack_f = unpack_f
+        self.max_queue = max_queue
+        self.transport = None
+        self.peername = None
+        self.error = None
+        self.buff = b''
+        if hasattr(unpack_f, 'decode_f'):
+            self.decoder = NsDecoder(max_len=unpack_f.max_len)
+            self.decode_f = unpack_f.decode_f
+        else:
+            self.decoder = None
+            self.decode_f = None
+        self.queue = None
+        self.task = None
+        self.reading_paused = False
+        self.writing_paused = False
+        # futures of tasks waiting in drain(), all are released at once
+        self.drain_waiters = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peername = transport.get_extra_info('peername')
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._dispatch())
+
+    def data_received(self, data):
+        try:
+            for obj in self._unpack(data):
+                self.queue.put_nowait(obj)
+        except Exception as e:
+            # malformed netstring or decode_f failure
+            self.error = e
+            self.transport.abort()
+            return
+        if self.queue.qsize() >= self.max_queue and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    def _unpack(self, data):
+        # unpacks all complete netstrings received so far
+        objs = []
+        if self.decoder is not None:
+            self.decoder.feed(data)
+            decode_f = self.decode_f
+            for payload in self.decoder:
+                objs.append(decode_f(payload) if decode_f is not None else payload)
+        else:
+            self.buff += data
+            (obj, tail) = self.unpack_f(self.buff)
+            while obj is not None:
+                objs.append(obj)
+                self.buff = tail
+                (obj, tail) = self.unpack_f(self.buff)
+        return objs
+
+    def connection_lost(self, exc):
+        if self.queue is not None:
+            self.queue.put_nowait(_EOF)
+        self._release_drain_waiters()
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self._release_drain_waiters()
+
+    def _release_drain_waiters(self):
+        (waiters, self.drain_waiters) = (self.drain_waiters, [])
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _dispatch(self):
+        # calls handler for objects in order of arrival
+        while True:
+            obj = await self.queue.get()
+            if obj is _EOF:
+                break
+            if self.reading_paused and self.queue.qsize() <= self.max_queue // 2:
+                self.reading_paused = False
+                self.transport.resume_reading()
+            try:
+                resp = await self.handler(self, obj)
+                if resp is not None and not self.transport.is_closing():
+                    self.write(resp)
+                    await self.drain()
+            except Exception as e:
+                self.error = e
+                self.transport.close()
+                break
+
+    def write(self, obj):
+        """Packs object using `pack_f` and writes it to transport.
+
+        Returns
+        -------
+        int
+            Number of written bytes.
+
+        """
+        ns = self.pack_f(obj)
+        self.transport.write(ns)
+        return len(ns)
+
+    async def drain(self):
+        """Waits while transport write buffer is above high-water mark.
+
+        All waiting tasks are resumed by `resume_writing()` or when
+        connection is lost.
+
+        >>> class Transport(asyncio.Transport):
+        ...     def is_closing(self):
+        ...         return False
+        >>> async def demo():
+        ...     conn = NsProtocol(None)
+        ...     conn.connection_made(Transport())
+        ...     conn.pause_writing()
+        ...     tasks = [asyncio.ensure_future(conn.drain()) for i in range(3)]
+        ...     await asyncio.sleep(0)
+        ...     conn.resume_writing()
+        ...     await asyncio.sleep(0)
+        ...     conn.connection_lost(None)
+        ...     return [task.done() for task in tasks]
+        >>> asyncio.run(demo())
+        [True, True, True]
+
+        """
+        if self.writing_paused and not self.transport.is_closing():
+            waiter = asyncio.get_running_loop().create_future()
+            self.drain_waiters.append(waiter)
+            await waiter
+
+    def close(self):
+        """Closes connection.
+        """
+        self.transport.close()
+
+async def serve(handler, host, port, pack_f=pack_str_strict, unpack_f=unpack_str_strict, max_queue=SERVER_MAX_QUEUE, **kwargs):
+    """Starts netstrings server in running event loop.
+
+    Parameters
+    ----------
+    handler
+        Coroutine function `handler(conn, obj)`, see `NsProtocol`.
+    host, port
+        Address to listen on.
+    pack_f, unpack_f
+        Packer and unpacker functions, see `NsStream`.
+    max_queue : int
+        See `NsProtocol`.
+    kwargs
+        Passed to `loop.create_server`.
+
+    Returns
+    -------
+    asyncio.Server
+
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(
+            lambda: NsProtocol(handler, pack_f=pack_f, unpack_f=unpack_f, max_queue=max_queue),
+            host, port, **kwargs)
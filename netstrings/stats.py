@@ -0,0 +1,385 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+
+"""
+Instrumentation of NsStream: counters, histograms and process-wide registry.
+
+Instrumented NsStream counts bytes, frames and operations on `fd`, time
+spent in `fd` reads and writes, in netstring framing and in `pack_f`
+and `unpack_f`, and keeps log2 histograms of frame sizes and of packing
+and unpacking time. NsStream without instrumentation only checks that
+its `instr` is None.
+
+    nstream = NsStream(fd, instrument=True)
+    ...
+    nstream.stats()
+    REGISTRY.snapshot()    # all instrumented streams of process
+
+    set_instrument_default(True)    # instrument all new NsStreams
+
+>>> from io import BytesIO
+>>> b_stream = BytesIO()
+>>> nstream = NsStream(b_stream, instrument=True)
+>>> nstream.write_many(['abc', 'de'])
+11
+>>> pos = b_stream.seek(0)
+>>> list(nstream)
+['abc', 'de']
+>>> s = nstream.stats()
+>>> (s['frames_out'], s['bytes_out'], s['frames_in'], s['bytes_in'], s['buff_hwm'])
+(2, 11, 2, 11, 11)
+>>> s['frame_size_in']['buckets']
+{'8': 2}
+"""
+
+import threading
+import weakref
+
+from .netstrings import NsStream
+
+# Number of log2 buckets of Histogram, bucket i counts values
+# in [2 ** (i - 1), 2 ** i), bucket 0 counts zeros
+HISTOGRAM_BUCKETS = 65
+
+# Time histograms count nanoseconds
+TIME_SCALE = 1e9
+
+def set_instrument_default(enabled):
+    """Instruments all NsStreams created without explicit `instrument` argument.
+
+    Parameters
+    ----------
+    enabled : bool
+        New default.
+
+    """
+    NsStream.instrument_default = bool(enabled)
+
+def instrument_default():
+    """Returns default of NsStream `instrument` argument, see `set_instrument_default`.
+    """
+    return NsStream.instrument_default
+
+class Histogram:
+    """
+    Histogram with log2 buckets.
+
+    Adding a value costs one `int.bit_length()`, percentiles are upper
+    bounds of buckets, so they are exact to within factor of 2.
+
+    Attributes
+    ----------
+    scale : float
+        Values are multiplied by `scale` before bucketing,
+        e.g. TIME_SCALE for seconds.
+    buckets : list of int
+        Counts of values in log2 buckets.
+    count : int
+        Number of values.
+    total : float
+        Sum of values.
+    max : float
+        Maximum value.
+
+    >>> h = Histogram()
+    >>> for x in [0, 1, 3, 100, 1000]:
+    ...     h.add(x)
+    >>> (h.count, h.total, h.max)
+    (5, 1104, 1000)
+    >>> (h.percentile(50), h.percentile(99))
+    (4, 1024)
+    >>> h.snapshot()['buckets']
+    {'0': 1, '2': 1, '4': 1, '128': 1, '1024': 1}
+
+    """
+    __slots__ = ('scale', 'buckets', 'count', 'total', 'max')
+
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, x):
+        """Counts value.
+        """
+        self.buckets[int(x * self.scale).bit_length()] += 1
+        self.count += 1
+        self.total += x
+        if x > self.max:
+            self.max = x
+
+    def percentile(self, q):
+        """Upper bound of bucket of percentile `q` (0-100), in units of values.
+        """
+        if not self.count:
+            return 0
+        rank = q * self.count / 100
+        n = 0
+        for (i, k) in enumerate(self.buckets):
+            n += k
+            if k and n >= rank:
+                return self._bound(i)
+        return self._bound(len(self.buckets) - 1)
+
+    def _bound(self, i):
+        bound = (1 << i) if i else 0
+        return bound if self.scale == 1 else bound / self.scale
+
+    def merge(self, other):
+        """Adds counts of other histogram with the same scale.
+        """
+        for (i, k) in enumerate(other.buckets):
+            self.buckets[i] += k
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def snapshot(self):
+        """Histogram as dict.
+
+        Returns
+        -------
+        dict
+            Keys: count, total, mean, max, p50, p90, p99, buckets (counts
+            of non-empty buckets by their upper bounds, keys are str so
+            snapshot can be dumped to JSON).
+
+        """
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': {str(self._bound(i)): k for (i, k) in enumerate(self.buckets) if k},
+        }
+
+# counters of NsStreamStats
+_COUNTERS = ('bytes_in', 'bytes_out', 'frames_in', 'frames_out', 'reads', 'writes',
+             'read_time', 'write_time', 'framing_time', 'buff_hwm')
+
+# histograms of NsStreamStats and their scales
+_HISTOGRAMS = (('frame_size_in', 1), ('frame_size_out', 1), ('pack_time', TIME_SCALE), ('unpack_time', TIME_SCALE))
+
+class NsStreamStats:
+    """
+    Counters and histograms of instrumented NsStream.
+
+    Can be shared by many streams, e.g. all connections of server, but
+    updates are not locked: streams of different threads should have their
+    own NsStreamStats, registry sums them.
+
+    Attributes
+    ----------
+    name : str
+        Name in registry snapshots.
+    bytes_in, bytes_out : int
+        Bytes read from and written to `fd`.
+    frames_in, frames_out : int
+        Netstrings read and written.
+    reads, writes : int
+        Read and write operations on `fd`.
+    read_time, write_time : float
+        Seconds spent in read and write operations on `fd`.
+    framing_time : float
+        Seconds spent in parsing of netstrings, excluding `decode_f`.
+    buff_hwm : int
+        High-water mark of received bytes that are not consumed yet.
+    frame_size_in, frame_size_out : Histogram
+        Netstring sizes, bytes.
+    pack_time, unpack_time : Histogram
+        Seconds spent in `pack_f` (or `encode_f`) and `unpack_f`
+        (or `decode_f`) per netstring.
+
+    >>> s = NsStreamStats('demo')
+    >>> s.on_read(100, 0.001)
+    >>> s.on_frame_in(50, 0.000002)
+    >>> snapshot = s.snapshot()
+    >>> (snapshot['bytes_in'], snapshot['avg_read_size'], snapshot['frames_in'])
+    (100, 100.0, 1)
+    >>> snapshot['unpack_time']['count']
+    1
+
+    """
+    __slots__ = ('name',) + _COUNTERS + tuple([name for (name, scale) in _HISTOGRAMS]) + ('__weakref__',)
+
+    def __init__(self, name=None):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        """Sets all counters to zero.
+        """
+        for name in _COUNTERS:
+            setattr(self, name, 0)
+        for (name, scale) in _HISTOGRAMS:
+            setattr(self, name, Histogram(scale))
+
+    def on_read(self, nbytes, seconds):
+        """Counts read operation on `fd`.
+        """
+        self.reads += 1
+        self.bytes_in += nbytes
+        self.read_time += seconds
+
+    def on_write(self, nbytes, seconds):
+        """Counts write operation on `fd`, vectored write is one operation.
+        """
+        self.writes += 1
+        self.bytes_out += nbytes
+        self.write_time += seconds
+
+    def on_buffer(self, nbytes):
+        """Updates high-water mark of receive buffer.
+        """
+        if nbytes > self.buff_hwm:
+            self.buff_hwm = nbytes
+
+    def on_frame_in(self, size, seconds=None):
+        """Counts netstring that was read, `seconds` of `unpack_f` if it was called.
+        """
+        self.frames_in += 1
+        self.frame_size_in.add(size)
+        if seconds is not None:
+            self.unpack_time.add(seconds)
+
+    def on_frame_out(self, size, seconds=None):
+        """Counts netstring that was written, `seconds` of `pack_f` if it was called.
+        """
+        self.frames_out += 1
+        self.frame_size_out.add(size)
+        if seconds is not None:
+            self.pack_time.add(seconds)
+
+    def merge(self, other):
+        """Adds counters and histograms of other stats, high-water mark is maximum.
+        """
+        for name in _COUNTERS:
+            if name == 'buff_hwm':
+                self.buff_hwm = max(self.buff_hwm, other.buff_hwm)
+            else:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+        for (name, scale) in _HISTOGRAMS:
+            getattr(self, name).merge(getattr(other, name))
+
+    def snapshot(self):
+        """Counters and histograms as dict that can be dumped to JSON.
+
+        Returns
+        -------
+        dict
+            Keys: name, counters (see attributes), avg_read_size,
+            avg_write_size and snapshots of histograms, see
+            `Histogram.snapshot`.
+
+        """
+        snapshot = {'name': self.name}
+        for name in _COUNTERS:
+            snapshot[name] = getattr(self, name)
+        snapshot['avg_read_size'] = self.bytes_in / self.reads if self.reads else 0.0
+        snapshot['avg_write_size'] = self.bytes_out / self.writes if self.writes else 0.0
+        for (name, scale) in _HISTOGRAMS:
+            snapshot[name] = getattr(self, name).snapshot()
+        return snapshot
+
+class NsStatsRegistry:
+    """
+    Thread-safe registry of NsStreamStats of live streams.
+
+    Streams are referenced weakly: when all streams of NsStreamStats are
+    garbage collected, its counters are added to `retired`, so totals
+    never decrease.
+
+    Methods
+    -------
+    register(stats, owner)
+        Adds stats of stream `owner`.
+    snapshot()
+        Snapshots of live stats and totals.
+    total()
+        NsStreamStats with sum of live and retired stats.
+
+    >>> registry = NsStatsRegistry()
+    >>> class Owner:
+    ...     pass
+    >>> owner = Owner()
+    >>> stats = registry.register(NsStreamStats('a'), owner)
+    >>> stats.on_write(10, 0.0)
+    >>> [s['name'] for s in registry.snapshot()['streams']]
+    ['a']
+    >>> del owner
+    >>> import gc
+    >>> n = gc.collect()
+    >>> snapshot = registry.snapshot()
+    >>> (snapshot['streams'], snapshot['total']['bytes_out'])
+    ([], 10)
+
+    """
+    def __init__(self):
+        # finalizers of garbage collected owners can be called
+        # by the thread that holds the lock
+        self.lock = threading.RLock()
+        # id(stats) -> [stats, number of live owners]
+        self.live = {}
+        self.retired = NsStreamStats('retired')
+
+    def register(self, stats, owner):
+        """Adds stats of stream, it is removed when `owner` is garbage collected.
+
+        Returns
+        -------
+        NsStreamStats
+            `stats`
+        """
+        with self.lock:
+            entry = self.live.get(id(stats))
+            if entry is None:
+                self.live[id(stats)] = [stats, 1]
+            else:
+                entry[1] += 1
+        weakref.finalize(owner, self._release, stats)
+        return stats
+
+    def _release(self, stats):
+        with self.lock:
+            entry = self.live.get(id(stats))
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.live[id(stats)]
+                self.retired.merge(stats)
+
+    def total(self):
+        """Sum of live and retired stats.
+
+        Returns
+        -------
+        NsStreamStats
+        """
+        with self.lock:
+            total = NsStreamStats('total')
+            total.merge(self.retired)
+            for (stats, owners) in self.live.values():
+                total.merge(stats)
+        return total
+
+    def snapshot(self):
+        """Snapshots of stats of live streams and totals, for scraping.
+
+        Returns
+        -------
+        dict
+            Keys: streams (list of `NsStreamStats.snapshot()`), total.
+
+        """
+        with self.lock:
+            streams = [stats.snapshot() for (stats, owners) in self.live.values()]
+        return {'streams': streams, 'total': self.total().snapshot()}
+
+# Process-wide registry of instrumented NsStreams
+REGISTRY = NsStatsRegistry()
@@ -0,0 +1,61 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+"""
+asyncio Echo server for netstrings, single thread for all connections.
+Compare with multithread server_echo_stream_delay.py.
+
+python server_echo_ns_async.py max_delay
+
+max_delay -- seconds, server will use [0 .. delay_max] inteval for random delays
+       of every response, if this parametr is 0 server will not perform delays.
+"""
+
+import asyncio
+import random
+import sys
+
+import netstrings as ns
+from netstrings.server import serve
+
+SERVER_ADDR = '127.0.0.1'
+SERVER_TCP_PORT = 9000 
+MAX_BACKLOG = 1024
+
+def make_echo_handler(max_delay):
+    async def echo(conn, payload):
+        print('req from {}:{} (len:{})\n  {!r}'.format(
+                conn.peername[0],
+                conn.peername[1],
+                len(payload),
+                payload))
+        if max_delay != 0:
+            await asyncio.sleep(random.randint(0, max_delay))
+        return payload
+    return echo
+
+async def main(max_delay):
+    # payloads are echoed as bytes, so any netstring is accepted
+    server = await serve(make_echo_handler(max_delay), SERVER_ADDR, SERVER_TCP_PORT,
+            pack_f=ns.make_packer(), unpack_f=ns.make_unpacker(),
+            reuse_address=True, backlog=MAX_BACKLOG)
+    local_addr = server.sockets[0].getsockname()
+    print('Listening on {}:{}'.format(local_addr[0], local_addr[1]))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    print('Starting ...<Ctrl-C> to stop.')
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    else:
+        max_delay = int(sys.argv[1])
+        if  max_delay < 0 :
+            print(__doc__)
+            sys.exit(1)
+    try:
+        asyncio.run(main(max_delay))
+    except KeyboardInterrupt:
+        print ('Stopping ...')
+        sys.exit(1)
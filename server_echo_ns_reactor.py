@@ -0,0 +1,46 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+"""
+selectors (epoll) Echo server for netstrings, single thread for all
+connections without asyncio.
+Compare with multithread server_echo_stream_delay.py.
+
+python server_echo_ns_reactor.py
+"""
+
+import sys
+
+import netstrings as ns
+from netstrings.reactor import NsReactor
+
+SERVER_ADDR = '127.0.0.1'
+SERVER_TCP_PORT = 9000 
+
+def on_connect(conn):
+    print('Accepted conection from {}:{}'.format(conn.addr[0], conn.addr[1]))
+
+def on_message(conn, payload):
+    print('req from {}:{} (len:{})\n  {!r}'.format(
+            conn.addr[0],
+            conn.addr[1],
+            len(payload),
+            payload))
+    # echo
+    return payload
+
+
+if __name__ == '__main__':
+    print('Starting ...<Ctrl-C> to stop.')
+    # payloads are echoed as bytes, so any netstring is accepted
+    reactor = NsReactor(on_message,
+            pack_f=ns.make_packer(), unpack_f=ns.make_unpacker(),
+            on_connect=on_connect)
+    server_sock = reactor.listen(SERVER_ADDR, SERVER_TCP_PORT)
+    local_addr = server_sock.getsockname()
+    print('Listening on {}:{}'.format(local_addr[0], local_addr[1]))
+    try:
+        reactor.run()
+    except KeyboardInterrupt:
+        print ('Stopping ...')
+        reactor.close()
+        sys.exit(1)
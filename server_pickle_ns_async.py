@@ -0,0 +1,45 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+"""
+asyncio server for receive 
+pickled objects over netstrings, single thread for all connections.
+Prints received object to console.
+Compare with multithread server_pickle_ns.py.
+
+python server_pickle_ns_async.py 
+"""
+import asyncio
+import sys
+
+from netstrings.server import serve
+# pack and unpack defined in threaded server file
+from server_pickle_ns import make_pickle_packer, make_pickle_unpacker
+
+SERVER_ADDR = '127.0.0.1'
+SERVER_TCP_PORT = 9000 
+MAX_BACKLOG = 1024
+
+async def print_handler(conn, data):
+    print('req from {}:{}\n  {!r}'.format(
+        conn.peername[0], 
+        conn.peername[1], 
+        data))
+
+async def main():
+    server = await serve(print_handler, SERVER_ADDR, SERVER_TCP_PORT,
+            pack_f=make_pickle_packer(),
+            unpack_f=make_pickle_unpacker(),
+            reuse_address=True, backlog=MAX_BACKLOG)
+    local_addr = server.sockets[0].getsockname()
+    print('Listening on {}:{}'.format(local_addr[0], local_addr[1]))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    print('Starting ...<Ctrl-C> to stop.')
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print ('Stopping ...')
+        sys.exit(1)
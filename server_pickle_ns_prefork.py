@@ -0,0 +1,41 @@
+#fileencoding=utf-8
+#!/usr/bin/env python3
+"""
+Multiprocess server for receive 
+pickled objects over netstrings.
+Worker processes share port with SO_REUSEPORT, so unpickling is spread
+between CPU cores. Prints received object to console.
+Compare with multithread server_pickle_ns.py.
+
+python server_pickle_ns_prefork.py [workers]
+"""
+import os
+import sys
+
+from netstrings.prefork import NsPreforkServer
+# pack and unpack defined in threaded server file
+from server_pickle_ns import make_pickle_packer, make_pickle_unpacker
+
+SERVER_ADDR = '127.0.0.1'
+SERVER_TCP_PORT = 9000 
+
+def print_message(conn, data):
+    print('req from {}:{} (PID:{})\n  {!r}'.format(
+        conn.addr[0], 
+        conn.addr[1], 
+        os.getpid(),
+        data))
+
+
+if __name__ == '__main__':
+    print('Starting ...<Ctrl-C> to stop.')
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    server = NsPreforkServer(print_message, SERVER_ADDR, SERVER_TCP_PORT,
+            workers=workers,
+            pack_f=make_pickle_packer(),
+            unpack_f=make_pickle_unpacker())
+    print('Listening on {}:{}, workers: {}'.format(SERVER_ADDR, SERVER_TCP_PORT, workers))
+    stats = server.serve_forever()
+    print ('Stopping ...')
+    for s in stats:
+        print(s)